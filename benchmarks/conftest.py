@@ -0,0 +1,99 @@
+import os
+import tracemalloc
+from os.path import abspath, dirname, isdir, join
+import pytest
+from bokeh.application import Application
+from bokeh.application.handlers import DirectoryHandler
+from water.modules.load_data import DATA_DIR, get_network_examples
+from water.modules.synthetic import write_synthetic_network
+
+WATER_DIR = abspath(join(dirname(__file__), '..', 'water'))
+
+# The example networks, benchmarks of examples without their data files
+# (the git submodules haven't been cloned) are skipped
+EXAMPLE_NETWORKS = ['ky2', 'ky4', 'ky8', 'ky9', 'ky14']
+
+# Number of junctions of the synthetic networks benchmarked by default
+DEFAULT_SYNTHETIC_NODES = '1000,10000'
+
+# Prefix of the synthetic networks, which are written to a temporary data
+# directory, alongside the examples of water/data
+SYNTHETIC_PREFIX = 'benchmark-synthetic-'
+
+# Number of pollution scenarios of each synthetic network
+SYNTHETIC_SCENARIOS = 3
+
+
+def pytest_addoption(parser):
+    parser.addoption('--synthetic-nodes', default=DEFAULT_SYNTHETIC_NODES,
+                     help="Comma separated sizes, in junctions, of the "
+                     "synthetic networks to benchmark. Empty for none.")
+
+
+def pytest_generate_tests(metafunc):
+    if 'network' in metafunc.fixturenames:
+        sizes = [int(size) for size in
+                 metafunc.config.getoption('synthetic_nodes').split(',')
+                 if size.strip()]
+        networks = EXAMPLE_NETWORKS + [SYNTHETIC_PREFIX + str(size)
+                                       for size in sizes]
+        metafunc.parametrize('network', networks, indirect=True)
+
+
+@pytest.fixture(scope='session')
+def data_dir(tmp_path_factory):
+    """A temporary data directory, used in place of water/data by the
+    benchmarks and the app, holding the synthetic networks and linking to
+    the examples of water/data"""
+    data_dir = str(tmp_path_factory.mktemp('data'))
+    os.symlink(join(DATA_DIR, 'examples'), join(data_dir, 'examples'))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr('water.modules.load_data.DATA_DIR', data_dir)
+        # Read by the app's own copy of the modules when it is imported
+        monkeypatch.setenv('WATER_DATA_DIR', data_dir)
+        yield data_dir
+
+
+@pytest.fixture(scope='session')
+def network(request, data_dir):
+    """The name of a network to benchmark, examples are skipped if their
+    data is missing and synthetic networks are created on first use"""
+    network = request.param
+    if network in EXAMPLE_NETWORKS:
+        if network not in get_network_examples() or not isdir(
+                join(data_dir, 'examples', network, network)):
+            pytest.skip("Example network " + network + " isn't available")
+    else:
+        write_synthetic_network(
+            network, int(network[len(SYNTHETIC_PREFIX):]),
+            scenarios=SYNTHETIC_SCENARIOS, data_dir=data_dir)
+    return network
+
+
+@pytest.fixture
+def peak_memory(benchmark):
+    """Record the peak memory allocated by one call of a function in the
+    benchmark results"""
+    def measure(function, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            function(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['peak_memory_bytes'] = peak
+        return peak
+
+    return measure
+
+
+@pytest.fixture(scope='session')
+def document(network):
+    """A document of the bokeh app, created without a server or browser,
+    once the network to benchmark is available"""
+    handler = DirectoryHandler(filename=WATER_DIR)
+    document = Application(handler).create_document()
+    if handler.failed:
+        raise RuntimeError("The app failed to start:\n"
+                           + handler.error_detail)
+    return document
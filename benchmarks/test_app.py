@@ -0,0 +1,77 @@
+import sys
+import time
+from itertools import cycle
+import pytest
+from bokeh.models import AutocompleteInput, Select, Slider
+from bokeh.server.callbacks import NextTickCallback
+
+# Longest time in seconds to wait for a network to load
+LOAD_TIMEOUT = 600
+
+
+def widget(document, widget_type, title):
+    """Find a widget of the app by its title"""
+    return [model for model in document.select({'type': widget_type})
+            if model.title == title][0]
+
+
+def launch(document, network):
+    """Load a network into the app, as the network selector does. The
+    network is loaded in a worker thread and launched on the next tick,
+    which is run here as the document has no server"""
+    network_select = widget(document, Select, "Choose Water Network")
+    network_select.trigger('value', network_select.value, network)
+    deadline = time.monotonic() + LOAD_TIMEOUT
+    while True:
+        callbacks = [callback for callback in document.session_callbacks
+                     if isinstance(callback, NextTickCallback)]
+        if callbacks:
+            break
+        if time.monotonic() > deadline:
+            raise RuntimeError("Timed out loading " + network)
+        time.sleep(0.001)
+    for callback in callbacks:
+        callback.callback()
+
+
+@pytest.fixture
+def app(document, network):
+    """The app document with the network loaded"""
+    launch(document, network)
+    return document
+
+
+def test_launch(benchmark, peak_memory, document, network):
+    # Clear the network data shared between sessions, so the peak memory
+    # is that of loading the network for the first time. The timed
+    # launches reuse the shared data, like every session after the first.
+    sys.modules['modules.cache'].network_cache.clear()
+    peak_memory(launch, document, network)
+    benchmark(launch, document, network)
+
+
+def test_switch_injection(benchmark, peak_memory, app, network):
+    injection_input = widget(app, AutocompleteInput,
+                             "Pollution Injection Node")
+    injection_nodes = sys.modules['modules.cache'].cached_pollution_dynamics(
+        network)[1]
+    injections = cycle(injection_nodes[:2])
+
+    def switch():
+        injection_input.value = next(injections)
+
+    peak_memory(switch)
+    benchmark(switch)
+
+
+def test_update(benchmark, peak_memory, app):
+    # Each change of the time slider draws one frame of the animation
+    time_slider = widget(app, Slider, "Time (s)")
+    timesteps = cycle([time_slider.value + time_slider.step,
+                       time_slider.value])
+
+    def update():
+        time_slider.value = next(timesteps)
+
+    peak_memory(update)
+    benchmark(update)
@@ -0,0 +1,42 @@
+from water.modules.load_data import (get_network_files_path,
+                                     preprocess_water_network,
+                                     load_water_network,
+                                     load_pollution_dynamics)
+from water.modules.pollution import pollution_scenario, pollution_series
+
+
+def test_preprocess_water_network(benchmark, peak_memory, network):
+    filename = get_network_files_path(network) + '/' + network + '.inp'
+    peak_memory(preprocess_water_network, filename)
+    benchmark(preprocess_water_network, filename)
+
+
+def test_load_water_network(benchmark, peak_memory, network):
+    # The first call writes the preprocessed network cache file, which the
+    # timed calls read
+    peak_memory(load_water_network, network)
+    benchmark(load_water_network, network)
+
+
+def test_load_pollution_dynamics(benchmark, peak_memory, network):
+    peak_memory(load_pollution_dynamics, network)
+    benchmark(load_pollution_dynamics, network)
+
+
+def test_read_scenario(benchmark, peak_memory, network):
+    def read():
+        # A new store each time, so that the scenario is read from disk
+        pollution, _, start_node, *_ = load_pollution_dynamics(network)
+        return pollution_scenario(pollution, start_node)
+
+    peak_memory(read)
+    benchmark(read)
+
+
+def test_pollution_series(benchmark, peak_memory, network):
+    pollution, _, start_node, start, end, *_ = load_pollution_dynamics(
+        network)
+    scenario = pollution_scenario(pollution, start_node)
+    timestep = scenario.index[len(scenario.index) // 2]
+    peak_memory(pollution_series, scenario, timestep)
+    benchmark(pollution_series, scenario, timestep)
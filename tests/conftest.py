@@ -1,5 +1,6 @@
 import pytest
 from water.modules.load_data import load_pollution_dynamics
+from water.modules.synthetic import write_synthetic_network
 
 
 @pytest.fixture(scope='session')
@@ -7,3 +8,57 @@ def pollution_data():
 
     pollution, *_ = load_pollution_dynamics('ky2')
     return pollution
+
+
+@pytest.fixture
+def small_network_inp(tmp_path):
+    """The path of a .inp file of a network with two junctions fed by a
+    reservoir"""
+    inp_file = tmp_path / 'small.inp'
+    inp_file.write_text(SMALL_NETWORK_INP)
+    return str(inp_file)
+
+
+@pytest.fixture(scope='session')
+def synthetic_data_dir(tmp_path_factory):
+    """A data directory, in place of water/data, holding a synthetic network
+    of 100 junctions and 3 pollution scenarios and no examples"""
+    data_dir = tmp_path_factory.mktemp('data')
+    (data_dir / 'examples').mkdir()
+    write_synthetic_network('test-synthetic', 100, scenarios=3,
+                            data_dir=str(data_dir))
+    return str(data_dir)
+
+
+@pytest.fixture
+def synthetic_network(synthetic_data_dir, monkeypatch):
+    """The name of the synthetic network, with the networks read from
+    synthetic_data_dir during the test"""
+    monkeypatch.setattr('water.modules.load_data.DATA_DIR',
+                        synthetic_data_dir)
+    return 'test-synthetic'
+
+
+SMALL_NETWORK_INP = """
+[JUNCTIONS]
+J-1  5  2
+J-2  4  4
+
+[RESERVOIRS]
+R-1  20
+
+[PIPES]
+P-1  R-1  J-1  100  12  100  0  Open
+P-2  J-1  J-2  100  12  100  0  Open
+
+[OPTIONS]
+Units  LPS
+Headloss  H-W
+
+[COORDINATES]
+J-1  1  0
+J-2  2  0
+R-1  0  0
+
+[END]
+"""
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+from water.modules.analytics import (MEASURES, PollutionAnalytics,
+                                     scenario_analytics)
+from water.modules.cache import (cached_pollution_analytics,
+                                 cached_scenario_analytics)
+from water.modules.load_data import load_pollution_dynamics
+
+TIMESTEPS = np.array([0, 300, 600, 900])
+# Pollution reaches the first node at 300s and the second at 600s, and
+# never reaches the third
+VALUES = np.array([[0.0, 0.0, 0.0],
+                   [2.0, 0.0, 0.0],
+                   [4.0, 1.0, 0.001],
+                   [0.0, 3.0, 0.0]])
+
+
+def test_scenario_analytics():
+    results = scenario_analytics(VALUES, TIMESTEPS)
+    assert list(results['arrival']) == [300, 600, np.inf]
+    assert list(results['peak']) == [4.0, 3.0, 0.001]
+    assert list(results['time_to_peak']) == [300, 600, np.inf]
+    # (0 + 2) / 2 * 300 + (2 + 4) / 2 * 300 + (4 + 0) / 2 * 300
+    assert results['exposure'][0] == 1800.0
+
+
+def test_scenario_analytics_threshold():
+    results = scenario_analytics(VALUES, TIMESTEPS, threshold=1.5)
+    assert list(results['arrival']) == [300, 900, np.inf]
+
+
+def test_scenario_analytics_several_scenarios():
+    values = np.stack([VALUES, VALUES[:, ::-1]])
+    results = scenario_analytics(values, TIMESTEPS)
+    assert results['arrival'].shape == (2, 3)
+    assert list(results['arrival'][1]) == [np.inf, 600, 300]
+    assert np.array_equal(results['exposure'][1],
+                          scenario_analytics(VALUES, TIMESTEPS)['exposure']
+                          [::-1])
+
+
+def test_pollution_analytics_graph_order():
+    pollution = {'J-1': pd.DataFrame(VALUES, index=TIMESTEPS,
+                                     columns=['J-1', 'J-2', 'J-3'])}
+    analytics = PollutionAnalytics(pollution, ['J-1'], ['J-3', 'J-1', 'J-2'])
+    assert analytics.arrival.shape == (1, 3)
+    assert list(analytics.scenario('J-1')['peak']) == [0.001, 4.0, 3.0]
+
+
+def test_cached_pollution_analytics(synthetic_network):
+    pollution, injection_nodes, *_ = load_pollution_dynamics(
+        synthetic_network)
+    analytics = cached_pollution_analytics(synthetic_network)
+    assert analytics.injection_nodes == injection_nodes
+    # Pollution reaches the injection node first
+    injection = injection_nodes[0]
+    results = analytics.scenario(injection)
+    position = analytics.nodes.index(injection)
+    assert results['arrival'][position] == np.nanmin(results['arrival'])
+    # The analytics of one scenario agree with those of the whole network
+    for measure, values in cached_scenario_analytics(
+            synthetic_network, injection_nodes[1]).items():
+        np.testing.assert_allclose(
+            values, analytics.scenario(injection_nodes[1])[measure])
+
+
+def test_pollution_analytics_processes(synthetic_network, monkeypatch):
+    pollution, injection_nodes, *_ = load_pollution_dynamics(
+        synthetic_network)
+    nodes = list(pollution[injection_nodes[0]].columns)
+    serial = PollutionAnalytics(pollution, injection_nodes, nodes)
+    monkeypatch.setattr('water.modules.analytics.CHUNK_SCENARIOS', 1)
+    parallel = PollutionAnalytics(pollution, injection_nodes, nodes,
+                                  processes=2)
+    for measure in MEASURES:
+        assert np.array_equal(getattr(parallel, measure),
+                              getattr(serial, measure))
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from water.modules.browser_animation import (browser_frames_data,
+                                             browser_endpoints_data,
+                                             browser_view_data)
+from water.modules.frames import ScenarioFrames
+from water.modules.lod import detail_view, full_view
+
+
+def test_browser_frames_data():
+    scenario = pd.DataFrame([[0.0, 1.0], [2.0, 3.0]], index=[0, 300],
+                            columns=['J-1', 'J-2'])
+    frames = ScenarioFrames(scenario, ['J-2', 'J-1'], np.array([0]),
+                            np.array([1]))
+    values = browser_frames_data(frames)['values']
+    # Rows of node values in graph order, one after the other
+    assert list(values) == [1.0, 0.0, 3.0, 2.0]
+    assert values.dtype == np.float32
+
+
+def test_browser_endpoints_data():
+    sources, targets = np.array([0, 1]), np.array([1, 2])
+    data = browser_endpoints_data(sources, targets,
+                                  full_view(3, sources, targets))
+    assert list(data['sources']) == [0, 1]
+    assert list(data['targets']) == [1, 2]
+    assert list(data['groups']) == [0, 1]
+    assert data['sources'].dtype == np.int32
+
+
+def test_browser_view_data():
+    xy = np.array([[0.0, 0.0], [1.0, 0.0], [2.0, 0.0]])
+    view = detail_view(xy, np.array([0, 1]), np.array([1, 2]),
+                       (1.5, 2.5, -1, 1))
+    data = browser_view_data(view)
+    assert list(data['groups']) == [-1, 0, 1]
+    assert data['groups'].dtype == np.int32
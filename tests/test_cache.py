@@ -0,0 +1,102 @@
+import threading
+import pytest
+import numpy as np
+from water.modules.cache import NetworkCache, nbytes
+
+
+def test_nbytes_numpy_array():
+    assert nbytes(np.zeros(1000)) == 8000
+
+
+def test_nbytes_counts_shared_objects_once():
+    array = np.zeros(1000)
+    assert nbytes([array, array]) < 2 * array.nbytes
+
+
+def test_network_cache_hit():
+    cache = NetworkCache()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return 'value'
+
+    assert cache.get(('kind', 'ky2', 1), loader) == 'value'
+    assert cache.get(('kind', 'ky2', 1), loader) == 'value'
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_network_cache_replaces_stale_entries():
+    """Check a new signature for the same network replaces the old entry"""
+    cache = NetworkCache()
+    cache.get(('kind', 'ky2', 1), lambda: 'old')
+    assert cache.get(('kind', 'ky2', 2), lambda: 'new') == 'new'
+    assert ('kind', 'ky2', 1) not in cache
+    assert len(cache) == 1
+
+
+def test_network_cache_evicts_least_recently_used():
+    cache = NetworkCache(max_bytes=20000)
+    cache.get(('kind', 'a', 1), lambda: np.zeros(1000))
+    cache.get(('kind', 'b', 1), lambda: np.zeros(1000))
+    # Use 'a' so that 'b' becomes the least recently used entry
+    cache.get(('kind', 'a', 1), lambda: None)
+    cache.get(('kind', 'c', 1), lambda: np.zeros(1000))
+    assert ('kind', 'a', 1) in cache
+    assert ('kind', 'b', 1) not in cache
+    assert ('kind', 'c', 1) in cache
+
+
+def test_network_cache_concurrent_load_once():
+    """Check simultaneous requests for a missing entry only load it once"""
+    cache = NetworkCache()
+    calls = []
+    started = threading.Event()
+
+    def loader():
+        calls.append(1)
+        started.wait(1)
+        return 'value'
+
+    threads = [threading.Thread(target=cache.get,
+                                args=(('kind', 'ky2', 1), loader))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    started.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+
+
+class GrowingStore:
+    def __init__(self):
+        self.loaded = 0
+
+    def loaded_nbytes(self):
+        return self.loaded
+
+
+def test_network_cache_measures_loaded_data():
+    """Check data loaded after an entry is stored counts towards its size
+    and evicts older entries"""
+    cache = NetworkCache(max_bytes=20000)
+    store = GrowingStore()
+    cache.get(('kind', 'a', 1), lambda: np.zeros(1000))
+    cache.get(('pollution', 'b', 1), lambda: {'store': store})
+    size = cache.size
+    store.loaded = 8000
+    assert cache.size == size + 8000
+    assert cache.network_size('b') > 8000
+    store.loaded = 16000
+    assert cache.get(('pollution', 'b', 1), lambda: None) == {'store': store}
+    assert ('kind', 'a', 1) not in cache
+
+
+def test_network_cache_freezes_arrays():
+    """Check the arrays of cached values can't be modified"""
+    cache = NetworkCache()
+    value = cache.get(('kind', 'a', 1), lambda: {'array': np.zeros(3)})
+    with pytest.raises(ValueError):
+        value['array'][0] = 1.0
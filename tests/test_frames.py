@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+from water.modules.frames import ScenarioFrames, palette_bins, update_column
+from water.modules.lod import full_view
+
+
+class FakeSource:
+    """Records how a ColumnDataSource is updated"""
+
+    def __init__(self):
+        self.data = {}
+        self.patches = []
+
+    def patch(self, patches):
+        # Like bokeh, changing the column arrays in place
+        self.patches.append(patches)
+        for column, changes in patches.items():
+            for index, value in changes:
+                self.data[column][index] = value
+
+
+def scenario_frames():
+    scenario = pd.DataFrame([[0.0, 0.0, 1.0],
+                             [0.0, 2.0, 4.0]],
+                            index=[0, 300], columns=['J-3', 'J-1', 'J-2'])
+    sources = np.array([0, 1])
+    targets = np.array([1, 2])
+    return ScenarioFrames(scenario, ['J-1', 'J-2', 'J-3'], sources, targets)
+
+
+def test_scenario_frames_graph_order():
+    node_values, edge_values = scenario_frames().frame(300)
+    assert list(node_values) == [2.0, 4.0, 0.0]
+    assert list(edge_values) == [3.0, 0.0]
+
+
+def test_scenario_frames_timestep_doesnt_exist():
+    node_values, edge_values = scenario_frames().frame(14)
+    assert list(node_values) == [0.0, 0.0, 0.0]
+    assert list(edge_values) == [0.0, 0.0]
+
+
+def test_scenario_frames_irregular_timesteps():
+    scenario = pd.DataFrame([[1.0], [2.0], [3.0]], index=[0, 300, 900],
+                            columns=['J-1'])
+    frames = ScenarioFrames(scenario, ['J-1'], np.array([], dtype=int),
+                            np.array([], dtype=int))
+    assert frames.row(900) == 2
+    assert frames.row(600) is None
+    assert list(frames.frame(600, interpolate=True)[0]) == [2.5]
+
+
+def test_scenario_frames_regular_timesteps():
+    frames = scenario_frames()
+    assert frames.row(0) == 0
+    assert frames.row(300) == 1
+    for timestep in [-300, 150, 600]:
+        assert frames.row(timestep) is None
+
+
+def test_scenario_frames_interpolate():
+    frames = scenario_frames()
+    node_values, edge_values = frames.frame(75, interpolate=True)
+    assert list(node_values) == [0.5, 1.75, 0.0]
+    assert list(edge_values) == [1.125, 0.0]
+    # Stored timesteps aren't interpolated, nor are those outside the
+    # scenario
+    assert np.shares_memory(frames.frame(300, interpolate=True)[0],
+                            frames.nodes)
+    assert list(frames.frame(450, interpolate=True)[0]) == [0.0, 0.0, 0.0]
+
+
+def test_scenario_frames_history():
+    history = scenario_frames()['J-2']
+    assert list(history.index) == [0, 300]
+    assert list(history) == [1.0, 4.0]
+
+
+def test_palette_bins():
+    values = np.array([0.0, 0.5, 1.0, 9.9, 11.0, 99.0, 100.0, 1000.0])
+    bins = palette_bins(values, 1.0, 100.0, n_colors=4)
+    assert bins.dtype == np.uint8
+    # Half the palette for each order of magnitude, values outside the
+    # range take the first or last color
+    assert list(bins) == [0, 0, 0, 1, 2, 3, 3, 3]
+
+
+def test_scenario_frames_bins():
+    scenario = pd.DataFrame([[0.0, 0.0, 1.0],
+                             [0.0, 2.0, 4.0]],
+                            index=[0, 300], columns=['J-3', 'J-1', 'J-2'])
+    frames = ScenarioFrames(scenario, ['J-1', 'J-2', 'J-3'], np.array([0, 1]),
+                            np.array([1, 2]), color_range=(1.0, 4.0))
+    node_bins, edge_bins = frames.bins_frame(300)
+    assert list(node_bins) == list(palette_bins([2.0, 4.0, 0.0], 1.0, 4.0))
+    assert list(edge_bins) == list(palette_bins([3.0, 0.0], 1.0, 4.0))
+    assert list(frames.bins_frame(150, interpolate=True)[0]) == list(
+        palette_bins([1.0, 2.5, 0.0], 1.0, 4.0))
+    assert list(frames.bins_frame(600)[0]) == [0, 0, 0]
+
+
+def test_update_column_replaces_unknown_values():
+    source = FakeSource()
+    values = np.arange(8.0)
+    update_column(source, 'colors', None, values)
+    assert list(source.data['colors']) == list(values)
+    # The column must be a copy, so patches don't modify the frames
+    assert source.data['colors'] is not values
+    assert source.patches == []
+
+
+def test_update_column_patches_few_changes():
+    source = FakeSource()
+    old_values = np.zeros(8)
+    source.data['colors'] = np.array(old_values)
+    new_values = np.zeros(8)
+    new_values[5] = 1.0
+    update_column(source, 'colors', old_values, new_values)
+    assert source.patches == [{'colors': [(5, 1.0)]}]
+    assert list(source.data['colors']) == list(new_values)
+    assert list(old_values) == [0.0] * 8
+
+
+def test_update_column_leaves_frames():
+    frames = scenario_frames()
+    view = full_view(3, np.array([0, 1]), np.array([1, 2]))
+    first = view.node_values(frames.frame(0)[0])
+    # A view drawing every node gives the frames themselves
+    assert np.shares_memory(first, frames.nodes)
+    source = FakeSource()
+    source.data['colors'] = np.array(first)
+    update_column(source, 'colors', first,
+                  view.node_values(frames.frame(300)[0]),
+                  max_patch_fraction=1.0)
+    assert list(source.data['colors']) == [2.0, 4.0, 0.0]
+    assert list(frames.frame(0)[0]) == [0.0, 1.0, 0.0]
+
+
+def test_update_column_replaces_many_changes():
+    source = FakeSource()
+    update_column(source, 'colors', np.zeros(8), np.ones(8))
+    assert source.patches == []
+    assert list(source.data['colors']) == [1.0] * 8
+
+
+def test_scenario_frames_share_ordered_values():
+    values = np.arange(6.0).reshape(2, 3)
+    scenario = pd.DataFrame(values, index=[0, 300],
+                            columns=['J-1', 'J-2', 'J-3'], copy=False)
+    frames = ScenarioFrames(scenario, ['J-1', 'J-2', 'J-3'],
+                            np.array([0]), np.array([1]))
+    assert np.shares_memory(frames.nodes, values)
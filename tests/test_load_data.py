@@ -1,7 +1,13 @@
+from os import remove
+from os.path import join
+import pandas as pd
 import pytest
 from water.modules.load_data import (get_network_examples, get_custom_networks,
                                      get_network_files_path, load_water_network,
-                                     load_pollution_dynamics)
+                                     load_pollution_dynamics,
+                                     preprocess_water_network)
+from water.modules.scenarios import (SPARSE_FILENAMES, SparseScenarioStore,
+                                     convert_scenarios)
 
 
 def test_get_network_examples():
@@ -31,3 +37,35 @@ def test_load_pollution_dynamics_bad_network():
     get_network_files_path() also stops load_pollution_dynamics()"""
     with pytest.raises(Exception):
         load_pollution_dynamics('bad network name')
+
+
+def test_preprocess_water_network(small_network_inp):
+    """Check the node attributes shown in tooltips and the normalised base
+    demands for a small network"""
+    G, locations, all_base_demands = preprocess_water_network(
+        small_network_inp, x_offset=10)
+    assert list(G.nodes()) == ['J-1', 'J-2', 'R-1']
+    assert G.nodes['J-1']['elevation'] == 5.0
+    assert G.nodes['R-1']['demand'] == 'N/A'
+    assert G.nodes['J-1']['connected'] == 'J-2: P-2 | R-1: P-1 '
+    assert list(all_base_demands) == [0.5, 1.0, 0.0]
+    assert locations['J-2'] == (12.0, 0.0)
+
+
+def test_load_pollution_dynamics_sparse(synthetic_network):
+    pollution, injection_nodes, *_ = load_pollution_dynamics(
+        synthetic_network)
+    directory = join(get_network_files_path(synthetic_network),
+                     synthetic_network)
+    convert_scenarios(directory, sparse=True)
+    try:
+        sparse, sparse_injection_nodes, *_ = load_pollution_dynamics(
+            synthetic_network)
+        assert isinstance(sparse, SparseScenarioStore)
+        assert sparse_injection_nodes == injection_nodes
+        pd.testing.assert_frame_equal(sparse[injection_nodes[0]],
+                                      pollution[injection_nodes[0]],
+                                      check_names=False)
+    finally:
+        for filename in SPARSE_FILENAMES:
+            remove(join(directory, filename))
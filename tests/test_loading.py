@@ -0,0 +1,25 @@
+import logging
+from water.modules.cache import (network_cache, network_signature,
+                                 cached_pollution_dynamics)
+from water.modules.loading import load_network, preload_networks
+
+
+def test_load_network(synthetic_network):
+    signature = network_signature(synthetic_network)
+    load_network(synthetic_network).result()
+    # Writing the derived files, like the summary, leaves the signature
+    assert network_signature(synthetic_network) == signature
+    injection = cached_pollution_dynamics(synthetic_network)[1][0]
+    for key in [('water_network', synthetic_network, signature),
+                ('scenario_frames', (synthetic_network, injection),
+                 signature)]:
+        assert key in network_cache
+
+
+def test_preload_networks(synthetic_network, caplog):
+    caplog.set_level(logging.INFO)
+    futures = preload_networks([synthetic_network, 'no-such-network'])
+    assert list(futures) == [synthetic_network]
+    assert futures[synthetic_network].result() >= 0
+    assert "Can't preload unknown network no-such-network" in caplog.text
+    assert network_cache.network_size(synthetic_network) > 0
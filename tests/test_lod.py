@@ -0,0 +1,86 @@
+import networkx as nx
+import numpy as np
+from water.modules.lod import (LevelOfDetail, detail_view, full_view,
+                               overview)
+
+# A row of four nodes, 0 - 1 - 2 - 3, one unit apart
+XY = np.array([[0.0, 0.0], [1.0, 0.0], [2.0, 0.0], [3.0, 0.0]])
+SOURCES = np.array([0, 1, 2])
+TARGETS = np.array([1, 2, 3])
+
+
+def test_full_view():
+    view = full_view(4, SOURCES, TARGETS)
+    values = np.array([1.0, 2.0, 3.0, 4.0])
+    assert view.node_values(values) is values
+    assert list(view.edge_values(values[:3])) == [1.0, 2.0, 3.0]
+
+
+def test_detail_view():
+    view = detail_view(XY, SOURCES, TARGETS, (-0.5, 0.5, -1, 1))
+    # Node 0 is inside, node 1 is drawn as the other end of its edge
+    assert list(view.nodes) == [0, 1]
+    assert list(view.node_groups) == [0, 1, -1, -1]
+    assert list(view.edge_groups) == [0, -1, -1]
+    assert list(view.node_values(np.array([[1, 2, 3, 4], [5, 6, 7, 8]]))[1]
+                ) == [5, 6]
+    assert view.contains(-0.2, 0.2, -0.5, 0.5)
+    assert not view.contains(-0.2, 1.2, -0.5, 0.5)
+
+
+def test_overview():
+    # Two cells across, nodes 0 and 1 in the first, 2 and 3 in the second
+    priority = np.array([0, 1, 0, 0])
+    view = overview(XY, SOURCES, TARGETS, priority, 4)
+    assert list(view.node_groups) == [0, 0, 1, 1]
+    # The highest priority node of each cell represents it
+    assert list(view.nodes) == [1, 2]
+    # Only the edge between the cells is drawn
+    assert list(view.edge_groups) == [-1, 0, -1]
+    assert (list(view.starts), list(view.ends)) == ([0], [1])
+    assert list(view.node_values(np.array([1.0, 0.0, 2.0, 3.0]))) == [1, 3]
+    assert list(view.node_values(np.array([1.0, 0.0, 2.0, 3.0]),
+                                 np.minimum)) == [0, 2]
+
+
+def grid_graph(side):
+    G = nx.MultiGraph()
+    locations = {}
+    for i in range(side * side):
+        name = 'J-' + str(i)
+        G.add_node(name, type='Junction', name=name, pos=divmod(i, side))
+        locations[name] = divmod(i, side)
+    for i in range(side * side):
+        if i % side + 1 < side:
+            G.add_edge('J-' + str(i), 'J-' + str(i + 1), type='Pipe')
+        if i + side < side * side:
+            G.add_edge('J-' + str(i), 'J-' + str(i + side), type='Pipe')
+    positions = {node: i for i, node in enumerate(G.nodes())}
+    sources = np.array([positions[edge[0]] for edge in G.edges()])
+    targets = np.array([positions[edge[1]] for edge in G.edges()])
+    return G, locations, sources, targets
+
+
+def test_level_of_detail_small_network():
+    lod = LevelOfDetail(*grid_graph(3), max_nodes=100)
+    assert not lod.enabled
+    assert lod.view(0, 1, 0, 1) is lod.full
+
+
+def test_level_of_detail():
+    lod = LevelOfDetail(*grid_graph(20), max_nodes=25)
+    assert lod.enabled
+    assert lod.view(0, 19, 0, 19) is lod.overview
+    assert len(lod.overview.nodes) <= 25
+
+    detail = lod.view(0, 2, 0, 2)
+    assert detail.bounds is not None
+    # Smaller pans and zooms keep the view
+    assert lod.view(0, 1.5, 0, 1.5, detail) is detail
+    assert lod.view(10, 12, 10, 12, detail) is not detail
+
+    node_data, edge_data, layout = lod.graph_data(detail)
+    assert set(node_data) == {'index', 'type', 'name', 'pos'}
+    assert node_data['pos'][0] == list(layout[node_data['index'][0]])
+    assert set(edge_data['start']) | set(edge_data['end']) <= set(layout)
+    assert edge_data['type'][0] == 'Pipe'
@@ -0,0 +1,21 @@
+from os.path import abspath, dirname, join
+from bokeh.application import Application
+from bokeh.application.handlers import DirectoryHandler
+from bokeh.core.validation import check_integrity
+from bokeh.models import Select
+
+WATER_DIR = abspath(join(dirname(__file__), '..', 'water'))
+
+
+def test_app_starts(synthetic_data_dir, monkeypatch):
+    """Check the app builds its document, showing the synthetic network"""
+    # Read by the app's own copy of the modules when it is imported
+    monkeypatch.setenv('WATER_DATA_DIR', synthetic_data_dir)
+    handler = DirectoryHandler(filename=WATER_DIR)
+    document = Application(handler).create_document()
+    assert not handler.failed, handler.error_detail
+    network_select = [model for model in document.select({'type': Select})
+                      if model.title == "Choose Water Network"][0]
+    assert network_select.value == 'test-synthetic'
+    assert len(document.roots) == 1
+    assert check_integrity(document.roots[0].references()).error == []
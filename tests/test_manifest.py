@@ -0,0 +1,79 @@
+import shutil
+import pytest
+from water.modules.manifest import (network_hash, build_scenarios,
+                                    stale_scenarios, consistent_scenarios)
+from water.modules.scenarios import ScenarioStore
+from water.modules.simulate import DEFAULT_PARAMETERS
+
+
+def edit_inp(inp_file, old, new):
+    with open(inp_file) as stream:
+        text = stream.read()
+    with open(inp_file, 'w') as stream:
+        stream.write(text.replace(old, new))
+
+
+def test_network_hash_ignores_display_changes(small_network_inp):
+    original = network_hash(small_network_inp)
+    edit_inp(small_network_inp, 'J-2  2  0', 'J-2  3  1 ; moved')
+    assert network_hash(small_network_inp) == original
+
+
+def test_network_hash_simulation_changes(small_network_inp):
+    original = network_hash(small_network_inp)
+    edit_inp(small_network_inp, 'P-2  J-1  J-2  100', 'P-2  J-1  J-2  200')
+    assert network_hash(small_network_inp) != original
+
+
+@pytest.fixture
+def built_scenarios(small_network_inp, tmp_path):
+    """Scenarios for both junctions of the small network with a manifest"""
+    directory = str(tmp_path / 'small')
+    build_scenarios(small_network_inp, directory, ['J-1', 'J-2'],
+                    processes=1)
+    return small_network_inp, directory
+
+
+def test_stale_scenarios_up_to_date(built_scenarios):
+    inp_file, directory = built_scenarios
+    assert stale_scenarios(inp_file, directory, ['J-1', 'J-2'],
+                           DEFAULT_PARAMETERS) == []
+    assert sorted(consistent_scenarios(inp_file, directory)) == ['J-1', 'J-2']
+
+
+def test_stale_scenarios_changed(built_scenarios):
+    inp_file, directory = built_scenarios
+    # Replace one scenario with the other
+    shutil.copy(directory + '/J-1.pkl', directory + '/J-2.pkl')
+    assert stale_scenarios(inp_file, directory, ['J-1', 'J-2'],
+                           DEFAULT_PARAMETERS) == ['J-2']
+    parameters = dict(DEFAULT_PARAMETERS, strength=1.0)
+    assert stale_scenarios(inp_file, directory, ['J-1', 'J-2'],
+                           parameters) == ['J-1', 'J-2']
+
+
+def test_consistent_scenarios_network_changed(built_scenarios):
+    inp_file, directory = built_scenarios
+    edit_inp(inp_file, 'P-2  J-1  J-2  100', 'P-2  J-1  J-2  200')
+    assert consistent_scenarios(inp_file, directory) == {}
+
+
+def test_scenario_store_refuses_changed_scenario(built_scenarios):
+    inp_file, directory = built_scenarios
+    shutil.copy(directory + '/J-1.pkl', directory + '/J-2.pkl')
+    store = ScenarioStore(directory,
+                          checksums=consistent_scenarios(inp_file, directory))
+    store['J-1']
+    with pytest.raises(ValueError):
+        store['J-2']
+
+
+def test_build_scenarios_records_finished_when_one_fails(small_network_inp,
+                                                         tmp_path):
+    """Check the scenarios that finish are recorded when another fails"""
+    directory = str(tmp_path / 'small')
+    with pytest.raises(Exception):
+        build_scenarios(small_network_inp, directory, ['J-1', 'X', 'J-2'],
+                        processes=1)
+    assert stale_scenarios(small_network_inp, directory, ['J-1', 'J-2'],
+                           DEFAULT_PARAMETERS) == []
@@ -0,0 +1,73 @@
+import pytest
+from water.modules import metrics
+from water.modules.metrics import (Counter, CounterFunction, Gauge,
+                                   Histogram, exposition, timed)
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Keep the metrics made by a test out of the process registry"""
+    monkeypatch.setattr(metrics, '_registry', [])
+
+
+def test_counter(registry):
+    counter = Counter('test_total', "A count", ['kind'])
+    counter.inc('a')
+    counter.inc('a', amount=2)
+    counter.inc('b"')
+    assert counter.exposition() == (
+        '# HELP test_total A count\n'
+        '# TYPE test_total counter\n'
+        'test_total{kind="a"} 3.0\n'
+        'test_total{kind="b\\""} 1.0\n')
+
+
+def test_gauge(registry):
+    gauge = Gauge('test_gauge', "A gauge")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.exposition().endswith('\ntest_gauge 1.0\n')
+    gauge.set(5)
+    assert gauge.samples() == [('', (), (), 5)]
+    values = [7]
+    assert CounterFunction('test_function_total', "A count kept elsewhere",
+                           lambda: values[0]).exposition() == (
+        '# HELP test_function_total A count kept elsewhere\n'
+        '# TYPE test_function_total counter\n'
+        'test_function_total 7.0\n')
+
+
+def test_histogram(registry):
+    histogram = Histogram('test_seconds', "Durations", ['function'],
+                          buckets=(0.1, 1.0))
+    histogram.observe(0.05, 'load')
+    histogram.observe(0.1, 'load')
+    histogram.observe(2.0, 'load')
+    assert histogram.exposition().split('\n')[2:] == [
+        'test_seconds_bucket{function="load",le="0.1"} 2.0',
+        'test_seconds_bucket{function="load",le="1.0"} 2.0',
+        'test_seconds_bucket{function="load",le="+Inf"} 3.0',
+        'test_seconds_sum{function="load"} 2.15',
+        'test_seconds_count{function="load"} 3.0',
+        '']
+
+
+def test_timed(registry):
+    histogram = Histogram('test_seconds', "Durations", ['function'])
+
+    @timed(histogram, 'fail')
+    def fail():
+        raise ValueError
+
+    @timed(histogram, 'add')
+    def add(a, b=0):
+        return a + b
+
+    assert add(1, b=2) == 3
+    assert add.__name__ == 'add'
+    with pytest.raises(ValueError):
+        fail()
+    # Failed calls are timed too
+    assert 'test_seconds_count{function="fail"} 1.0' in exposition()
+    assert 'test_seconds_count{function="add"} 1.0' in exposition()
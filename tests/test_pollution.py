@@ -1,5 +1,8 @@
+import numpy as np
+import pandas as pd
 import pytest
-from water.modules.pollution import pollution_series, pollution_scenario
+from water.modules.pollution import (pollution_series, pollution_scenario,
+                                     node_positions, edge_pollution)
 
 
 def test_pollution_series(pollution_data):
@@ -15,7 +18,30 @@ def test_pollution_series_timestep_doesnt_exist(pollution_data):
     assert pollution_series(scenario, 14)[0] == 0.0
 
 
+def test_pollution_series_zero_for_each_node():
+    scenario = pd.DataFrame([[1.0, 2.0, 3.0]], index=[0],
+                            columns=['J-1', 'J-2', 'J-3'])
+    series = pollution_series(scenario, 300)
+    assert list(series.index) == ['J-1', 'J-2', 'J-3']
+    assert list(series) == [0.0, 0.0, 0.0]
+
+
 def test_pollution_series_node_doesnt_exist(pollution_data):
     pollution = pollution_data
     with pytest.raises(KeyError):
         pollution_scenario(pollution, 'X')
+
+
+def test_node_positions():
+    scenario = pd.DataFrame([[1, 2, 3]], columns=['J-1', 'J-2', 'J-3'])
+    assert list(node_positions(scenario, ['J-3', 'J-1', 'J-2'])) == [2, 0, 1]
+    with pytest.raises(KeyError):
+        node_positions(scenario, ['J-1', 'X'])
+
+
+def test_edge_pollution():
+    node_pollution = np.array([0.0, 2.0, 4.0])
+    sources = np.array([0, 1, 2])
+    targets = np.array([1, 2, 0])
+    # Edges with an unpolluted node at either end have no pollution
+    assert list(edge_pollution(node_pollution, sources, targets)) == [0, 3, 0]
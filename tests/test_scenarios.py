@@ -0,0 +1,149 @@
+import json
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+from water.modules.pollution import pollution_scenario
+from water.modules.scenarios import (ScenarioStore, ArrayScenarioStore,
+                                     SparseScenarioStore, ARRAY_FILENAME,
+                                     SPARSE_VALUES_FILENAME, SUMMARY_FILENAME,
+                                     convert_scenarios, dequantize_log,
+                                     open_scenario_store, quantize_log)
+
+
+@pytest.fixture
+def scenario_dir(tmp_path):
+    """A directory of three small pollution scenarios, one with no
+    pollution at all"""
+    timesteps = [0, 300, 600, 900]
+    nodes = ['J-1', 'J-2', 'J-3']
+    for i, injection in enumerate(nodes):
+        values = np.arange(12, dtype=float).reshape(4, 3) * i
+        df = pd.DataFrame(values, index=timesteps, columns=nodes)
+        with open(str(tmp_path / (injection + '.pkl')), 'wb') as output:
+            pickle.dump(df, output)
+    return tmp_path
+
+
+def test_scenario_store_summary(scenario_dir):
+    store = ScenarioStore(str(scenario_dir))
+    assert store.injection_nodes == ['J-1', 'J-2', 'J-3']
+    assert store.max_pol == 22.0
+    assert store.min_pol == 1.0
+    assert list(store.timesteps) == [0, 300, 600, 900]
+    assert (scenario_dir / SUMMARY_FILENAME).exists()
+
+
+def test_scenario_store_uses_saved_summary(scenario_dir):
+    """Check the summary file is used instead of reading every scenario"""
+    ScenarioStore(str(scenario_dir))
+    summary_file = scenario_dir / SUMMARY_FILENAME
+    summary = json.loads(summary_file.read_text())
+    summary['max_pol'] = 100.0
+    summary_file.write_text(json.dumps(summary))
+    assert ScenarioStore(str(scenario_dir)).max_pol == 100.0
+
+
+def test_scenario_store_lazy_and_bounded(scenario_dir):
+    store = ScenarioStore(str(scenario_dir), max_scenarios=2)
+    assert len(store._scenarios) == 0
+    assert store.loaded_nbytes() == 0
+    assert store['J-3'].loc[900, 'J-3'] == 22.0
+    store['J-1']
+    store['J-2']
+    assert list(store._scenarios) == ['J-1', 'J-2']
+    assert store.loaded_nbytes() >= 2 * 12 * 8
+
+
+def test_scenario_store_missing_injection(scenario_dir):
+    store = ScenarioStore(str(scenario_dir))
+    with pytest.raises(KeyError):
+        pollution_scenario(store, 'X')
+
+
+def test_convert_scenarios(scenario_dir):
+    assert convert_scenarios(str(scenario_dir)) == (3, 4, 3)
+    store = open_scenario_store(str(scenario_dir))
+    assert isinstance(store, ArrayScenarioStore)
+    assert store.injection_nodes == ['J-1', 'J-2', 'J-3']
+    assert (store.max_pol, store.min_pol) == (22.0, 1.0)
+    with open(str(scenario_dir / 'J-3.pkl'), 'rb') as input_file:
+        expected = pickle.load(input_file)
+    pd.testing.assert_frame_equal(store['J-3'], expected, check_names=False)
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_converted_scenarios_not_used_once_changed(scenario_dir, sparse):
+    """Check the .pkl files are used once they change after they were
+    converted"""
+    convert_scenarios(str(scenario_dir), sparse=sparse)
+    df = pd.DataFrame(np.full((4, 3), 7.0), index=[0, 300, 600, 900],
+                      columns=['J-1', 'J-2', 'J-3'])
+    with open(str(scenario_dir / 'J-2.pkl'), 'wb') as output:
+        pickle.dump(df, output)
+    os.utime(str(scenario_dir / 'J-2.pkl'), ns=(0, 0))
+    store = open_scenario_store(str(scenario_dir))
+    assert type(store) is ScenarioStore
+    assert store['J-2'].loc[300, 'J-1'] == 7.0
+    convert_scenarios(str(scenario_dir), sparse=sparse)
+    assert type(open_scenario_store(str(scenario_dir))) is not ScenarioStore
+
+
+def test_array_scenario_store_is_memory_mapped(scenario_dir):
+    convert_scenarios(str(scenario_dir))
+    store = ArrayScenarioStore(str(scenario_dir))
+    assert np.shares_memory(store['J-2'].values, store.data)
+    with pytest.raises(KeyError):
+        pollution_scenario(store, 'X')
+
+
+def test_convert_scenarios_sparse(scenario_dir):
+    # Pollution that stops and starts again at a node is kept
+    df = pd.DataFrame([[0.0, 0.0, 0.0], [0.0, 5.0, 0.0], [0.0, 0.0, 0.0],
+                       [0.0, 2.0, 0.0]],
+                      index=[0, 300, 600, 900], columns=['J-1', 'J-2', 'J-3'])
+    with open(str(scenario_dir / 'J-4.pkl'), 'wb') as output:
+        pickle.dump(df, output)
+    convert_scenarios(str(scenario_dir))
+    assert convert_scenarios(str(scenario_dir), sparse=True) == (4, 4, 3)
+    # Converting to one format removes the other
+    assert not (scenario_dir / ARRAY_FILENAME).exists()
+    store = open_scenario_store(str(scenario_dir))
+    assert isinstance(store, SparseScenarioStore)
+    assert (store.max_pol, store.min_pol) == (22.0, 1.0)
+    # Only the values from the first to the last polluted timestep are kept
+    assert len(store.values) == 2 * 11 + 3
+    for injection in store:
+        with open(str(scenario_dir / (injection + '.pkl')), 'rb') as stream:
+            expected = pickle.load(stream)
+        pd.testing.assert_frame_equal(store[injection], expected,
+                                      check_names=False)
+    assert store['J-2'] is store['J-2']
+    with pytest.raises(KeyError):
+        pollution_scenario(store, 'X')
+    convert_scenarios(str(scenario_dir))
+    assert not (scenario_dir / SPARSE_VALUES_FILENAME).exists()
+
+
+def test_convert_scenarios_log_quantized(scenario_dir):
+    convert_scenarios(str(scenario_dir), sparse=True, log_quantize=True)
+    store = SparseScenarioStore(str(scenario_dir))
+    assert store.values.dtype == np.uint16
+    with open(str(scenario_dir / 'J-3.pkl'), 'rb') as input_file:
+        expected = pickle.load(input_file)
+    np.testing.assert_allclose(store['J-3'].values, expected.values,
+                               rtol=1e-4)
+    assert store['J-3'].loc[0, 'J-1'] == 0.0
+    with pytest.raises(ValueError):
+        convert_scenarios(str(scenario_dir), log_quantize=True)
+
+
+def test_quantize_log():
+    values = np.array([0.0, -1.0, 1e-40, 1e-3, 1e3])
+    levels = quantize_log(values, 1e-40, 1e3)
+    assert list(levels[:3]) == [0, 0, 1]
+    assert levels[-1] == np.iinfo(np.uint16).max
+    recovered = dequantize_log(levels, 1e-40, 1e3)
+    assert list(recovered[:2]) == [0.0, 0.0]
+    np.testing.assert_allclose(recovered[2:], values[2:], rtol=1e-3)
@@ -0,0 +1,33 @@
+from water.modules.cache import cached_node_index, cached_water_network
+from water.modules.search import NodeIndex
+
+NAMES = ['J-10', 'J-2', 'R-1', 'j-1', 'J-1', 'T-1']
+
+
+def test_search():
+    index = NodeIndex(NAMES)
+    # Ignoring case, in alphabetical order
+    assert sorted(index.search('j-1')) == ['J-1', 'J-10', 'j-1']
+    assert index.search(' J-10 ') == ['J-10']
+    assert index.search('r') == ['R-1']
+    assert index.search('X') == []
+    assert len(index.search('', top=4)) == 4
+    assert index.search('J', top=2) == index.search('J')[:2]
+
+
+def test_position():
+    index = NodeIndex(NAMES)
+    assert index.position('R-1') == 2
+    assert index.names[index.position('j-1')] == 'j-1'
+    assert index.position('X') is None
+    assert 'T-1' in index
+    assert 'None' not in index
+    assert len(index) == 6
+
+
+def test_cached_node_index(synthetic_network):
+    node_index, injection_index = cached_node_index(synthetic_network)
+    G = cached_water_network(synthetic_network)[0]
+    assert list(node_index.names) == list(G.nodes())
+    assert len(injection_index) == 3
+    assert all(name in node_index for name in injection_index.names)
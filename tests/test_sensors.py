@@ -0,0 +1,62 @@
+import numpy as np
+from water.modules.cache import cached_sensor_placement
+from water.modules.sensors import DetectionIndex, place_sensors
+
+INF = np.inf
+# Arrival times of three scenarios at four nodes, the third scenario never
+# exceeds the threshold anywhere
+ARRIVAL = np.array([[100.0, 200.0, INF, 400.0],
+                    [INF, 300.0, 100.0, INF],
+                    [INF, INF, INF, INF]])
+END = 1000.0
+
+
+def test_detection_index():
+    index = DetectionIndex(ARRIVAL, END)
+    assert index.n_scenarios == 2
+    assert list(index.penalties) == [900.0, 900.0]
+    # Delays from the first arrival of each scenario, by node
+    assert index.delays.tolist() == [[0, 900], [100, 200], [900, 0],
+                                     [300, 900]]
+    assert index.detection([1]) == (1.0, 150.0)
+    assert index.detection([]) == (0.0, 900.0)
+
+
+def test_place_sensors():
+    index = DetectionIndex(ARRIVAL, END)
+    # Node 1 detects both scenarios, then nodes 0 and 2 detect them at once
+    chosen, mean_delays = place_sensors(index, 1)
+    assert chosen == [1]
+    assert mean_delays == [150.0]
+    chosen, mean_delays = place_sensors(index, 4)
+    # Nothing is gained from a fourth sensor
+    assert sorted(chosen[1:]) == [0, 2]
+    assert mean_delays[-1] == 0.0
+    assert len(chosen) == 3
+
+
+def test_place_sensors_candidates():
+    index = DetectionIndex(ARRIVAL, END)
+    chosen, _ = place_sensors(index, 2, candidates=np.array([0, 3]))
+    assert chosen == [0]
+
+
+def test_place_sensors_matches_greedy():
+    rng = np.random.RandomState(0)
+    arrival = rng.uniform(0, 1000, (30, 60))
+    arrival[rng.uniform(size=arrival.shape) < 0.7] = np.inf
+    index = DetectionIndex(arrival, END)
+    chosen, _ = place_sensors(index, 8)
+    # Recalculate every gain for every sensor
+    best = index.penalties.copy()
+    for node in chosen:
+        assert node == np.argmax(index.gains(best))
+        best = np.minimum(best, index.delays[node])
+
+
+def test_cached_sensor_placement(synthetic_network):
+    index, placement = cached_sensor_placement(synthetic_network)
+    assert index.n_scenarios == 3
+    detected, mean_delay = index.detection(placement)
+    assert detected == 1.0
+    assert mean_delay == 0.0
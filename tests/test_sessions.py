@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+from water.modules.sessions import SessionActivity
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def test_activity():
+    clock = Clock()
+    activity = SessionActivity(clock)
+    clock.time = 120.0
+    assert activity.idle_seconds() == 120.0
+    assert activity.idle(minutes=1)
+    assert not activity.idle(minutes=3)
+    # Idle sessions are never closed with 0 minutes
+    assert not activity.idle(minutes=0)
+    activity.touch()
+    assert activity.idle_seconds() == 0.0
+
+
+def test_activity_changes():
+    clock = Clock()
+    activity = SessionActivity(clock)
+    slider, select = object(), object()
+    activity.ignore(slider)
+    clock.time = 10.0
+    # Changes made by the server, or by the browser to ignored models,
+    # aren't the user's
+    activity.changed(SimpleNamespace(model=select, setter=None))
+    activity.changed(SimpleNamespace(model=slider, setter='session'))
+    assert activity.idle_seconds() == 10.0
+    activity.changed(SimpleNamespace(model=select, setter='session'))
+    assert activity.idle_seconds() == 0.0
+    activity.forget(slider)
+    clock.time = 20.0
+    activity.changed(SimpleNamespace(model=slider, setter='session'))
+    assert activity.idle_seconds() == 0.0
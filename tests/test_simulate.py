@@ -0,0 +1,31 @@
+import os
+import pickle
+from water.modules.simulate import generate_scenarios
+
+
+def test_generate_scenarios(small_network_inp, tmp_path):
+    output_dir = str(tmp_path / 'small')
+    assert generate_scenarios(small_network_inp, output_dir,
+                              processes=1) == ['J-1', 'J-2']
+    scenario = open_scenario(output_dir, 'J-1')
+    assert list(scenario.columns) == ['J-1', 'J-2', 'R-1']
+    assert scenario.index[-1] == 24 * 3600
+    # Pollution is injected at 10-11hr
+    assert scenario.loc[9 * 3600, 'J-1'] == 0
+    assert scenario.loc[10.5 * 3600, 'J-1'] > 0
+
+
+def test_generate_scenarios_resumes(small_network_inp, tmp_path):
+    """Check nodes with a finished scenario are not simulated again"""
+    output_dir = str(tmp_path / 'small')
+    generate_scenarios(small_network_inp, output_dir, nodes=['J-1'],
+                       processes=1)
+    modified = os.path.getmtime(os.path.join(output_dir, 'J-1.pkl'))
+    assert generate_scenarios(small_network_inp, output_dir,
+                              processes=1) == ['J-2']
+    assert os.path.getmtime(os.path.join(output_dir, 'J-1.pkl')) == modified
+
+
+def open_scenario(directory, injection):
+    with open(os.path.join(directory, injection + '.pkl'), 'rb') as input_file:
+        return pickle.load(input_file)
@@ -0,0 +1,85 @@
+from os.path import exists, join
+import numpy as np
+import pandas as pd
+import pytest
+from water.modules.cache import cached_source_index
+from water.modules.load_data import load_pollution_dynamics
+from water.modules.sources import (DENSE_SOURCE_INDEX_FILENAME,
+                                   SOURCE_INDEX_FILENAMES, build_source_index,
+                                   load_source_index, parse_observations)
+
+TIMESTEPS = np.array([0, 300])
+NODES = ['J-1', 'J-2', 'J-3']
+# Pollution injected at J-1 reaches J-2, injected at J-3 it stays there
+POLLUTION = {
+    'J-1': pd.DataFrame([[0.0, 0.0, 0.0], [10.0, 5.0, 0.0]],
+                        index=TIMESTEPS, columns=NODES),
+    'J-3': pd.DataFrame([[0.0, 0.0, 0.0], [10.0, 0.0, 0.0]],
+                        index=TIMESTEPS, columns=NODES[::-1]),
+}
+
+
+def test_rank():
+    index = build_source_index(POLLUTION, ['J-1', 'J-3'], NODES, TIMESTEPS)
+    # Only the polluted values are kept
+    assert len(index.values) == 3
+    assert index.expected(300, [0, 1, 2]).tolist() == [[10.0, 0.0],
+                                                       [5.0, 0.0],
+                                                       [0.0, 10.0]]
+    ranked = index.rank({'J-2': 4.0}, 300)
+    assert [injection for injection, _ in ranked] == ['J-1', 'J-3']
+    assert ranked[0][1] < ranked[1][1]
+    # The columns of the scenario of J-3 are reordered to match the nodes
+    assert [injection for injection, _ in index.rank({'J-3': 10.0}, 300,
+                                                     top=1)] == ['J-3']
+    assert index.rank({}, 300) == []
+
+
+def test_rank_errors():
+    index = build_source_index(POLLUTION, ['J-1', 'J-3'], NODES, TIMESTEPS)
+    with pytest.raises(ValueError):
+        index.rank({'J-9': 1.0}, 300)
+    with pytest.raises(ValueError):
+        index.rank({'J-1': 1.0}, 150)
+
+
+def test_load_source_index(tmp_path):
+    directory = str(tmp_path)
+    # The dense index of earlier versions is removed
+    (tmp_path / DENSE_SOURCE_INDEX_FILENAME).write_bytes(b'')
+    index = load_source_index(POLLUTION, ['J-1', 'J-3'], NODES, TIMESTEPS,
+                              directory)
+    assert isinstance(index.values, np.memmap)
+    assert all(exists(join(directory, filename))
+               for filename in SOURCE_INDEX_FILENAMES)
+    assert not exists(join(directory, DENSE_SOURCE_INDEX_FILENAME))
+    # The saved index is used, unless it's for different scenarios
+    assert load_source_index({}, ['J-1', 'J-3'], NODES, TIMESTEPS,
+                             directory).expected(300, [1]).tolist() == [
+        [5.0, 0.0]]
+    assert load_source_index(POLLUTION, ['J-1'], NODES, TIMESTEPS,
+                             directory).expected(300, [1]).shape == (1, 1)
+
+
+def test_parse_observations():
+    assert parse_observations("J-5=2.5, J-10 = 0,") == {'J-5': 2.5,
+                                                        'J-10': 0.0}
+    assert parse_observations("") == {}
+    with pytest.raises(ValueError):
+        parse_observations("J-5")
+    with pytest.raises(ValueError):
+        parse_observations("J-5=high")
+
+
+def test_cached_source_index(synthetic_network):
+    pollution, injection_nodes, *_ = load_pollution_dynamics(
+        synthetic_network)
+    index = cached_source_index(synthetic_network)
+    # Each scenario matches itself best
+    for injection in injection_nodes:
+        scenario = pollution[injection]
+        # While pollution is being injected
+        timestep = int(scenario[injection].idxmax())
+        observations = {node: scenario.loc[timestep, node]
+                        for node in index.nodes}
+        assert index.rank(observations, timestep, top=1)[0][0] == injection
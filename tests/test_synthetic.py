@@ -0,0 +1,55 @@
+import numpy as np
+import wntr
+from water.modules.load_data import load_water_network, load_pollution_dynamics
+from water.modules.synthetic import SyntheticNetwork, write_synthetic_network
+
+
+def test_synthetic_network_inp(tmp_path):
+    """Check the .inp file of a synthetic network can be read by wntr and
+    every node is connected to a reservoir"""
+    network = SyntheticNetwork(100)
+    inp_file = tmp_path / 'synthetic.inp'
+    inp_file.write_text(network.inp_text())
+    wn = wntr.network.WaterNetworkModel(str(inp_file))
+    assert wn.num_junctions == 100
+    assert wn.node_name_list == network.nodes
+    assert np.isfinite(network.supply_distances).all()
+
+
+def test_synthetic_network_seed():
+    assert (SyntheticNetwork(100, seed=1).inp_text()
+            == SyntheticNetwork(100, seed=1).inp_text())
+    assert (SyntheticNetwork(100, seed=1).inp_text()
+            != SyntheticNetwork(100, seed=2).inp_text())
+
+
+def test_synthetic_scenario():
+    network = SyntheticNetwork(100)
+    scenario = network.scenario('J-50')
+    assert list(scenario.columns) == network.nodes
+    assert scenario.index[-1] == 24 * 3600
+    # Pollution is injected at 10-11hr and only carried downstream
+    assert scenario.loc[9 * 3600].max() == 0
+    assert scenario.loc[10 * 3600, 'J-50'] == 1000.0
+    assert scenario.loc[11 * 3600, 'J-50'] == 0
+    assert scenario['R-1'].max() == 0
+
+
+def test_write_synthetic_network(tmp_path):
+    file_path = write_synthetic_network('synthetic', 100, scenarios=3,
+                                        data_dir=str(tmp_path))
+    assert (tmp_path / 'synthetic' / 'synthetic.inp').exists()
+    assert len(list((tmp_path / 'synthetic' / 'synthetic').glob('J-*.pkl'))
+               ) == 3
+    assert file_path == str(tmp_path / 'synthetic')
+
+
+def test_load_synthetic_network(synthetic_network):
+    G, locations, all_base_demands, include_map = load_water_network(
+        synthetic_network)
+    assert G.number_of_nodes() == 101
+    pollution, injection_nodes, start_node, start, end, step, *_ = (
+        load_pollution_dynamics(synthetic_network))
+    assert len(injection_nodes) == 3
+    assert (start, end, step) == (0, 24 * 3600, 300)
+    assert set(pollution[start_node].columns) == set(G.nodes())
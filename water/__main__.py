@@ -0,0 +1,3 @@
+from water.modules.cli import main
+
+main()
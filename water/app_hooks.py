@@ -0,0 +1,26 @@
+from os import environ
+from modules.loading import preload_networks
+from modules.metrics import ACTIVE_SESSIONS, SESSIONS
+
+
+def on_server_loaded(server_context):
+    """Start loading the networks listed in the WATER_PRELOAD_NETWORKS
+    environment variable, separated by commas, or every network if it is
+    'all', into the cache shared by the sessions of this process. The
+    server starts accepting sessions straight away"""
+    networks = [network.strip() for network
+                in environ.get('WATER_PRELOAD_NETWORKS', '').split(',')
+                if network.strip()]
+    if networks:
+        preload_networks(networks)
+
+
+def on_session_created(session_context):
+    """Count the sessions of the app"""
+    SESSIONS.inc()
+    ACTIVE_SESSIONS.inc()
+
+
+def on_session_destroyed(session_context):
+    """Count the sessions of the app"""
+    ACTIVE_SESSIONS.dec()
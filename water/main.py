@@ -1,31 +1,62 @@
 from bokeh.events import Tap
 from bokeh.io import curdoc
 from bokeh.layouts import row, column
-from bokeh.models.graphs import from_networkx, NodesAndLinkedEdges
+from bokeh.models.graphs import NodesAndLinkedEdges, StaticLayoutProvider
 from bokeh.models import (Range1d, MultiLine, Circle, TapTool, HoverTool,
                           Slider, Span, Button, ColorBar, LogTicker,
-                          ColumnDataSource)
+                          BasicTicker, LinearColorMapper, LogColorMapper,
+                          ColumnDataSource, GraphRenderer, TextInput,
+                          AutocompleteInput, Toggle, CDSView)
 from bokeh.models.annotations import Title
 from bokeh.models.widgets import Div, Select, RadioGroup
 from bokeh.plotting import figure
 from bokeh.tile_providers import get_provider, Vendors
 from bokeh.transform import log_cmap
 from collections import defaultdict
+from functools import partial
 import colorcet as cc
+import numpy as np
 from modules.html_formatter import (timer_html, pollution_history_html,
-                                    pollution_location_html, node_type_html)
-from modules.load_data import (load_water_network, load_pollution_dynamics,
-                               get_networks, get_custom_networks)
-from modules.pollution import (pollution_series, pollution_history,
-                               pollution_scenario)
-
-
-def launch(network):
+                                    pollution_location_html, node_type_html,
+                                    sensor_placement_html,
+                                    source_candidates_html, loading_html,
+                                    idle_html)
+from modules.cache import (MAX_SENSORS, cached_water_network,
+                           cached_pollution_dynamics, cached_scenario_frames,
+                           cached_level_of_detail, cached_scenario_analytics,
+                           cached_sensor_placement, cached_source_index,
+                           cached_node_index, network_signature)
+from modules.browser_animation import (BROWSER_MODE, browser_frames_data,
+                                       browser_endpoints_data,
+                                       browser_view_data,
+                                       browser_animation_callbacks,
+                                       browser_animation_stop,
+                                       browser_visibility_callback)
+from modules.frames import (INTERPOLATION_STEPS, PALETTE_BINS, PALETTE_SIZE,
+                            update_column)
+from modules.load_data import (get_networks, get_custom_networks,
+                               edge_endpoints)
+from modules.loading import load_in_background, load_network
+from modules.metrics import CALLBACK_SECONDS, IDLE_SESSIONS, timed
+from modules.pollution import pollution_history
+from modules.sessions import IDLE_CHECK_SECONDS, IDLE_MINUTES, SessionActivity
+from modules.sources import parse_observations
+
+
+@timed(CALLBACK_SECONDS, 'launch')
+def launch(network, signature=None):
+    """Show a network in the document, returning the function that closes
+    it. Its data is looked up in the network cache with the signature of
+    its files, found here unless it was found when the network was loaded"""
+    if signature is None:
+        signature = network_signature(network)
     callback_id = None
     # Labels for the play/pause button in paused and playing states
     # respectively
     BUTTON_LABEL_PAUSED = '► Start Pollution'
     BUTTON_LABEL_PLAYING = '❚❚ Pause'
+    # Index of the animation mode that interpolates between timesteps
+    SMOOTH_MODE = 2
     # Node scaling factor
     NODE_SCALING = 15
 
@@ -40,6 +71,34 @@ def launch(network):
     # Color of selected node type
     type_highlight_color = "purple"
 
+    # Color of nodes chosen for sensors (red)
+    sensor_color = "#e6194b"
+
+    # Color of the candidate sources of observed pollution (orange)
+    candidate_color = "#f58231"
+
+    # Highlights in increasing priority, a node or edge drawn for several
+    # network nodes or edges shows the highest priority highlight of them
+    (TYPE_HIGHLIGHT, SENSOR_HIGHLIGHT, CANDIDATE_HIGHLIGHT, HISTORY_HIGHLIGHT,
+     INJECTION_HIGHLIGHT) = 1, 2, 3, 4, 5
+    highlight_colors = np.array([None, type_highlight_color, sensor_color,
+                                 candidate_color, highlight_color,
+                                 injection_color], dtype=object)
+
+    # What the node colors can show, the pollution at the current timestep
+    # or a measure of the whole scenario from the pollution analytics
+    color_by_measures = {
+        'Pollution': None,
+        'Arrival Time': 'arrival',
+        'Time to Peak': 'time_to_peak',
+        'Peak Pollution': 'peak',
+        'Exposure': 'exposure'
+    }
+    # Measures of time, a node drawn for several network nodes shows the
+    # earliest of them
+    TIME_MEASURES = ['arrival', 'time_to_peak']
+
+    @timed(CALLBACK_SECONDS, 'update_highlights')
     def update_highlights():
         """Set the color and width for each node and edge in the graph."""
 
@@ -47,70 +106,52 @@ def launch(network):
         highlight_width = 3.0
         normal_width = 2.0
 
-        # Create a default dictionary for node types, any node with a type not
-        # in the dictionary gets the default color
-        colors = defaultdict(lambda: "magenta")
-        colors.update({
-            'Junction': 'gray',
-            'Reservoir': 'orange',
-            'Tank': 'green'
-            })
-
-        injection = pollution_injection_select.value
-        node_to_highlight = pollution_history_select.value
+        injection = pollution_injection_input.value
+        node_to_highlight = pollution_history_input.value
         type_highlight = node_type_select.value
 
-        outline_colors = []
-        outline_widths = []
-        for node in G.nodes():
-            if node == injection:
-                # Color injection node the injection color
-                outline_colors.append(injection_color)
-                outline_widths.append(highlight_width)
-            elif node == node_to_highlight:
-                # Color selected node bright green
-                outline_colors.append(highlight_color)
-                outline_widths.append(highlight_width)
-            else:
-                # Otherwise color based on the node type
-                node_type = G.nodes[node]['type']
-                if node_type == type_highlight:
-                    outline_colors.append(type_highlight_color)
-                else:
-                    outline_colors.append(colors[node_type])
-                outline_widths.append(normal_width)
+        # Color the injection node the injection color, then the selected
+        # node bright green, otherwise color based on the node type
+        highlights = np.zeros(len(node_names), dtype=np.int8)
+        highlights[node_types == type_highlight] = TYPE_HIGHLIGHT
+        highlights[sensors] = SENSOR_HIGHLIGHT
+        highlights[[node_index.position(node) for node in candidates]] = (
+            CANDIDATE_HIGHLIGHT)
+        if node_to_highlight in node_index:
+            highlights[node_index.position(node_to_highlight)] = (
+                HISTORY_HIGHLIGHT)
+        highlights[node_index.position(injection)] = INJECTION_HIGHLIGHT
 
         # Set colors for edges so that those connected to a colored node
         # are also that color, to increase visibility
-        edge_colors = []
-        edge_widths = []
+        edge_highlights = np.maximum(highlights[sources], highlights[targets])
+
+        highlights = view.node_values(highlights)
+        outline_colors = np.where(highlights == 0,
+                                  node_type_colors[view.nodes],
+                                  highlight_colors[highlights])
+        outline_widths = np.where(highlights >= SENSOR_HIGHLIGHT,
+                                  highlight_width, normal_width)
+
         highlight_edge_width = shadow_width + 1.0
-        for edge in G.edges():
-            if edge[0] == injection or edge[1] == injection:
-                edge_colors.append(injection_color)
-                edge_widths.append(highlight_edge_width)
-            elif edge[0] == node_to_highlight or edge[1] == node_to_highlight:
-                edge_colors.append(highlight_color)
-                edge_widths.append(highlight_edge_width)
-            else:
-                type1 = G.nodes[edge[0]]['type']
-                type2 = G.nodes[edge[1]]['type']
-                if type1 == type_highlight or type2 == type_highlight:
-                    edge_colors.append(type_highlight_color)
-                else:
-                    edge_colors.append('gray')
-                edge_widths.append(shadow_width)
+        edge_highlights = view.edge_values(edge_highlights)
+        edge_colors = np.where(edge_highlights == 0, 'gray',
+                               highlight_colors[edge_highlights])
+        edge_widths = np.where(edge_highlights >= HISTORY_HIGHLIGHT,
+                               highlight_edge_width, shadow_width)
 
         data = graph.node_renderer.data_source.data
-        data['line_color'], data['line_width'] = outline_colors, outline_widths
+        data['line_color'], data['line_width'] = (outline_colors.tolist(),
+                                                  outline_widths)
 
-        edge_data = graph_shadow.edge_renderer.data_source.data
-        edge_data['line_color'], edge_data['line_width'] = (edge_colors,
-                                                            edge_widths)
+        edge_data = graph.edge_renderer.data_source.data
+        edge_data['shadow_color'], edge_data['shadow_width'] = (
+            edge_colors.tolist(), edge_widths)
 
+    @timed(CALLBACK_SECONDS, 'update_pollution_history')
     def update_pollution_history():
-        history_node = pollution_history_select.value
-        history = pollution_history(scenario, history_node)
+        history_node = pollution_history_input.value
+        history = pollution_history(frames, history_node)
         # Set these at the same time to avoid bokeh user error
         pollution_history_source.data = {'time': history.index,
                                          'pollution_value': history.values}
@@ -126,39 +167,175 @@ def launch(network):
             pollution_history_plot.x_range.update(start=0, end=0)
             pollution_history_plot.y_range.update(start=0, end=0)
 
+    @timed(CALLBACK_SECONDS, 'update')
     def update():
         """Update the appearance of the pollution dynamics network,
         including node and edge colors"""
+        nonlocal displayed_frame
         timestep = time_slider.value
-        # Get pollution for each node for the given injection site and timestep
-        series = pollution_series(scenario, timestep)
-
-        data = graph.node_renderer.data_source.data
+        # Get pollution for each node and edge for the given injection site
+        # and timestep
+        node_values, edge_values = view_frame(timestep)
 
         # Set the timer text
         timer.text = timer_html(timestep)
-        # Update node colours
-        data['colors'] = list(series)
-
-        # Update edge colours
-        edge_values = []
-        for node1, node2 in G.edges():
-            node1_pollution = series[node1]
-            node2_pollution = series[node2]
-            # The edge color should be the mean of the connected nodes
-            # except when one node is zero, which indicates pollution
-            # is yet to spread through that edge (pipe)
-            if node1_pollution == 0 or node2_pollution == 0:
-                edge_values.append(0)
-            else:
-                edge_values.append((node1_pollution + node2_pollution) / 2.)
-        graph.edge_renderer.data_source.data['colors'] = edge_values
+
+        # Update node and edge colours, only sending the values that have
+        # changed since the last frame
+        displayed_node_values, displayed_edge_values = displayed_frame
+        update_column(graph.node_renderer.data_source, 'colors',
+                      displayed_node_values, node_values)
+        update_column(graph.edge_renderer.data_source, 'colors',
+                      displayed_edge_values, edge_values)
+        displayed_frame = (node_values, edge_values)
+        if PALETTE_BINS:
+            update_pollution(timestep)
 
         # Update timestep span on pollution history plot
         timestep_span.update(location=timestep)
 
+    def analytics_data():
+        """Get the pollution analytics of each node drawn, nodes pollution
+        never reaches have no arrival time or time to peak"""
+        data = {}
+        for measure, values in analytics.items():
+            if measure in TIME_MEASURES:
+                values = view.node_values(values, np.minimum)
+                values = np.where(np.isfinite(values), values, np.nan)
+            else:
+                values = view.node_values(values)
+            data[measure] = values
+        return data
+
+    def update_color_by():
+        """Color the nodes by the pollution or by the chosen measure of the
+        scenario, scaling the colors to the measure's values"""
+        measure = color_by_measures[color_by_select.value]
+        if measure is None:
+            fill_color = color_mapper
+        else:
+            mapper = measure_mappers[measure]
+            values = analytics[measure]
+            if measure in TIME_MEASURES:
+                values = values[np.isfinite(values)]
+            else:
+                values = values[values > 0]
+            if len(values) > 0:
+                mapper.update(low=values.min(), high=values.max())
+            fill_color = {'field': measure, 'transform': mapper}
+        graph.node_renderer.glyph.fill_color = fill_color
+        graph.node_renderer.nonselection_glyph.fill_color = fill_color
+        # The color bar shows pollution values, rather than palette bins
+        color_bar.update(color_mapper=(pollution_legend if measure is None
+                                       else fill_color['transform']),
+                         ticker=(BasicTicker() if measure in TIME_MEASURES
+                                 else LogTicker()))
+
+    def update_color_by_select(attrname, old, new):
+        """Color nodes by drop down callback"""
+        update_color_by()
+
+    def view_frame(timestep):
+        """Get the colors of each node and edge drawn at a timestep, their
+        pollution or, with PALETTE_BINS, its bin in the palette"""
+        interpolate = animation_mode.active == SMOOTH_MODE
+        if PALETTE_BINS:
+            node_values, edge_values = frames.bins_frame(timestep,
+                                                         interpolate)
+        else:
+            node_values, edge_values = frames.frame(timestep, interpolate)
+        return view.node_values(node_values), view.edge_values(edge_values)
+
+    def view_pollution(timestep):
+        """Get the pollution of each node drawn at a timestep for the
+        tooltips when the colors are palette bins, or None while the
+        animation plays, as sending them would make each frame much larger"""
+        if play_button.label == BUTTON_LABEL_PLAYING:
+            return None
+        node_values, _ = frames.frame(
+            timestep, interpolate=animation_mode.active == SMOOTH_MODE)
+        return view.node_values(node_values)
+
+    def update_pollution(timestep):
+        """Send the pollution of each node drawn to the tooltips, which
+        show no values while the animation plays"""
+        nonlocal displayed_pollution
+        pollution = view_pollution(timestep)
+        if pollution is None:
+            if displayed_pollution is not None:
+                graph.node_renderer.data_source.data['pollution'] = np.full(
+                    len(view.nodes), np.nan)
+        else:
+            update_column(graph.node_renderer.data_source, 'pollution',
+                          displayed_pollution, pollution)
+        displayed_pollution = pollution
+
+    def draw_view(new_view):
+        """Replace the nodes and edges drawn in the graph with those of a
+        view of the network"""
+        nonlocal view
+        nonlocal displayed_frame
+        nonlocal displayed_pollution
+        view = new_view
+        node_data, edge_data, layout = lod.graph_data(view)
+        node_values, edge_values = view_frame(time_slider.value)
+        # The values of a view drawing every node are the cached frames
+        # themselves, so the columns patched by update_column are copies
+        node_data['colors'] = np.array(node_values)
+        node_data['size'] = (node_size_slider.value
+                             + all_base_demands[view.nodes]*NODE_SCALING)
+        edge_data['colors'] = np.array(edge_values)
+        if PALETTE_BINS:
+            displayed_pollution = view_pollution(time_slider.value)
+            node_data['pollution'] = (
+                np.full(len(view.nodes), np.nan)
+                if displayed_pollution is None
+                else np.array(displayed_pollution))
+        node_data.update(analytics_data())
+        graph.node_renderer.data_source.data = node_data
+        graph.edge_renderer.data_source.data = edge_data
+        graph.layout_provider.graph_layout = layout
+        displayed_frame = (node_values, edge_values)
+        update_highlights()
+        update_browser_view()
+
+    def update_view():
+        """Draw the nodes and edges suited to the area shown by the plot"""
+        nonlocal view_update_pending
+        view_update_pending = False
+        if frames is None:
+            # The network was closed while the update was queued
+            return
+        new_view = lod.view(plot.x_range.start, plot.x_range.end,
+                            plot.y_range.start, plot.y_range.end, view)
+        if new_view is not view:
+            draw_view(new_view)
+
+    def update_range(attrname, old, new):
+        """Plot range callback.
+        Zooming and panning change the start and end of both ranges, so the
+        nodes and edges to draw are chosen once, on the next tick"""
+        nonlocal view_update_pending
+        if not view_update_pending:
+            view_update_pending = True
+            curdoc().add_next_tick_callback(update_view)
+
+    def update_node_completions(widget, index, attrname, old, new):
+        """Node name input callback, called as each character is typed.
+        Offers the names starting with the text typed, so that the names of
+        every node are never sent to the browser"""
+        widget.completions = index.search(new)
+
     def update_pollution_history_node(attrname, old, new):
-        """Select node to show pollution history for and highlight it green."""
+        """Select node to show pollution history for and highlight it green.
+        Clearing the input shows no history, other names that aren't nodes
+        are ignored"""
+        if new == "":
+            pollution_history_input.value = "None"
+            return
+        if new != "None" and new not in node_index:
+            pollution_history_input.value = old
+            return
         update_highlights()
         update_pollution_history()
         history_node = new
@@ -191,11 +368,11 @@ def launch(network):
         # It's possible to click multiple nodes when they overlap, but we only
         # want one
         first_clicked_node_int = nodes_clicked_ints[0]
-        clicked_node = list(G.nodes())[first_clicked_node_int]
+        clicked_node = node_names[view.nodes[first_clicked_node_int]]
         if what_click_does.active == click_options['Pollution History Plot']:
-            pollution_history_select.value = clicked_node
+            pollution_history_input.value = clicked_node
         if what_click_does.active == click_options['Pollution Injection Node']:
-            pollution_injection_select.value = clicked_node
+            pollution_injection_input.value = clicked_node
 
     def update_node_type_highlight(attrname, old, new):
         """Highlight node type drop down callback.
@@ -205,25 +382,152 @@ def launch(network):
         node_type = node_type_select.value
         type_div.text = node_type_html(node_type, type_highlight_color)
 
+    def update_sensors(attrname, old, new):
+        """Sensor budget slider callback.
+        Highlights the best nodes for that many sensors to detect the
+        pollution scenarios. The placement is calculated from every scenario
+        of the network in the background the first time it is needed"""
+        nonlocal sensors
+        if new == 0:
+            sensors = []
+            sensor_div.text = sensor_placement_html()
+            update_highlights()
+        else:
+            sensor_div.text = sensor_placement_html(pending=True)
+            when_loaded(load_in_background(cached_sensor_placement,
+                                           network, signature),
+                        partial(show_sensors, new))
+
+    def show_sensors(n_sensors, future):
+        """Highlight the nodes chosen for sensors once the placement has
+        loaded, unless the slider has moved since"""
+        nonlocal sensors
+        if sensor_slider.value != n_sensors:
+            return
+        index, placement = future.result()
+        sensors = placement[:n_sensors]
+        detected, mean_delay = index.detection(sensors)
+        sensor_div.text = sensor_placement_html(len(sensors), detected,
+                                                mean_delay, sensor_color)
+        update_highlights()
+
+    def when_loaded(future, callback):
+        """Call callback with the future of data loading in the background
+        on the next tick once it has loaded, unless the network has been
+        closed by then"""
+        def done(future):
+            if frames is not None:
+                doc.add_next_tick_callback(partial(loaded, future))
+
+        def loaded(future):
+            if frames is not None:
+                callback(future)
+        future.add_done_callback(done)
+
+    def find_sources():
+        """Find sources button callback.
+        Ranks the injection nodes by how well their scenarios match the
+        observed concentrations at the time shown, and highlights the best.
+        The source index is built in the background the first time it is
+        needed"""
+        nonlocal candidates
+        try:
+            observations = parse_observations(observations_input.value)
+        except ValueError as error:
+            candidates = []
+            sources_div.text = source_candidates_html(error=str(error))
+            update_highlights()
+            return
+        sources_div.text = source_candidates_html(pending=True)
+        when_loaded(load_in_background(cached_source_index, network,
+                                       signature),
+                    partial(rank_sources, observations, time_slider.value))
+
+    def rank_sources(observations, timestep, future):
+        """Rank the injection nodes once the source index has loaded"""
+        nonlocal candidates
+        try:
+            ranked = future.result().rank(observations, timestep)
+        except ValueError as error:
+            candidates = []
+            sources_div.text = source_candidates_html(error=str(error))
+        else:
+            candidates = [injection for injection, _ in ranked]
+            sources_div.text = source_candidates_html(ranked,
+                                                      candidate_color)
+        update_highlights()
+
     def update_time_slider(attrname, old, new):
         """Time slider callback.
         As node colours depend on many widget values, this callback simply
         calls the update function."""
+        if browser_playing():
+            # The browser has already drawn this frame itself
+            return
         update()
 
+    def browser_playing():
+        """Whether the animation is being played by the browser"""
+        return (play_button.label == BUTTON_LABEL_PLAYING
+                and animation_mode.active == BROWSER_MODE)
+
+    def update_browser_frames():
+        """Send the scenario to the browser when it plays the animation,
+        otherwise release the copy held by the browser"""
+        if animation_mode.active == BROWSER_MODE:
+            frames_source.data = browser_frames_data(frames)
+            update_browser_view()
+        elif len(frames_source.data['values']) > 0:
+            frames_source.data = {'values': []}
+
+    def update_browser_view():
+        """Send the nodes and edges drawn to the browser when it plays the
+        animation"""
+        nonlocal browser_view
+        if animation_mode.active != BROWSER_MODE or browser_view is view:
+            return
+        endpoints = browser_endpoints_data(sources, targets, view)
+        if len(endpoints_source.data['sources']) == 0:
+            endpoints_source.data = endpoints
+        else:
+            # The end points never change, only the edges drawn
+            endpoints_source.data['groups'] = endpoints['groups']
+        view_source.data = browser_view_data(view)
+        browser_view = view
+
+    def update_animation_mode(attrname, old, new):
+        """Animation mode radio group callback.
+        Pauses any playing animation and sends or releases the scenario
+        data the browser needs to play the animation. Leaving the smooth
+        animation moves the slider back to the last timestep with data"""
+        if play_button.label == BUTTON_LABEL_PLAYING:
+            animate()
+        if old == SMOOTH_MODE:
+            timestep = time_slider.value
+            time_slider.value = timestep - (timestep - start_step) % step_size
+        update_browser_frames()
+
+    @timed(CALLBACK_SECONDS, 'update_injection')
     def update_injection(attrname, old, new):
-        """Pollution injection node location drop down callback.
-        The nonlocal variable scenario, which holds the dataframe of pollution
-        dynamics is updated.
+        """Pollution injection node location input callback.
+        The nonlocal variable frames, which holds the node and edge pollution
+        values at each timestep, is updated.
         As the injection site affects both the node highlights and pollution
         data, his callback calls both the update highlights and the update
-        functions"""
-        nonlocal scenario
-        scenario = pollution_scenario(pollution, new)
+        functions. Names that aren't injection nodes are ignored"""
+        nonlocal frames, analytics
+        if new not in injection_index:
+            pollution_injection_input.value = old
+            return
+        frames = cached_scenario_frames(network, new, signature)
+        analytics = cached_scenario_analytics(network, new, signature)
+        graph.node_renderer.data_source.data.update(analytics_data())
+        update_color_by()
+        update_browser_frames()
         update_highlights()
         update_pollution_history()
         update()
-        injection_node = pollution_injection_select.value
+        injection_node = pollution_injection_input.value
         pollution_location_div.text = pollution_location_html(injection_node,
                                                               injection_color)
 
@@ -231,27 +535,41 @@ def launch(network):
         """Node size slider callback.
         Updates the base size of the nodes in the graph"""
         graph.node_renderer.data_source.data['size'] = (
-            new + all_base_demands*NODE_SCALING
+            new + all_base_demands[view.nodes]*NODE_SCALING
             )
 
     def step():
-        """Move the time slider by one step"""
-        timestep = time_slider.value + step_size
+        """Move the time slider by one step, or by a fraction of one when
+        animating smoothly"""
+        timestep = time_slider.value + animation_step()
         if timestep > end_step:
             timestep = start_step
         time_slider.value = timestep
 
     def animate():
         """Move the time slider at animation_speed ms/frame
-        on play button click"""
+        on play button click. In browser mode the browser moves the slider
+        itself, using the callbacks from browser_animation_callbacks"""
         nonlocal callback_id
         nonlocal animation_speed
+        nonlocal displayed_frame
         if play_button.label == BUTTON_LABEL_PAUSED:
             play_button.label = BUTTON_LABEL_PLAYING
-            callback_id = curdoc().add_periodic_callback(step, animation_speed)
+            if animation_mode.active != BROWSER_MODE:
+                callback_id = curdoc().add_periodic_callback(
+                    step, animation_period())
         elif play_button.label == BUTTON_LABEL_PLAYING:
             play_button.label = BUTTON_LABEL_PAUSED
-            curdoc().remove_periodic_callback(callback_id)
+            if callback_id is not None:
+                curdoc().remove_periodic_callback(callback_id)
+                callback_id = None
+            else:
+                # The browser changed the colours without the server, so
+                # send all of them for the frame it stopped at
+                displayed_frame = (None, None)
+                update()
+        if PALETTE_BINS:
+            update_pollution(time_slider.value)
 
     def update_speed(attrname, old, new):
         """Adjust the animation speed"""
@@ -262,9 +580,44 @@ def launch(network):
         animation_speed = speeds[new]
 
         # If animation is playing recreate the periodic callback
-        if play_button.label == BUTTON_LABEL_PLAYING:
+        if callback_id is not None:
+            curdoc().remove_periodic_callback(callback_id)
+            callback_id = curdoc().add_periodic_callback(step,
+                                                         animation_period())
+
+    def pause_hidden(attrname, old, new):
+        """Page hidden callback.
+        Pauses the animation while the page is hidden, as nobody is
+        watching it. The browser has already stopped any animation it was
+        playing"""
+        if new and play_button.label == BUTTON_LABEL_PLAYING:
+            animate()
+
+    def close(session_closed=False):
+        """Stop the animation and release the scenario of the network, once
+        another network replaces it or the session has closed, which has
+        already removed the periodic callbacks of the document"""
+        nonlocal callback_id, frames, analytics
+        if frames is None:
+            # Already closed, for being idle
+            return
+        if callback_id is not None and not session_closed:
             curdoc().remove_periodic_callback(callback_id)
-            callback_id = curdoc().add_periodic_callback(step, animation_speed)
+        callback_id = None
+        frames = analytics = None
+        page_hidden.remove_on_change('active', pause_hidden)
+        activity.forget(time_slider, timer, timestep_span)
+
+    def animation_step():
+        """The seconds the slider moves by each frame of the animation"""
+        if animation_mode.active == SMOOTH_MODE:
+            return max(step_size // INTERPOLATION_STEPS, 1)
+        return step_size
+
+    def animation_period():
+        """The ms between frames of the animation, so that the timesteps
+        pass at animation_speed however many frames are drawn for each"""
+        return max(animation_speed * animation_step() // step_size, 1)
 
     def plot_bounds(locations):
         # Get lists of node locations
@@ -286,10 +639,35 @@ def launch(network):
 
         return Range1d(x_lower, x_upper), Range1d(y_lower, y_upper)
 
-    G, locations, all_base_demands, include_map = load_water_network(network)
+    # Network data is cached and shared between all sessions of the server,
+    # so it must not be modified here
+    (G, locations, all_base_demands,
+     include_map) = cached_water_network(network, signature)
 
     (pollution, injection_nodes, start_node, start_step, end_step, step_size,
-     max_pol, min_pol) = load_pollution_dynamics(network)
+     max_pol, min_pol) = cached_pollution_dynamics(network, signature)
+
+    # Arrays of node properties and edge end points, in the order used by
+    # the graph renderer, for setting colors without looping over the graph
+    node_index, injection_index = cached_node_index(network, signature)
+    node_names = node_index.names
+    node_types = np.array([G.nodes[node]['type'] for node in node_names],
+                          dtype=object)
+    sources, targets = edge_endpoints(G)
+
+    # Which nodes and edges to draw, for the area shown
+    lod = cached_level_of_detail(network, signature)
+
+    # Create a default dictionary for node types, any node with a type not
+    # in the dictionary gets the default color
+    colors = defaultdict(lambda: "magenta")
+    colors.update({
+        'Junction': 'gray',
+        'Reservoir': 'orange',
+        'Tank': 'green'
+        })
+    node_type_colors = np.array([colors[node_type]
+                                 for node_type in node_types], dtype=object)
 
     # Create figure object
     x_bounds, y_bounds = plot_bounds(locations)
@@ -305,11 +683,20 @@ def launch(network):
         tile_provider = get_provider(Vendors.CARTODBPOSITRON)
         plot.add_tile(tile_provider)
 
-    # Create bokeh graph from the NetworkX object
-    graph = from_networkx(G, locations)
+    # Create bokeh graph, the nodes and edges drawn are added by draw_view
+    graph = GraphRenderer(layout_provider=StaticLayoutProvider())
 
-    # Define color map for pollution
+    # Define color map for pollution, the color bar always shows its log
+    # scale. With PALETTE_BINS the server finds the palette bin of each
+    # value, so frames are sent as uint8 bins mapped straight to colors,
+    # and the values are sent for the tooltips when the animation stops
     color_mapper = log_cmap('colors', cc.CET_L18, min_pol, max_pol)
+    pollution_legend = color_mapper['transform']
+    if PALETTE_BINS:
+        color_mapper = {'field': 'colors',
+                        'transform': LinearColorMapper(
+                            palette=cc.CET_L18, low=-0.5,
+                            high=PALETTE_SIZE - 0.5)}
 
     # Create nodes, set the node colors by pollution level and size
     # by base demand. Node outline color and thickness is different
@@ -325,8 +712,16 @@ def launch(network):
                                                     line_color="line_color",
                                                     line_width="line_width")
 
+    # Color maps for the pollution analytics, earlier times are hotter
+    measure_mappers = {
+        'arrival': LinearColorMapper(palette=cc.CET_L18[::-1]),
+        'time_to_peak': LinearColorMapper(palette=cc.CET_L18[::-1]),
+        'peak': LogColorMapper(palette=cc.CET_L18),
+        'exposure': LogColorMapper(palette=cc.CET_L18)
+    }
+
     # Add color bar as legend
-    color_bar = ColorBar(color_mapper=color_mapper['transform'],
+    color_bar = ColorBar(color_mapper=pollution_legend,
                          ticker=LogTicker(),
                          label_standoff=12,
                          location=(0, 0))
@@ -338,15 +733,19 @@ def launch(network):
                                           line_color=color_mapper)
 
     # Create 'shadow' of the network edges so that they stand out
-    # against the map
-    graph_shadow = from_networkx(G, locations)
+    # against the map. It shares the data sources and layout of the graph,
+    # drawing the edges again from the 'shadow_color' and 'shadow_width'
+    # columns, so the network is only sent to the browser once
+    graph_shadow = GraphRenderer(layout_provider=graph.layout_provider)
+    for renderer, source in [
+            (graph_shadow.node_renderer, graph.node_renderer.data_source),
+            (graph_shadow.edge_renderer, graph.edge_renderer.data_source)]:
+        renderer.data_source = source
+        renderer.view = CDSView(source=source)
     shadow_width = edge_width*1.5
-    graph_shadow.edge_renderer.glyph = MultiLine(line_width="line_width",
-                                                 line_color="line_color")
-    graph_shadow.node_renderer.glyph = Circle(size=0.1,
-                                              fill_color="black",
-                                              line_color="black",
-                                              line_width=1)
+    graph_shadow.edge_renderer.glyph = MultiLine(line_width="shadow_width",
+                                                 line_color="shadow_color")
+    graph_shadow.node_renderer.visible = False
 
     # Green hover for both nodes and edges
     hover_color = '#abdda4'
@@ -373,13 +772,26 @@ def launch(network):
         ("Elevation", "@elevation"),
         ("Connected", "@connected"),
         ("Base Demand", "@demand"),
-        ("Pollution Level", "@colors")
+        ("Pollution Level", "@pollution" if PALETTE_BINS else "@colors"),
+        ("Arrival Time", "@arrival{00:00:00}"),
+        ("Time to Peak", "@time_to_peak{00:00:00}"),
+        ("Peak Pollution", "@peak"),
+        ("Exposure", "@exposure")
     ]
-    plot.add_tools(HoverTool(tooltips=TOOLTIPS), TapTool())
+    plot.add_tools(HoverTool(tooltips=TOOLTIPS, renderers=[graph]),
+                   TapTool())
 
     # Set clicking a node to choose pollution history
     plot.select(type=TapTool)
     plot.on_event(Tap, update_click_node)
+    plot.on_event(Tap, activity.touch)
+
+    # Large networks are drawn in more detail as the plot is zoomed in
+    view_update_pending = False
+    if lod.enabled:
+        for plot_range in (plot.x_range, plot.y_range):
+            plot_range.on_change('start', update_range)
+            plot_range.on_change('end', update_range)
 
     # Pollution history plot
     pollution_history_source = ColumnDataSource(
@@ -406,12 +818,18 @@ def launch(network):
     # Play button to move the slider for the pollution timeseries
     play_button = Button(label=BUTTON_LABEL_PAUSED, button_type="success")
     play_button.on_click(animate)
-
-    # Menu to highlight nodes green and display pollution history
-    pollution_history_select = Select(title="Pollution History Plot Node",
-                                      value="None",
-                                      options=['None']+list(G.nodes()))
-    pollution_history_select.on_change('value', update_pollution_history_node)
+    play_button.on_click(activity.touch)
+
+    # Input to highlight nodes green and display pollution history, offering
+    # the names that match the text typed
+    pollution_history_input = AutocompleteInput(
+        title="Pollution History Plot Node", value="None",
+        placeholder="Type a node name", min_characters=1,
+        case_sensitive=False)
+    pollution_history_input.on_change(
+        'value_input', partial(update_node_completions,
+                               pollution_history_input, node_index))
+    pollution_history_input.on_change('value', update_pollution_history_node)
 
     # Create a div to show the name of pollution history node
     pollution_history_node_div = Div(text=pollution_history_html())
@@ -428,22 +846,47 @@ def launch(network):
     # Create a div to show the selected node type to highlight
     type_div = Div(text=node_type_html())
 
-    # Dropdown menu to choose pollution start location
-    pollution_injection_select = Select(title="Pollution Injection Node",
-                                        value=injection_nodes[0],
-                                        options=injection_nodes)
-    pollution_injection_select.on_change('value', update_injection)
+    # Slider to choose the number of sensors to place, 0 for none
+    sensor_slider = Slider(start=0, end=min(MAX_SENSORS, len(node_names)),
+                           value=0, step=1, title="Sensors")
+    sensor_slider.on_change('value', update_sensors)
+
+    # Create a div to show how well the sensors detect pollution
+    sensor_div = Div(text=sensor_placement_html())
+
+    # Observed pollution to find the injection nodes that explain it
+    observations_input = TextInput(title="Observed Pollution at Time Shown",
+                                   placeholder="J-5=2.5, J-10=0")
+    find_sources_button = Button(label="Find Sources", button_type="warning")
+    find_sources_button.on_click(find_sources)
+    find_sources_button.on_click(activity.touch)
+
+    # Create a div to show the best matching injection nodes
+    sources_div = Div(text=source_candidates_html())
+
+    # Dropdown menu to choose what the node colors show
+    color_by_select = Select(title="Color Nodes By",
+                             value='Pollution',
+                             options=list(color_by_measures))
+    color_by_select.on_change('value', update_color_by_select)
+
+    # Input to choose pollution start location
+    pollution_injection_input = AutocompleteInput(
+        title="Pollution Injection Node", value=injection_nodes[0],
+        placeholder="Type an injection node name", min_characters=1,
+        case_sensitive=False)
+    pollution_injection_input.on_change(
+        'value_input', partial(update_node_completions,
+                               pollution_injection_input, injection_index))
+    pollution_injection_input.on_change('value', update_injection)
 
     # Create a div to show the name of pollution start node
-    injection_node = pollution_injection_select.value
+    injection_node = pollution_injection_input.value
     pol_html = pollution_location_html(injection_node, injection_color)
     pollution_location_div = Div(text=pol_html)
 
     # Dropdown menu to choose node size and demand weighting
     initial_node_size = 8
-    graph.node_renderer.data_source.data['size'] = (
-        initial_node_size + all_base_demands*NODE_SCALING
-        )
     node_size_slider = Slider(start=5, end=20, value=initial_node_size, step=1,
                               title="Base Node Size")
     node_size_slider.on_change('value', update_node_size)
@@ -458,6 +901,35 @@ def launch(network):
     # Create a div for the timer
     timer = Div(text="")
 
+    # Radio group to choose whether the server or the browser plays the
+    # animation. The browser is sent the whole scenario, then plays it without
+    # the server computing each frame
+    animation_mode = RadioGroup(labels=['Animate on Server',
+                                        'Animate in Browser',
+                                        'Animate Smoothly on Server'],
+                                active=0)
+    animation_mode.on_change('active', update_animation_mode)
+    frames_source = ColumnDataSource(data={'values': []})
+    endpoints_source = ColumnDataSource(data={'sources': [], 'targets': [],
+                                              'groups': []})
+    view_source = ColumnDataSource(data={'groups': []})
+    # The view whose nodes and edges the browser has been sent
+    browser_view = None
+    play_js, speed_js = browser_animation_callbacks(
+        animation_mode, speed_radio, speeds, time_slider, timer,
+        timestep_span, graph.node_renderer.data_source,
+        graph.edge_renderer.data_source, frames_source, endpoints_source,
+        view_source, pollution.timesteps, start_step, end_step, step_size,
+        (min_pol, max_pol, PALETTE_SIZE) if PALETTE_BINS else None)
+    play_button.js_on_click(play_js)
+    play_button.js_on_click(visibility_js)
+    speed_radio.js_on_change('active', speed_js)
+    animation_mode.js_on_change('active', browser_animation_stop())
+    # The browser moves these as it plays the animation, which isn't the
+    # user using the session
+    activity.ignore(time_slider, timer, timestep_span)
+    page_hidden.on_change('active', pause_hidden)
+
     # Create a radio button to choose what clicking a node does
     click_options_menu = ['Pollution History Plot', 'Pollution Injection Node']
     click_options = dict(zip(click_options_menu, [0, 1]))
@@ -473,18 +945,27 @@ def launch(network):
     # Create menu bar
     menu_bar = column(
         network_select,
-        row(pollution_history_select, pollution_history_node_div,
+        loading_div,
+        page_hidden,
+        row(pollution_history_input, pollution_history_node_div,
             sizing_mode="scale_height"),
-        row(pollution_injection_select, pollution_location_div,
+        row(pollution_injection_input, pollution_location_div,
             sizing_mode="scale_height"),
         Div(text="Clicking a Node selects it as:"),
         what_click_does,
         row(node_type_select, type_div,
             sizing_mode="scale_height"),
+        color_by_select,
+        sensor_slider,
+        sensor_div,
+        observations_input,
+        find_sources_button,
+        sources_div,
         node_size_slider,
         pollution_spread_info,
         row(play_button, speed_radio,
             sizing_mode="scale_height"),
+        animation_mode,
         time_slider,
         timer,
         width=220, sizing_mode="stretch_height"
@@ -504,21 +985,92 @@ def launch(network):
     )
 
     # Initialise
-    scenario = pollution_scenario(pollution, pollution_injection_select.value)
+    frames = cached_scenario_frames(network, pollution_injection_input.value,
+                                    signature)
+    analytics = cached_scenario_analytics(
+        network, pollution_injection_input.value, signature)
+    # The node and edge values currently shown, set by draw_view
+    displayed_frame = (None, None)
+    # The pollution values of the nodes shown by the tooltips, None while
+    # the animation plays, set by draw_view
+    displayed_pollution = None
     animation_speed = speeds[speed_radio.active]
+    # The positions of the nodes chosen for sensors
+    sensors = []
+    # The injection nodes that best match the observed pollution
+    candidates = []
+    view = None
+    draw_view(lod.view(x_bounds.start, x_bounds.end,
+                       y_bounds.start, y_bounds.end))
     update_pollution_history()
-    update_highlights()
     update()
 
     curdoc().clear()
     curdoc().add_root(layout)
     curdoc().title = "Water Network Pollution"
+    return close
 
 
+@timed(CALLBACK_SECONDS, 'switch_network')
 def switch_network(attrname, old, new):
-    """Switch the water network to the selected"""
-    network = new
-    launch(network)
+    """Switch the water network to the selected.
+    The network is loaded in a worker thread, so the server keeps
+    responding, and launched on the next tick once it has loaded. Loading a
+    network that has since been replaced by another choice is cancelled"""
+    global loading
+    cancel_loading()
+    loading_div.text = loading_html(new)
+    loading = load_network(new)
+    loading.add_done_callback(
+        lambda future: doc.add_next_tick_callback(
+            partial(finish_switch, new, future)))
+
+
+def finish_switch(network, future):
+    """Launch a network once it has loaded, unless it has been replaced,
+    then close the network it replaces"""
+    global loading, close_network
+    if future is not loading:
+        return
+    loading = None
+    error = future.exception()
+    if error is not None:
+        loading_div.text = loading_html(network, error)
+        return
+    loading_div.text = loading_html()
+    close_previous = close_network
+    close_network = launch(network, future.result())
+    close_previous()
+
+
+def cancel_loading():
+    """Cancel loading the network being switched to, if any"""
+    global loading
+    if loading is not None:
+        loading.cancel()
+        loading = None
+
+
+def close_session(session_context):
+    """Release the network of the session once it has closed"""
+    cancel_loading()
+    close_network(session_closed=True)
+
+
+def close_idle_session():
+    """Close the session once the user hasn't done anything for
+    IDLE_MINUTES, stopping its animation and releasing its network. The
+    page asks the user to reload it to start again"""
+    if not activity.idle():
+        return
+    IDLE_SESSIONS.inc()
+    doc.remove_periodic_callback(idle_check)
+    # Pause the animation as if the page was hidden
+    page_hidden.active = True
+    cancel_loading()
+    close_network()
+    doc.clear()
+    doc.add_root(Div(text=idle_html(IDLE_MINUTES)))
 
 
 # By default, we want example network ky2 to load into the bokeh app
@@ -537,5 +1089,28 @@ network_select = Select(title="Choose Water Network",
                         value=default_network,
                         options=networks)
 network_select.on_change('value', switch_network)
-
-launch(default_network)
+# Shows the network being loaded
+loading_div = Div(text=loading_html())
+# The future of the network being loaded, if any
+loading = None
+doc = curdoc()
+# Stop the animation of the previous network if the browser was playing it
+network_select.js_on_change('value', browser_animation_stop())
+
+# Active while the page is hidden, when the animation is paused, stopping
+# it first in the browser if the browser was playing it
+page_hidden = Toggle(visible=False)
+page_hidden.js_on_change('active', browser_animation_stop())
+# Reports the page being hidden, from the first click of a play button
+visibility_js = browser_visibility_callback(page_hidden)
+# When the user last did something, sessions left idle are closed
+activity = SessionActivity()
+activity.ignore(page_hidden)
+doc.on_change(activity.changed)
+if IDLE_MINUTES > 0:
+    idle_check = doc.add_periodic_callback(close_idle_session,
+                                           IDLE_CHECK_SECONDS * 1000)
+doc.on_session_destroyed(close_session)
+
+# Closes the network shown, returned by launch
+close_network = launch(default_network)
@@ -0,0 +1,157 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+from .pollution import node_positions
+from .scenarios import open_scenario_store
+
+# Pollution above this concentration counts as having reached a node
+DEFAULT_THRESHOLD = 0.01
+
+# The names of the measures of a pollution scenario at each node
+MEASURES = ['arrival', 'peak', 'time_to_peak', 'exposure']
+
+# Number of scenarios measured by each task given to a worker process
+CHUNK_SCENARIOS = 16
+
+# The scenario store of a worker process, see _measure_worker
+_worker = {}
+
+
+def scenario_analytics(values, timesteps, threshold=DEFAULT_THRESHOLD):
+    """
+    Measure how pollution reaches each node in one or more scenarios.
+
+    Args:
+        values (numpy.ndarray): The pollution values, with the shape
+            (timestep, node) for one scenario or (scenario, timestep, node)
+            for several.
+        timesteps (numpy.ndarray): The timesteps of the values in seconds.
+        threshold (float): The concentration pollution has to exceed to
+            count as having reached a node.
+
+    Returns:
+        dict: Arrays with the shape (node,) or (scenario, node) of
+            'arrival', the first timestep pollution exceeds the threshold,
+            'peak', the highest pollution, 'time_to_peak', the seconds from
+            pollution first reaching any node to the peak, and 'exposure',
+            the pollution integrated over time. The arrival and time to peak
+            are infinite at nodes pollution never reaches.
+    """
+    values = np.asarray(values)
+    timesteps = np.asarray(timesteps, dtype=float)
+    above = values > threshold
+    reached = above.any(axis=-2)
+    arrival = np.where(reached, timesteps[above.argmax(axis=-2)], np.inf)
+    peak = values.max(axis=-2)
+    peak_time = timesteps[values.argmax(axis=-2)]
+    # Pollution first reaches the network at the injection node
+    start = arrival.min(axis=-1)[..., np.newaxis]
+    time_to_peak = np.where(reached, peak_time - start, np.inf)
+    # Trapezium rule integral over time
+    steps = np.diff(timesteps)[:, np.newaxis]
+    exposure = ((values[..., 1:, :] + values[..., :-1, :]) / 2
+                * steps).sum(axis=-2)
+    return {'arrival': arrival, 'peak': peak, 'time_to_peak': time_to_peak,
+            'exposure': exposure}
+
+
+class PollutionAnalytics:
+    """
+    The arrival time, peak, time to peak and exposure of every node in every
+    pollution scenario of a network, see scenario_analytics.
+
+    Scenarios are read one at a time, so only the results, with the shape
+    (injection node, node), are held in memory.
+
+    Scenarios read from a directory (by a ScenarioStore or
+    ArrayScenarioStore) can be measured by several worker processes, each
+    opening the scenarios itself.
+
+    Args:
+        pollution (Mapping): The pollution scenario of each injection node.
+        injection_nodes (list): The injection nodes to measure.
+        nodes (list): The node labels in graph order.
+        threshold (float): The concentration pollution has to exceed to
+            count as having reached a node.
+        processes (int): The number of worker processes, None for the
+            number of CPUs, or 1 to measure every scenario in this process.
+    """
+
+    def __init__(self, pollution, injection_nodes, nodes,
+                 threshold=DEFAULT_THRESHOLD, processes=1):
+        self.injection_nodes = list(injection_nodes)
+        self.nodes = list(nodes)
+        self.threshold = threshold
+        self._rows = {node: i for i, node in enumerate(self.injection_nodes)}
+        shape = (len(self.injection_nodes), len(self.nodes))
+        for measure in MEASURES:
+            setattr(self, measure, np.empty(shape))
+
+        chunks = [self.injection_nodes[i:i + CHUNK_SCENARIOS]
+                  for i in range(0, len(self.injection_nodes),
+                                 CHUNK_SCENARIOS)]
+        directory = getattr(pollution, 'directory', None)
+        if processes == 1 or directory is None or len(chunks) < 2:
+            results = (_measure_scenarios(pollution, chunk, self.nodes,
+                                          threshold)
+                       for chunk in chunks)
+            self._store(chunks, results)
+        else:
+            checksums = getattr(pollution, 'checksums', None)
+            # The workers are started afresh rather than forked, as forking
+            # the threads of a bokeh server process can deadlock them
+            with ProcessPoolExecutor(max_workers=processes,
+                                     mp_context=get_context('spawn')
+                                     ) as executor:
+                self._store(chunks, executor.map(
+                    _measure_worker, [directory] * len(chunks),
+                    [checksums] * len(chunks), chunks,
+                    [self.nodes] * len(chunks),
+                    [threshold] * len(chunks)))
+
+    def _store(self, chunks, results):
+        """Copy the results of each chunk of scenarios into place"""
+        row = 0
+        for chunk, chunk_results in zip(chunks, results):
+            for measure in MEASURES:
+                getattr(self, measure)[row:row + len(chunk)] = (
+                    chunk_results[measure])
+            row += len(chunk)
+
+    def scenario(self, injection):
+        """
+        Get the results of one scenario.
+
+        Args:
+            injection (str): The node label of the injection site.
+
+        Returns:
+            dict: The results of each node, see scenario_analytics.
+        """
+        row = self._rows[injection]
+        return {measure: getattr(self, measure)[row] for measure in MEASURES}
+
+
+def _measure_scenarios(pollution, injections, nodes, threshold):
+    """Measure a chunk of scenarios, giving arrays of the shape
+    (injection node, node)"""
+    results = {measure: [] for measure in MEASURES}
+    for injection in injections:
+        scenario = pollution[injection]
+        positions = node_positions(scenario, nodes)
+        scenario_results = scenario_analytics(scenario.values[:, positions],
+                                              scenario.index.values,
+                                              threshold)
+        for measure in MEASURES:
+            results[measure].append(scenario_results[measure])
+    return {measure: np.array(values) for measure, values in results.items()}
+
+
+def _measure_worker(directory, checksums, injections, nodes, threshold):
+    """Measure a chunk of scenarios in a worker process, opening the
+    scenario store once per process"""
+    if _worker.get('directory') != directory:
+        _worker['directory'] = directory
+        _worker['pollution'] = open_scenario_store(directory, checksums)
+    return _measure_scenarios(_worker['pollution'], injections, nodes,
+                              threshold)
@@ -0,0 +1,279 @@
+from bokeh.models import CustomJS
+import numpy as np
+
+# Index of the browser option in the animation mode radio group
+BROWSER_MODE = 1
+
+# Animation state, kept on the window so that every callback can reach the
+# running timer
+_STATE_JS = """
+const state = window.water_animation || (window.water_animation = {})
+function stop() {
+    if (state.timer != null) {
+        clearInterval(state.timer)
+        state.timer = null
+        // The frames only moved the slider in the browser, tell the server
+        // where the animation stopped so that it draws that frame
+        state.slider.setv({value: state.slider.value}, {check_eq: false})
+    }
+}
+"""
+
+# Start or stop playing the scenario in the browser
+_PLAY_JS = _STATE_JS + """
+if (mode.active != browser_mode || state.timer != null) {
+    stop()
+    return
+}
+
+const rows = new Map()
+timesteps.forEach((t, i) => rows.set(t, i))
+
+// Show a change in the browser only. Changes set silently are neither sent
+// to the server nor drawn, so the views of the model are told about them
+// directly
+function show(model, attrs) {
+    model.setv(attrs, {silent: true})
+    for (const attr in attrs) {
+        model.properties[attr].change.emit()
+    }
+    model.change.emit()
+}
+
+function timer_html(timestep) {
+    // Matches the Python timedelta formatting used by the server
+    const days = Math.floor(timestep / 86400)
+    const seconds = timestep % 86400
+    const h = Math.floor(seconds / 3600)
+    const m = String(Math.floor(seconds % 3600 / 60)).padStart(2, '0')
+    const s = String(seconds % 60).padStart(2, '0')
+    let text = h + ':' + m + ':' + s
+    if (days > 0) {
+        text = days + (days == 1 ? ' day, ' : ' days, ') + text
+    }
+    return "<h1 style='color:grey'>Time: " + text + "</h1>"
+}
+
+// When bins is set the colour columns hold the palette bin of each value,
+// found as by a LogColorMapper, rather than the value
+function color(value) {
+    if (bins === null) {
+        return value
+    }
+    const [low, high, n_colors] = bins
+    if (!(value > low)) {
+        return 0
+    }
+    const scale = n_colors / ((Math.log(high) - Math.log(low)) || 1)
+    return Math.min(n_colors - 1,
+                    Math.floor((Math.log(value) - Math.log(low)) * scale))
+}
+
+state.frame = function () {
+    let timestep = slider.value + step_size
+    if (timestep > end_step) {
+        timestep = start_step
+    }
+    const row = rows.get(timestep)
+    // Read the scenario and the nodes and edges drawn each frame, as the
+    // server replaces them when the injection node or the view changes
+    const values = frames.data.values
+    const node_groups = view.data.groups
+    const edge_groups = endpoints.data.groups
+    const sources = endpoints.data.sources
+    const targets = endpoints.data.targets
+    const n_nodes = node_groups.length
+    const offset = row * n_nodes
+
+    // Colours are changed in place, which redraws the graph without
+    // sending the values back to the server. Each node and edge drawn
+    // shows the highest value of the network nodes and edges it stands for
+    const node_colors = node_source.data.colors
+    const edge_colors = edge_source.data.colors
+    const node_values = new Float64Array(node_colors.length)
+    const edge_values = new Float64Array(edge_colors.length)
+    if (row !== undefined) {
+        for (let i = 0; i < n_nodes; i++) {
+            const group = node_groups[i]
+            const value = values[offset + i]
+            if (group >= 0 && value > node_values[group]) {
+                node_values[group] = value
+            }
+        }
+        for (let i = 0; i < sources.length; i++) {
+            const group = edge_groups[i]
+            const a = values[offset + sources[i]]
+            const b = values[offset + targets[i]]
+            const value = (a == 0 || b == 0) ? 0 : (a + b) / 2
+            if (group >= 0 && value > edge_values[group]) {
+                edge_values[group] = value
+            }
+        }
+    }
+    for (let i = 0; i < node_colors.length; i++) {
+        node_colors[i] = color(node_values[i])
+    }
+    for (let i = 0; i < edge_colors.length; i++) {
+        edge_colors[i] = color(edge_values[i])
+    }
+    node_source.change.emit()
+    edge_source.change.emit()
+
+    // Shown in the browser only, so that playing sends nothing to the
+    // server until the animation stops
+    show(slider, {value: timestep})
+    show(timer, {text: timer_html(timestep)})
+    show(timestep_span, {location: timestep})
+}
+state.slider = slider
+state.timer = setInterval(state.frame, speeds[speed_radio.active])
+"""
+
+# Restart a playing animation at the newly chosen speed
+_SPEED_JS = _STATE_JS + """
+if (state.timer != null) {
+    clearInterval(state.timer)
+    state.timer = setInterval(state.frame, speeds[cb_obj.active])
+}
+"""
+
+
+def browser_frames_data(frames):
+    """
+    Produce the data for the ColumnDataSource that ships a pollution
+    scenario to the browser.
+
+    Args:
+        frames (ScenarioFrames): The node and edge values of the scenario.
+
+    Returns:
+        dict: The node values at every timestep, flattened row by row into a
+            single float32 column 'values'.
+    """
+    return {'values': frames.nodes.astype(np.float32).ravel()}
+
+
+def browser_endpoints_data(sources, targets, view):
+    """
+    Produce the data for the ColumnDataSource that ships the edge end points
+    to the browser.
+
+    Args:
+        sources (numpy.ndarray): The position of the first node of each edge.
+        targets (numpy.ndarray): The position of the second node of each edge.
+        view (NetworkView): The nodes and edges drawn.
+
+    Returns:
+        dict: The end points as int32 columns 'sources' and 'targets', and
+            the edge drawn for each edge as the int32 column 'groups'.
+    """
+    return {'sources': sources.astype(np.int32),
+            'targets': targets.astype(np.int32),
+            'groups': view.edge_groups.astype(np.int32)}
+
+
+def browser_view_data(view):
+    """
+    Produce the data for the ColumnDataSource that ships the nodes drawn to
+    the browser.
+
+    Args:
+        view (NetworkView): The nodes and edges drawn.
+
+    Returns:
+        dict: The node drawn for each network node as the int32 column
+            'groups'.
+    """
+    return {'groups': view.node_groups.astype(np.int32)}
+
+
+def browser_animation_callbacks(mode, speed_radio, speeds, time_slider,
+                                timer, timestep_span,
+                                node_source, edge_source, frames_source,
+                                endpoints_source, view_source, timesteps,
+                                start_step, end_step, step_size,
+                                bins=None):
+    """
+    Create the CustomJS callbacks that play a pollution scenario in the
+    browser, so that animation frames don't need the server.
+
+    Args:
+        mode (RadioGroup): The animation mode, the browser plays the
+            animation when the active option is BROWSER_MODE.
+        speed_radio (RadioGroup): The animation speed.
+        speeds (list): The ms per frame of each animation speed.
+        time_slider (Slider): The timestep slider.
+        timer (Div): The div showing the time.
+        timestep_span (Span): The timestep marker of the pollution history
+            plot.
+        node_source (ColumnDataSource): The graph node data.
+        edge_source (ColumnDataSource): The graph edge data.
+        frames_source (ColumnDataSource): The scenario, see
+            browser_frames_data.
+        endpoints_source (ColumnDataSource): The edge end points, see
+            browser_endpoints_data.
+        view_source (ColumnDataSource): The nodes drawn, see
+            browser_view_data.
+        timesteps (numpy.ndarray): The timesteps of the scenario.
+        start_step (int): The first timestep.
+        end_step (int): The last timestep.
+        step_size (int): The seconds between timesteps.
+        bins (tuple): The lowest and highest pollution value of the palette
+            and its number of colors, when the graph's colour columns hold
+            palette bins, or None when they hold the values.
+
+    Returns:
+        tuple: The CustomJS callbacks for clicks of the play button and
+            changes of the animation speed.
+    """
+    play = CustomJS(args=dict(mode=mode,
+                              browser_mode=BROWSER_MODE,
+                              speed_radio=speed_radio,
+                              speeds=speeds,
+                              slider=time_slider,
+                              timer=timer,
+                              timestep_span=timestep_span,
+                              node_source=node_source,
+                              edge_source=edge_source,
+                              frames=frames_source,
+                              endpoints=endpoints_source,
+                              view=view_source,
+                              timesteps=[int(t) for t in timesteps],
+                              start_step=int(start_step),
+                              end_step=int(end_step),
+                              step_size=int(step_size),
+                              bins=(None if bins is None
+                                    else [float(b) for b in bins])),
+                    code=_PLAY_JS)
+    speed = CustomJS(args=dict(speeds=speeds), code=_SPEED_JS)
+    return play, speed
+
+
+def browser_animation_stop():
+    """Create a CustomJS callback that stops any animation playing in the
+    browser"""
+    return CustomJS(code=_STATE_JS + "stop()")
+
+
+def browser_visibility_callback(page_hidden):
+    """
+    Create a CustomJS callback that, from then on, tells the server whether
+    the page is hidden, in a background tab or a minimised window. It only
+    listens once however many times it is run.
+
+    Args:
+        page_hidden (Toggle): The toggle made active while the page is
+            hidden.
+
+    Returns:
+        CustomJS: The callback, for clicks of the play button, as the page
+            being hidden only matters once an animation has been played.
+    """
+    return CustomJS(args=dict(page_hidden=page_hidden), code="""
+if (!window.water_visibility) {
+    window.water_visibility = true
+    document.addEventListener('visibilitychange', () => {
+        page_hidden.active = document.hidden
+    })
+}
+""")
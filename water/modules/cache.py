@@ -0,0 +1,420 @@
+import mmap
+import sys
+import threading
+from collections import OrderedDict
+from os import environ, scandir
+from os.path import isdir, join
+import numpy as np
+import pandas as pd
+from .analytics import PollutionAnalytics, scenario_analytics
+from .frames import PALETTE_BINS, ScenarioFrames
+from .lod import LevelOfDetail
+from .metrics import CounterFunction, Gauge
+from .load_data import (get_network_files_path, load_water_network,
+                        load_pollution_dynamics, edge_endpoints)
+from .pollution import pollution_scenario
+from .scenarios import SUMMARY_FILENAME
+from .search import NodeIndex
+from .sensors import DetectionIndex, place_sensors
+from .sources import (DENSE_SOURCE_INDEX_FILENAME, SOURCE_INDEX_FILENAMES,
+                      load_source_index)
+
+# Default upper bound on the memory held by the shared network cache, can be
+# overridden with the WATER_CACHE_MAX_BYTES environment variable
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+# Number of processes measuring the scenarios of a network for the pollution
+# analytics, by default the number of CPUs, can be overridden with the
+# WATER_ANALYTICS_PROCESSES environment variable
+ANALYTICS_PROCESSES = int(environ.get('WATER_ANALYTICS_PROCESSES', 0)) or None
+
+# Most sensors that can be placed on a network
+MAX_SENSORS = 50
+
+
+def nbytes(obj, _seen=None, growing=None):
+    """
+    Estimate the memory used by an object and everything it references.
+
+    numpy arrays and pandas objects report their own buffer sizes, containers
+    and plain objects (such as NetworkX graphs) are walked recursively. Each
+    object is only counted once. Objects that load more data as they are
+    used, such as scenario stores, report the size of what they have loaded
+    with a loaded_nbytes method, which isn't included.
+
+    Args:
+        obj: The object to size.
+        growing (list): If given, the objects with a loaded_nbytes method
+            are appended to it, to be measured again later.
+
+    Returns:
+        int: The approximate size of the object in bytes.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    if hasattr(obj, 'loaded_nbytes'):
+        if growing is not None:
+            growing.append(obj)
+        return sys.getsizeof(obj)
+
+    if isinstance(obj, np.ndarray):
+        # Memory mapped arrays live in the OS page cache, not in the process
+        base = obj
+        while isinstance(base, np.ndarray):
+            if isinstance(base, np.memmap):
+                return sys.getsizeof(obj)
+            base = base.base
+        if isinstance(base, mmap.mmap):
+            return sys.getsizeof(obj)
+        return obj.nbytes
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += (nbytes(key, _seen, growing)
+                     + nbytes(value, _seen, growing))
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += nbytes(item, _seen, growing)
+    elif hasattr(obj, '__dict__'):
+        size += nbytes(vars(obj), _seen, growing)
+    return size
+
+
+def freeze(obj, _seen=None):
+    """
+    Make the numpy arrays of an object, and of everything it references,
+    read only, walking the object as nbytes does. Objects that load more
+    data as they are used, and pandas objects, are left as they are.
+
+    Args:
+        obj: The object to freeze.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen or hasattr(obj, 'loaded_nbytes'):
+        return
+    _seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        obj.flags.writeable = False
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            freeze(value, _seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            freeze(item, _seen)
+    elif (hasattr(obj, '__dict__')
+          and not isinstance(obj, (pd.DataFrame, pd.Series, pd.Index))):
+        freeze(vars(obj), _seen)
+
+
+def _entry_size(entry):
+    """The size of a cache entry, measuring what its growing objects have
+    loaded since it was stored"""
+    _, size, growing = entry
+    return size + sum(obj.loaded_nbytes() for obj in growing)
+
+
+def is_derived_file(filename):
+    """Whether a file in a network directory is created by the app from the
+    other network files, so doesn't need to be part of the signature"""
+    return (filename.startswith('.') or filename.endswith('.tmp')
+            or filename in (SUMMARY_FILENAME, DENSE_SOURCE_INDEX_FILENAME)
+            or filename in SOURCE_INDEX_FILENAMES)
+
+
+def network_signature(network):
+    """
+    Produce a value that changes whenever any of the files of a network
+    change, or files are added or removed, used to invalidate cached copies
+    of the network. The directories' own modification times are left out,
+    as the app writes its derived files into them.
+
+    Args:
+        network (str): The name of the water network.
+
+    Returns:
+        tuple: (path, mtime) pairs for the network files.
+    """
+    file_path = get_network_files_path(network)
+    signature = []
+    for directory in (file_path, join(file_path, network)):
+        if not isdir(directory):
+            continue
+        for entry in scandir(directory):
+            if entry.is_file() and not is_derived_file(entry.name):
+                signature.append((entry.path, entry.stat().st_mtime))
+    return tuple(sorted(signature))
+
+
+class NetworkCache:
+    """
+    A thread-safe, least recently used cache of loaded network data.
+
+    A single instance is shared by every session of a bokeh server process,
+    as the modules are only imported once per process, so cached values must
+    not be modified. The numpy arrays they hold are made read only when they
+    are stored, see freeze. Entries are evicted, oldest first, when the
+    estimated size of all entries exceeds max_bytes. Concurrent requests for
+    the same missing entry wait for one load rather than all loading the
+    files themselves.
+
+    Args:
+        max_bytes (int): The maximum estimated size of all cached entries.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def size(self):
+        """The estimated size of all cached entries in bytes."""
+        with self._lock:
+            return sum(map(_entry_size, self._entries.values()))
+
+    def network_size(self, network):
+        """The estimated size in bytes of the cached entries of a network,
+        including those of its scenarios."""
+        with self._lock:
+            return sum(_entry_size(entry)
+                       for key, entry in self._entries.items()
+                       if key[1] == network or (isinstance(key[1], tuple)
+                                                and key[1][0] == network))
+
+    def get(self, key, loader):
+        """
+        Get the value for a key, calling loader to create it on a miss.
+
+        Args:
+            key (tuple): A hashable key, the first two items should be the
+                kind of data and the network name. Other entries for the same
+                kind and network are discarded when a new one is stored.
+            loader (callable): A function with no arguments that creates the
+                value.
+
+        Returns:
+            The cached or newly loaded value.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self._evict()
+                return self._entries[key][0]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have loaded the value while we waited
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+                self.misses += 1
+
+            try:
+                value = loader()
+                freeze(value)
+                growing = []
+                self._store(key, value, nbytes(value, growing=growing),
+                            growing)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+        return value
+
+    def _store(self, key, value, size, growing=()):
+        with self._lock:
+            # Drop entries made stale by changes to the network files
+            for stale_key in [k for k in self._entries if k[:2] == key[:2]]:
+                del self._entries[stale_key]
+            self._entries[key] = (value, size, list(growing))
+            self._evict()
+
+    def _evict(self):
+        """Evict the least recently used entries while the cache is too
+        big, always keeping the newest entry, even if it exceeds the limit.
+        Called with the lock held"""
+        sizes = [_entry_size(entry) for entry in self._entries.values()]
+        total = sum(sizes)
+        for evicted_size in sizes[:-1]:
+            if total <= self.max_bytes:
+                break
+            self._entries.popitem(last=False)
+            total -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+
+network_cache = NetworkCache(
+    int(environ.get('WATER_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+    )
+
+CounterFunction('water_cache_hits_total',
+                "Number of requests for network data found in the cache",
+                lambda: network_cache.hits)
+CounterFunction('water_cache_misses_total',
+                "Number of requests for network data that had to be loaded",
+                lambda: network_cache.misses)
+CounterFunction('water_cache_evictions_total',
+                "Number of entries evicted from the full cache",
+                lambda: network_cache.evictions)
+Gauge('water_cache_bytes', "Estimated size of the cached network data",
+      lambda: network_cache.size)
+Gauge('water_cache_entries', "Number of entries in the cache",
+      lambda: len(network_cache))
+
+
+# The cached_ functions take the network_signature of the network, so that
+# its files are only listed once for all the lookups of a launch, and find
+# it themselves if it isn't given. Loading an entry passes the signature on
+# to the entries it is made from
+def _signature(network, signature):
+    """The signature given, or the network_signature of the network"""
+    return network_signature(network) if signature is None else signature
+
+
+def cached_water_network(network, signature=None):
+    """Return load_water_network(network), shared between sessions."""
+    signature = _signature(network, signature)
+    key = ('water_network', network, signature)
+    return network_cache.get(key, lambda: load_water_network(network))
+
+
+def cached_pollution_dynamics(network, signature=None):
+    """Return load_pollution_dynamics(network), shared between sessions."""
+    signature = _signature(network, signature)
+    key = ('pollution_dynamics', network, signature)
+    return network_cache.get(key, lambda: load_pollution_dynamics(network))
+
+
+def cached_level_of_detail(network, signature=None):
+    """Return the LevelOfDetail of a network, shared between sessions."""
+    def load():
+        G, locations = cached_water_network(network, signature)[:2]
+        sources, targets = edge_endpoints(G)
+        return LevelOfDetail(G, locations, sources, targets)
+
+    signature = _signature(network, signature)
+    key = ('level_of_detail', network, signature)
+    return network_cache.get(key, load)
+
+
+def cached_node_index(network, signature=None):
+    """Return the NodeIndex of every node of a network, and of its injection
+    nodes, shared between sessions."""
+    def load():
+        G = cached_water_network(network, signature)[0]
+        injection_nodes = cached_pollution_dynamics(network, signature)[1]
+        return NodeIndex(list(G.nodes())), NodeIndex(injection_nodes)
+
+    signature = _signature(network, signature)
+    key = ('node_index', network, signature)
+    return network_cache.get(key, load)
+
+
+def cached_pollution_analytics(network, signature=None):
+    """Return the PollutionAnalytics of every scenario of a network, shared
+    between sessions."""
+    def load():
+        G = cached_water_network(network, signature)[0]
+        pollution, injection_nodes = cached_pollution_dynamics(
+            network, signature)[:2]
+        return PollutionAnalytics(pollution, injection_nodes, list(G.nodes()),
+                                  processes=ANALYTICS_PROCESSES)
+
+    signature = _signature(network, signature)
+    key = ('pollution_analytics', network, signature)
+    return network_cache.get(key, load)
+
+
+def cached_scenario_analytics(network, injection, signature=None):
+    """Return the scenario_analytics of the pollution scenario for an
+    injection node, in graph order, shared between sessions."""
+    def load():
+        if network_analytics_key in network_cache:
+            return cached_pollution_analytics(
+                network, signature).scenario(injection)
+        frames = cached_scenario_frames(network, injection, signature)
+        return scenario_analytics(frames.nodes, frames.timesteps)
+
+    signature = _signature(network, signature)
+    network_analytics_key = ('pollution_analytics', network, signature)
+    key = ('scenario_analytics', (network, injection), signature)
+    return network_cache.get(key, load)
+
+
+def cached_sensor_placement(network, signature=None):
+    """Return the DetectionIndex of a network, and the nodes chosen for
+    MAX_SENSORS sensors by place_sensors, shared between sessions.
+    Greedy placement adds one sensor at a time, so the best n sensors are
+    the first n of them."""
+    def load():
+        arrival = cached_pollution_analytics(network, signature).arrival
+        end = cached_pollution_dynamics(network, signature)[4]
+        index = DetectionIndex(arrival, end)
+        return index, place_sensors(index, MAX_SENSORS)[0]
+
+    signature = _signature(network, signature)
+    key = ('sensor_placement', network, signature)
+    return network_cache.get(key, load)
+
+
+def cached_source_index(network, signature=None):
+    """Return the SourceIndex of a network, shared between sessions. It is
+    saved with the scenarios, so it is only built once"""
+    def load():
+        G = cached_water_network(network, signature)[0]
+        pollution, injection_nodes = cached_pollution_dynamics(
+            network, signature)[:2]
+        directory = join(get_network_files_path(network), network)
+        return load_source_index(pollution, injection_nodes,
+                                 list(G.nodes()), pollution.timesteps,
+                                 directory)
+
+    signature = _signature(network, signature)
+    key = ('source_index', network, signature)
+    return network_cache.get(key, load)
+
+
+def cached_scenario_frames(network, injection, signature=None):
+    """Return the ScenarioFrames of the pollution scenario for an injection
+    node, shared between sessions. With PALETTE_BINS they include the bins
+    of the colors the values are drawn with."""
+    def load():
+        G = cached_water_network(network, signature)[0]
+        pollution, *_, max_pol, min_pol = cached_pollution_dynamics(
+            network, signature)
+        sources, targets = edge_endpoints(G)
+        return ScenarioFrames(pollution_scenario(pollution, injection),
+                              list(G.nodes()), sources, targets,
+                              (min_pol, max_pol) if PALETTE_BINS else None)
+
+    signature = _signature(network, signature)
+    key = ('scenario_frames', (network, injection), signature)
+    return network_cache.get(key, load)
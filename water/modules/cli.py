@@ -0,0 +1,221 @@
+import argparse
+import importlib
+import sys
+from os.path import abspath, dirname, exists, isdir, join
+from .load_data import get_network_files_path, get_networks
+from .manifest import build_scenarios, stale_scenarios
+from .scenarios import (ARRAY_FILENAME, SPARSE_VALUES_FILENAME,
+                        convert_scenarios, scenario_files)
+from .simulate import DEFAULT_PARAMETERS, candidate_injection_nodes
+from .synthetic import DEFAULT_SCENARIOS, write_synthetic_network
+
+
+def convert(args):
+    """Convert the .pkl scenarios of a network, or with --all of every
+    network that has them, to the array or sparse format"""
+    if args.all:
+        networks = [network for network in get_networks()
+                    if has_scenario_files(network)]
+    elif args.network is not None:
+        networks = [args.network]
+    else:
+        raise SystemExit("Give a network to convert, or --all")
+    if args.log_quantize and not args.sparse:
+        raise SystemExit("--log-quantize needs --sparse")
+    for network in networks:
+        directory = get_network_files_path(network) + '/' + network
+        shape = convert_scenarios(directory, dtype=args.dtype,
+                                  sparse=args.sparse,
+                                  log_quantize=args.log_quantize)
+        print("Wrote " + str(shape[0]) + " scenarios of " + str(shape[1])
+              + " timesteps and " + str(shape[2]) + " nodes to " + directory)
+
+
+def has_scenario_files(network):
+    """Whether a network has .pkl scenarios to convert"""
+    directory = join(get_network_files_path(network), network)
+    return isdir(directory) and len(scenario_files(directory)) > 0
+
+
+def simulate(args, rebuild):
+    """Simulate the missing, or with rebuild also the out of date, pollution
+    scenarios of a network with wntr"""
+    file_path = get_network_files_path(args.network)
+    inp_file = join(file_path, args.network + '.inp')
+    directory = join(file_path, args.network)
+    parameters = dict(DEFAULT_PARAMETERS)
+    parameters.update({'strength': args.strength,
+                       'injection_start': args.injection_start,
+                       'injection_end': args.injection_end})
+
+    nodes = args.nodes or candidate_injection_nodes(inp_file)
+    if rebuild:
+        todo = stale_scenarios(inp_file, directory, nodes, parameters)
+    elif args.force:
+        todo = nodes
+    else:
+        todo = [node for node in nodes
+                if not exists(join(directory, node + '.pkl'))]
+    print(str(len(nodes) - len(todo)) + " of " + str(len(nodes))
+          + " scenarios are up to date")
+
+    def progress(injection, done, total):
+        print("Simulated " + injection + " (" + str(done) + "/" + str(total)
+              + ")")
+
+    simulated = build_scenarios(inp_file, directory, todo,
+                                processes=args.processes,
+                                parameters=parameters, progress=progress)
+    print("Simulated " + str(len(simulated)) + " scenarios in " + directory)
+    if len(simulated) > 0 and (
+            exists(join(directory, ARRAY_FILENAME))
+            or exists(join(directory, SPARSE_VALUES_FILENAME))):
+        print("Run 'python -m water convert " + args.network + "' to update "
+              "the converted scenarios with the new ones")
+
+
+def generate(args):
+    """Simulate the pollution scenarios of a network that don't exist yet"""
+    simulate(args, rebuild=False)
+
+
+def rebuild(args):
+    """Simulate the pollution scenarios of a network that are missing or
+    don't match the network and simulation parameters"""
+    simulate(args, rebuild=True)
+
+
+def synthesize(args):
+    """Write a synthetic network and pollution scenarios"""
+    file_path = write_synthetic_network(args.network, args.junctions,
+                                        scenarios=args.scenarios,
+                                        seed=args.seed, dtype=args.dtype)
+    print("Wrote a synthetic network of " + str(args.junctions)
+          + " junctions to " + file_path)
+
+
+def serve(args):
+    """Run the app on a bokeh server, with its metrics at /metrics"""
+    from bokeh.application import Application
+    from bokeh.application.handlers import DirectoryHandler
+    from bokeh.server.server import Server
+
+    app_dir = abspath(join(dirname(__file__), '..'))
+    # The app imports its modules as the top level package 'modules', serve
+    # the metrics it records rather than those of water.modules
+    sys.path.insert(0, app_dir)
+    metrics = importlib.import_module('modules.metrics')
+    server = Server({'/water': Application(DirectoryHandler(
+                        filename=app_dir))},
+                    port=args.port, address=args.address,
+                    num_procs=args.num_procs,
+                    allow_websocket_origin=args.allow_websocket_origin,
+                    extra_patterns=[('/metrics', metrics.MetricsHandler)])
+    server.start()
+    print("Serving the app at http://" + (args.address or 'localhost') + ':'
+          + str(server.port) + "/water, metrics at /metrics")
+    server.io_loop.start()
+
+
+def add_simulation_arguments(parser):
+    """Add the arguments of the commands that simulate scenarios"""
+    parser.add_argument('network', help="Name of the water network")
+    parser.add_argument('--nodes', nargs='+',
+                        help="Injection nodes, by default every junction")
+    parser.add_argument('--processes', type=int,
+                        help="Number of simulations to run at once, by "
+                             "default the number of CPUs")
+    parser.add_argument('--strength', type=float,
+                        default=DEFAULT_PARAMETERS['strength'],
+                        help="Pollution concentration of the source")
+    parser.add_argument('--injection-start', type=int,
+                        default=DEFAULT_PARAMETERS['injection_start'],
+                        help="Time pollution injection starts, in seconds")
+    parser.add_argument('--injection-end', type=int,
+                        default=DEFAULT_PARAMETERS['injection_end'],
+                        help="Time pollution injection ends, in seconds")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m water',
+        description="Tools for preparing water network data for the app")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    convert_parser = subparsers.add_parser(
+        'convert',
+        help="Convert a network's .pkl pollution scenarios into memory "
+             "mapped arrays")
+    convert_parser.add_argument('network', nargs='?',
+                                help="Name of the water network")
+    convert_parser.add_argument('--all', action='store_true',
+                                help="Convert every network with .pkl "
+                                     "scenarios")
+    convert_parser.add_argument('--dtype', default='float64',
+                                choices=['float64', 'float32', 'float16'],
+                                help="Data type to store pollution values as")
+    convert_parser.add_argument('--sparse', action='store_true',
+                                help="Store only the values of each node "
+                                     "while it is polluted, smaller on disk "
+                                     "but expanded into the memory of each "
+                                     "server process using them")
+    convert_parser.add_argument('--log-quantize', action='store_true',
+                                help="Store the values of the sparse format "
+                                     "as 16 bit levels on a log scale")
+    convert_parser.set_defaults(func=convert)
+
+    generate_parser = subparsers.add_parser(
+        'generate',
+        help="Simulate pollution injected at each node of a network with "
+             "wntr, writing a .pkl scenario for each")
+    add_simulation_arguments(generate_parser)
+    generate_parser.add_argument('--force', action='store_true',
+                                 help="Simulate nodes that already have a "
+                                      "scenario, instead of resuming")
+    generate_parser.set_defaults(func=generate)
+
+    rebuild_parser = subparsers.add_parser(
+        'rebuild',
+        help="Simulate only the pollution scenarios of a network that are "
+             "missing, or out of date with its .inp file or the simulation "
+             "parameters according to the manifest")
+    add_simulation_arguments(rebuild_parser)
+    rebuild_parser.set_defaults(func=rebuild)
+
+    synthesize_parser = subparsers.add_parser(
+        'synthesize',
+        help="Write a synthetic network, with pollution scenarios, of any "
+             "size to water/data for testing")
+    synthesize_parser.add_argument('network',
+                                   help="Name of the synthetic network")
+    synthesize_parser.add_argument('--junctions', type=int, default=10000,
+                                   help="Approximate number of junctions")
+    synthesize_parser.add_argument('--scenarios', type=int,
+                                   default=DEFAULT_SCENARIOS,
+                                   help="Number of pollution scenarios")
+    synthesize_parser.add_argument('--seed', type=int, default=0,
+                                   help="Seed of the random generator")
+    synthesize_parser.add_argument('--dtype', default='float64',
+                                   choices=['float64', 'float32'],
+                                   help="Data type of the pollution values")
+    synthesize_parser.set_defaults(func=synthesize)
+
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help="Run the app on a bokeh server, with Prometheus metrics of "
+             "each server process at /metrics")
+    serve_parser.add_argument('--port', type=int, default=5006,
+                              help="Port to listen on")
+    serve_parser.add_argument('--address',
+                              help="Address to listen on, by default all")
+    serve_parser.add_argument('--num-procs', type=int, default=1,
+                              help="Number of server processes, 0 for one "
+                                   "per CPU")
+    serve_parser.add_argument('--allow-websocket-origin', action='append',
+                              help="Host the app may be embedded from, can "
+                                   "be repeated")
+    serve_parser.set_defaults(func=serve)
+
+    args = parser.parse_args(argv)
+    args.func(args)
@@ -0,0 +1,224 @@
+from os import environ
+import numpy as np
+import pandas as pd
+from .pollution import node_positions, edge_pollution
+
+# Largest fraction of a column that is sent as a patch of changed values,
+# above this it is cheaper to send the whole column as a binary array
+MAX_PATCH_FRACTION = 0.25
+
+# Number of frames drawn for each timestep of the scenario when the
+# animation interpolates between them
+INTERPOLATION_STEPS = 4
+
+# Whether frames are sent to the browser as the palette bin of each value, a
+# uint8, rather than as the value, set the WATER_PALETTE_BINS environment
+# variable to 1 to send the bins
+PALETTE_BINS = environ.get('WATER_PALETTE_BINS', '0') != '0'
+
+# Number of colors in the pollution palette, so that each bin fits in a
+# uint8
+PALETTE_SIZE = 256
+
+
+def palette_bins(values, low, high, n_colors=PALETTE_SIZE):
+    """
+    Find the color of each pollution value in a palette spread over a log
+    scale, as bokeh's LogColorMapper does.
+
+    Args:
+        values (numpy.ndarray): The pollution values.
+        low (float): The value of the first color.
+        high (float): The value of the last color.
+        n_colors (int): The number of colors in the palette.
+
+    Returns:
+        numpy.ndarray: The uint8 index in the palette of each value, values
+            below low, including no pollution, are the first color and
+            those above high the last.
+    """
+    values = np.asarray(values)
+    bins = np.zeros(values.shape, dtype=np.uint8)
+    above = values > low
+    scale = n_colors / (np.log(high) - np.log(low) or 1.0)
+    bins[above] = np.clip(
+        (np.log(values[above].astype(np.float64)) - np.log(low)) * scale,
+        0, n_colors - 1).astype(np.uint8)
+    return bins
+
+
+class ScenarioFrames:
+    """
+    The node and edge pollution values at every timestep of a pollution
+    scenario, ordered like the nodes and edges of the network graph.
+
+    Frames are calculated once when the injection node is chosen, so that
+    moving through time is only a lookup. When the scenario's columns are
+    already in graph order, as they are for the array format, the node
+    values are a view of the scenario rather than a copy, so memory mapped
+    scenarios are shared by every server process.
+
+    The frame of a timestep is found by integer division when the timesteps
+    are evenly spaced, as those of wntr simulations are, and the pollution
+    history of a node is read as a column, like that of the scenario.
+
+    When a color range is given, the palette bin of every value is found
+    too, so frames can be sent to the browser as bins.
+
+    Args:
+        pollution_scenario (pandas.Dataframe): A dataframe of the pollution
+            values at each node for set of timesteps. The columns of the
+            Dataframe are the node labels and the index is a set of timesteps.
+        nodes (list): The node labels in graph order.
+        sources (numpy.ndarray): The position in nodes of the first node of
+            each edge.
+        targets (numpy.ndarray): The position in nodes of the second node of
+            each edge.
+        color_range (tuple): The lowest and highest pollution value of the
+            palette, or None to only keep the values.
+    """
+
+    def __init__(self, pollution_scenario, nodes, sources, targets,
+                 color_range=None):
+        positions = node_positions(pollution_scenario, nodes)
+        self.timesteps = np.asarray(pollution_scenario.index)
+        values = pollution_scenario.values
+        if np.array_equal(positions, np.arange(values.shape[1])):
+            self.nodes = np.ascontiguousarray(values)
+        else:
+            self.nodes = np.ascontiguousarray(values[:, positions])
+        self.edges = edge_pollution(self.nodes, sources, targets)
+        self._labels = nodes
+        self._sources = sources
+        self._targets = targets
+        # Positions of the node labels, made when a history is first read
+        self._node_positions = None
+        intervals = np.diff(self.timesteps)
+        if (np.issubdtype(self.timesteps.dtype, np.integer)
+                and len(intervals) > 0 and intervals[0] > 0
+                and (intervals == intervals[0]).all()):
+            self._start = int(self.timesteps[0])
+            self._interval = int(intervals[0])
+            self._rows = None
+        else:
+            self._start = self._interval = None
+            self._rows = {timestep: i for i, timestep
+                          in enumerate(self.timesteps.tolist())}
+        # Timesteps without pollution data have no pollution
+        self._zero_nodes = np.zeros(self.nodes.shape[1])
+        self._zero_edges = np.zeros(self.edges.shape[1])
+        self.color_range = color_range
+        if color_range is not None:
+            self.node_bins = palette_bins(self.nodes, *color_range)
+            self.edge_bins = palette_bins(self.edges, *color_range)
+
+    def row(self, timestep):
+        """
+        Find the frame of a timestep.
+
+        Args:
+            timestep (int): The time step.
+
+        Returns:
+            int: The row of the timestep in nodes and edges, or None if the
+                timestep has no pollution data.
+        """
+        if self._interval is None:
+            return self._rows.get(timestep)
+        row, remainder = divmod(timestep - self._start, self._interval)
+        if remainder != 0 or not 0 <= row < len(self.timesteps):
+            return None
+        return int(row)
+
+    def frame(self, timestep, interpolate=False):
+        """
+        Get the pollution values at a timestep.
+
+        Args:
+            timestep (int): The time step.
+            interpolate (bool): Whether to interpolate linearly between the
+                frames either side of a timestep without pollution data
+                inside the scenario, rather than show no pollution.
+
+        Returns:
+            tuple: The node values and edge values, as numpy arrays.
+        """
+        row = self.row(timestep)
+        if row is not None:
+            return self.nodes[row], self.edges[row]
+        if (not interpolate or len(self.timesteps) == 0
+                or not self.timesteps[0] < timestep < self.timesteps[-1]):
+            return self._zero_nodes, self._zero_edges
+        if self._interval is None:
+            before = int(np.searchsorted(self.timesteps, timestep)) - 1
+        else:
+            before = int((timestep - self._start) // self._interval)
+        start, end = self.timesteps[before], self.timesteps[before + 1]
+        weight = (timestep - start) / (end - start)
+        node_values = ((1 - weight) * self.nodes[before]
+                       + weight * self.nodes[before + 1])
+        # An edge stays clean until pollution reaches both of its nodes
+        return node_values, edge_pollution(node_values, self._sources,
+                                           self._targets)
+
+    def bins_frame(self, timestep, interpolate=False):
+        """
+        Get the palette bins of the pollution values at a timestep, when
+        the frames have a color range.
+
+        Args:
+            timestep (int): The time step.
+            interpolate (bool): Whether to interpolate between frames, see
+                frame.
+
+        Returns:
+            tuple: The node bins and edge bins, as uint8 numpy arrays.
+        """
+        row = self.row(timestep)
+        if row is not None:
+            return self.node_bins[row], self.edge_bins[row]
+        node_values, edge_values = self.frame(timestep, interpolate)
+        return (palette_bins(node_values, *self.color_range),
+                palette_bins(edge_values, *self.color_range))
+
+    def __getitem__(self, node):
+        """
+        Get the pollution history of a node, like the column of a scenario.
+
+        Args:
+            node (str): The label of the node.
+
+        Returns:
+            pandas.Series: The pollution value at each timestep.
+        """
+        if self._node_positions is None:
+            self._node_positions = {label: i
+                                    for i, label in enumerate(self._labels)}
+        return pd.Series(self.nodes[:, self._node_positions[node]],
+                         index=self.timesteps, name=node)
+
+
+def update_column(source, column, old_values, new_values,
+                  max_patch_fraction=MAX_PATCH_FRACTION):
+    """
+    Set a column of a bokeh ColumnDataSource, sending only the values that
+    have changed when few of them have.
+
+    Args:
+        source (bokeh.models.ColumnDataSource): The data source to update.
+        column (str): The name of the column.
+        old_values (numpy.ndarray): The values currently in the column, or
+            None if they are not known.
+        new_values (numpy.ndarray): The values to set.
+        max_patch_fraction (float): The largest fraction of values that may
+            change for the update to be sent as a patch.
+    """
+    if old_values is not None and len(old_values) == len(new_values):
+        changed = np.flatnonzero(old_values != new_values)
+        if len(changed) <= max_patch_fraction * len(new_values):
+            if len(changed) > 0:
+                source.patch({column: list(zip(changed.tolist(),
+                                               new_values[changed].tolist()))})
+            return
+    # Copy, so that later patches don't modify the values passed in
+    source.data[column] = np.array(new_values)
@@ -1,4 +1,5 @@
 import datetime
+import html
 
 
 def timer_html(timestep):
@@ -34,3 +35,51 @@ def node_type_html(type="None", color="black"):
     node_type_html += type
     node_type_html += "</b></p>"
     return node_type_html
+
+
+def sensor_placement_html(n_sensors=0, detected=0.0, mean_delay=0.0,
+                          color="black", pending=False):
+    if pending:
+        return "<p><i>Placing sensors...</i></p>"
+    if n_sensors == 0:
+        return "<p>No sensors placed</p>"
+    sensor_placement_html = "<p><b style='color:"
+    sensor_placement_html += color + "'>"
+    sensor_placement_html += str(n_sensors) + " sensors</b> detect "
+    sensor_placement_html += str(int(round(detected * 100)))
+    sensor_placement_html += "% of scenarios, after "
+    sensor_placement_html += str(datetime.timedelta(seconds=int(mean_delay)))
+    sensor_placement_html += " on average</p>"
+    return sensor_placement_html
+
+
+def source_candidates_html(candidates=None, color="black", error=None,
+                           pending=False):
+    if pending:
+        return "<p><i>Finding sources...</i></p>"
+    if error is not None:
+        return "<p style='color:red'>" + html.escape(error) + "</p>"
+    if candidates is None:
+        return "<p>Enter observations as node=value, separated by commas</p>"
+    source_candidates_html = "<p>Best matching injection nodes:</p><ol>"
+    for injection, match_error in candidates:
+        source_candidates_html += "<li><b style='color:" + color + "'>"
+        source_candidates_html += injection + "</b> (error "
+        source_candidates_html += format(match_error, '.2f') + ")</li>"
+    source_candidates_html += "</ol>"
+    return source_candidates_html
+
+
+def loading_html(network=None, error=None):
+    if network is None:
+        return ""
+    if error is not None:
+        return ("<p style='color:red'>Failed to load " + html.escape(network)
+                + ": " + html.escape(str(error)) + "</p>")
+    return "<p><i>Loading " + html.escape(network) + "...</i></p>"
+
+
+def idle_html(minutes):
+    return ("<h2 style='color:grey'>Closed after "
+            + format(minutes, 'g') + " minutes without use</h2>"
+            "<p>Reload the page to start again</p>")
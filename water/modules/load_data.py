@@ -1,18 +1,31 @@
+import hashlib
+import pickle
 import wntr
 import numpy as np
-from os import listdir
+from os import environ, listdir, replace
 from os.path import dirname, join, isdir
-import pickle
 from statistics import mean
 import yaml
+from .manifest import consistent_scenarios
+from .metrics import LOAD_SECONDS, timed
+from .scenarios import open_scenario_store, temporary_filename
+
+# Version of the preprocessed network cache files, increase this when the
+# output of preprocess_water_network changes to invalidate existing files
+TOPOLOGY_CACHE_VERSION = 1
+TOPOLOGY_CACHE_SUFFIX = '.topology.pkl'
+
+# Directory of the water networks, the example networks in its examples
+# directory and any others added in their own directories. Can be overridden
+# with the WATER_DATA_DIR environment variable
+DATA_DIR = environ.get('WATER_DATA_DIR', join(dirname(__file__), '../data'))
 
 
 def get_network_examples():
     """Get the names of example water networks with data files present
     in water/data/examples as a list of strings"""
     examples = []
-    dir = join(dirname(__file__), '../data',
-               'examples/')
+    dir = join(DATA_DIR, 'examples/')
     for filename in listdir(dir):
         if isdir(join(dir, filename)):
             examples.append(filename)
@@ -24,7 +37,7 @@ def get_custom_networks():
     """Get the names of any non-example water networks added to water/data
     as a list of strings"""
     custom_networks = []
-    dir = join(dirname(__file__), '../data')
+    dir = DATA_DIR
     for filename in listdir(dir):
         if isdir(join(dir, filename)) and filename != 'examples':
             custom_networks.append(filename)
@@ -37,22 +50,16 @@ def get_networks():
 
 def get_network_files_path(network):
     if network in get_network_examples():
-        return join(dirname(__file__), '../data',
-                    'examples/' + network)
+        return join(DATA_DIR, 'examples/' + network)
     elif network in get_custom_networks():
-        return join(dirname(__file__), '../data',
-                    network)
+        return join(DATA_DIR, network)
     else:
         raise ValueError('Selected network cannot be loaded, files missing')
 
 
-def load_water_network(network):
-    """Get data variables needed for the visualisation from the water network
-    .inp file"""
-
-    # load .inp file
-    file_path = get_network_files_path(network)
-    filename = file_path + '/' + network + '.inp'
+def preprocess_water_network(filename, x_offset=0, y_offset=0):
+    """Build the graph, node locations and normalised base demands used by
+    the visualisation from a water network .inp file"""
 
     # Create water network
     try:
@@ -64,113 +71,151 @@ def load_water_network(network):
     # Get the NetworkX graph
     G = wn.get_graph().to_undirected()
 
+    # Query node attributes for all nodes at once
+    elevations = wn.query_node_attribute('elevation').to_dict()
+
     # Add the node name as an attribute, so we can use with tooltips
     # Also add info about the demand and elevation
     # Also add the names of connected nodes and edge names
     # Also get a list of the base demand for each node
-    all_base_demands = []
-    for node in G.nodes():
-        G.nodes[node]['name'] = node
-        try:
-            G.nodes[node]['elevation'] = (
-                wn.query_node_attribute('elevation')[node]
-                )
-        except KeyError:
-            G.nodes[node]['elevation'] = 'N/A'
+    all_base_demands = np.zeros(G.number_of_nodes())
+    for i, (node, node_data) in enumerate(G.nodes().items()):
+        node_data['name'] = node
+        node_data['elevation'] = elevations.get(node, 'N/A')
         try:
-            base_demands = []
             # Base demand value used to weight node size
-            for timeseries in wn.get_node(node).demand_timeseries_list:
-                base_demands.append(timeseries.base_value)
-            base_demand = mean(base_demands)
-            G.nodes[node]['demand'] = base_demand
-            all_base_demands.append(base_demand)
+            base_demand = mean(timeseries.base_value for timeseries
+                               in wn.get_node(node).demand_timeseries_list)
+            node_data['demand'] = base_demand
+            all_base_demands[i] = base_demand
         except AttributeError:
             # Nodes with no demand will not resize from the base_node_size
-            all_base_demands.append(0.0)
-            G.nodes[node]['demand'] = "N/A"
-        pipes = dict(G.adj[node])
-        connected_str = ""
-        i = 0
-        for connected_node, pipe_info in pipes.items():
-            if i > 0:
-                connected_str = connected_str + "| "
-            connected_str = connected_str + connected_node + ": "
-            for pipe, info in pipe_info.items():
-                connected_str = connected_str + pipe + " "
-            i += 1
-        G.nodes[node]['connected'] = connected_str
+            node_data['demand'] = "N/A"
+        node_data['connected'] = "| ".join(
+            connected_node + ": " + "".join(pipe + " " for pipe in pipe_info)
+            for connected_node, pipe_info in G.adj[node].items())
 
     # Normalise base demands
     # This global variable list is used for node resizing and the demand data
     # is also displayed in the tooltip
-    all_base_demands = np.array([float(i) / max(all_base_demands)
-                                 for i in all_base_demands])
+    all_base_demands = all_base_demands / all_base_demands.max()
 
     # Create plottable coordinates for each network node
+    locations = {node: (node_data['pos'][0] + x_offset,
+                        node_data['pos'][1] + y_offset)
+                 for node, node_data in G.nodes().items()}
+
+    return G, locations, all_base_demands
+
+
+@timed(LOAD_SECONDS, 'load_water_network')
+def load_water_network(network):
+    """Get data variables needed for the visualisation from the water network
+    .inp file.
+    The preprocessed network is cached in a file next to the .inp file, which
+    is used until the .inp or metadata file changes"""
+
+    # load .inp file
+    file_path = get_network_files_path(network)
+    filename = file_path + '/' + network + '.inp'
+
     # Adjust the coordinates if specified by metadata file
     x_offset = 0
     y_offset = 0
     include_map = False
+    metadata_bytes = b''
     try:
         metadata_file = file_path + '/metadata.yml'
-        with open(metadata_file, 'r') as stream:
-            metadata = yaml.safe_load(stream)
-            if 'map' in metadata:
-                x_offset = metadata['map']['x_offset']
-                y_offset = metadata['map']['y_offset']
-                include_map = True
+        with open(metadata_file, 'rb') as stream:
+            metadata_bytes = stream.read()
+        metadata = yaml.safe_load(metadata_bytes)
+        if 'map' in metadata:
+            x_offset = metadata['map']['x_offset']
+            y_offset = metadata['map']['y_offset']
+            include_map = True
     except (FileNotFoundError, KeyError):
         pass
 
-    locations = {}
-    for node, node_data in G.nodes().items():
-        xd = node_data['pos'][0] + x_offset
-        yd = node_data['pos'][1] + y_offset
-        locations[node] = (xd, yd)
+    # Identify the version of the cached data by the hash of the files used
+    # to create it
+    network_hash = hashlib.sha256()
+    try:
+        with open(filename, 'rb') as stream:
+            network_hash.update(stream.read())
+    except FileNotFoundError:
+        raise FileNotFoundError("Please add the water network file: " +
+                                filename)
+    network_hash.update(metadata_bytes)
+    cache_id = (TOPOLOGY_CACHE_VERSION, network_hash.hexdigest())
+
+    cache_file = join(file_path, '.' + network + TOPOLOGY_CACHE_SUFFIX)
+    try:
+        with open(cache_file, 'rb') as stream:
+            cached = pickle.load(stream)
+        if cached['id'] == cache_id:
+            return cached['network'] + (include_map,)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError, KeyError, TypeError):
+        # Missing, incomplete or outdated cache files are replaced
+        pass
+
+    G, locations, all_base_demands = preprocess_water_network(
+        filename, x_offset, y_offset)
+
+    try:
+        with open(temporary_filename(cache_file), 'wb') as stream:
+            pickle.dump({'id': cache_id,
+                         'network': (G, locations, all_base_demands)},
+                        stream, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(temporary_filename(cache_file), cache_file)
+    except OSError:
+        # A read only data directory just means preprocessing every time
+        pass
 
     return G, locations, all_base_demands, include_map
 
 
+def edge_endpoints(G):
+    """Get the positions, in the order of G.nodes(), of the nodes at each end
+    of every edge, in the order of G.edges(), as two integer arrays"""
+    positions = {node: i for i, node in enumerate(G.nodes())}
+    n_edges = G.number_of_edges()
+    sources = np.fromiter((positions[edge[0]] for edge in G.edges()),
+                          dtype=np.intp, count=n_edges)
+    targets = np.fromiter((positions[edge[1]] for edge in G.edges()),
+                          dtype=np.intp, count=n_edges)
+    return sources, targets
+
+
+@timed(LOAD_SECONDS, 'load_pollution_dynamics')
 def load_pollution_dynamics(network):
-    # Load pollution dynamics
-    # Create pollution as a global var used in some functions
-
-    files = get_network_files_path(network) + '/' + network
-    # Determine max and min pollution values and all node names
-    max_pols = []
-    min_pols = []
-    injection_nodes = []
-    pollution = {}
-    for filename in listdir(files):
-        if filename.endswith(".pkl"):
-            node_name = filename.split(".pkl")[0]
-            injection_nodes.append(node_name)
-            with open(files + "/" + filename, 'rb') as input_file:
-                pollution_df = pickle.load(input_file)
-                pollution[node_name] = pollution_df
-                v = pollution_df.values.ravel()
-                max_pols.append(np.max(v))
-                try:  # below will error for a df where all values zero
-                    min_pols.append(np.min(v[v > 0]))
-                except ValueError:
-                    pass
-
-    max_pol = np.max(max_pols)
-    min_pol = np.min(min_pols)
-    injection_nodes.sort()
+    """Get the pollution dynamics for each injection node of a network.
+    Scenarios are read lazily, when first used, by the returned store, or
+    memory mapped if they have been converted to the array format.
+    If the scenarios have a manifest, only those simulated from the current
+    .inp file are used"""
+
+    file_path = get_network_files_path(network)
+    files = file_path + '/' + network
+    checksums = consistent_scenarios(file_path + '/' + network + '.inp',
+                                     files)
+    pollution = open_scenario_store(files, checksums)
+    injection_nodes = list(pollution.injection_nodes)
+    if len(injection_nodes) == 0:
+        raise ValueError("No pollution scenarios of " + network + " match "
+                         "its network file, rebuild the scenarios")
 
     # Choose a default node for pollution injection
     start_node = injection_nodes[0]
 
     # Determine the step numbers for the beginning and end of the pollution
-    # data. This assumes all injection_nodes are identical in time
-    # to the default starting node!
-    start = pollution[start_node].index.min()
-    end = pollution[start_node].index.max()
+    # data. This assumes all injection_nodes are identical in time,
+    # as only the first scenario's timesteps are kept in the summary!
+    start = pollution.timesteps.min()
+    end = pollution.timesteps.max()
 
-    # Get the timstep size for the slider from the pollution df
-    step = pollution[start_node].index[1] - pollution[start_node].index[0]
+    # Get the timstep size for the slider from the pollution timesteps
+    step = pollution.timesteps[1] - pollution.timesteps[0]
 
     return (pollution, injection_nodes, start_node, start, end, step,
-            max_pol, min_pol)
+            pollution.max_pol, pollution.min_pol)
@@ -0,0 +1,125 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+from .cache import (network_cache, cached_water_network,
+                    cached_pollution_dynamics, cached_level_of_detail,
+                    cached_node_index, cached_scenario_frames,
+                    cached_scenario_analytics, network_signature)
+from .load_data import get_networks
+from .metrics import LOAD_SECONDS, timed
+
+log = logging.getLogger(__name__)
+
+# Number of threads loading networks for the sessions of a server process,
+# can be overridden with the WATER_LOAD_THREADS environment variable
+LOAD_THREADS = int(environ.get('WATER_LOAD_THREADS', 4))
+
+# Shared by every session, so that loading never blocks the event loop
+_executor = ThreadPoolExecutor(max_workers=LOAD_THREADS,
+                               thread_name_prefix='water-load')
+
+
+@timed(LOAD_SECONDS, 'preload_network')
+def preload_network(network):
+    """
+    Load everything launching the app for a network needs into the shared
+    network cache, so that launching it doesn't read any files.
+
+    Args:
+        network (str): The name of the water network.
+
+    Returns:
+        tuple: The network_signature the network was loaded with, for
+            launching it without listing its files again.
+    """
+    signature = network_signature(network)
+    cached_water_network(network, signature)
+    injection_nodes = cached_pollution_dynamics(network, signature)[1]
+    cached_level_of_detail(network, signature)
+    cached_node_index(network, signature)
+    cached_scenario_frames(network, injection_nodes[0], signature)
+    cached_scenario_analytics(network, injection_nodes[0], signature)
+    return signature
+
+
+def timed_preload(network):
+    """Preload a network, returning the time it took in seconds"""
+    start = time.perf_counter()
+    preload_network(network)
+    return time.perf_counter() - start
+
+
+def preload_networks(networks):
+    """
+    Start preloading several networks in parallel, logging the time each
+    took to load and the memory it uses in the cache, or why it couldn't be
+    loaded.
+
+    Sessions opening a network that is still being preloaded wait for it,
+    rather than loading it again.
+
+    Args:
+        networks (list): The names of the networks, or ['all'] for every
+            network.
+
+    Returns:
+        dict: The future of the preload of each network, whose result is
+            the time it took in seconds.
+    """
+    available = get_networks()
+    if list(networks) == ['all']:
+        networks = available
+    futures = {}
+    for network in networks:
+        if network not in available:
+            log.error("Can't preload unknown network %s", network)
+            continue
+        future = _executor.submit(timed_preload, network)
+        future.add_done_callback(
+            lambda future, network=network: _log_preload(network, future))
+        futures[network] = future
+    return futures
+
+
+def _log_preload(network, future):
+    error = future.exception()
+    if error is not None:
+        log.error("Failed to preload %s: %s", network, error)
+        return
+    log.info("Preloaded %s in %.1f s, using %.1f MB", network,
+             future.result(), network_cache.network_size(network) / 1e6)
+    if network_cache.evictions > 0:
+        log.warning("The cache of %.0f MB is full, so preloaded networks "
+                    "may be loaded again, set WATER_CACHE_MAX_BYTES to keep "
+                    "them all", network_cache.max_bytes / 1e6)
+
+
+def load_network(network):
+    """
+    Start preloading a network in a worker thread.
+
+    Args:
+        network (str): The name of the water network.
+
+    Returns:
+        concurrent.futures.Future: The future of the preload, which can be
+            cancelled until it starts. Its result is the network_signature
+            the network was loaded with.
+    """
+    return _executor.submit(preload_network, network)
+
+
+def load_in_background(function, *args):
+    """
+    Start loading network data that takes long to compute, such as the
+    source index, in a worker thread, so that the server keeps responding.
+
+    Args:
+        function (callable): The cached loading function.
+        args: Its arguments.
+
+    Returns:
+        concurrent.futures.Future: The future of the data.
+    """
+    return _executor.submit(function, *args)
@@ -0,0 +1,306 @@
+from math import sqrt
+from os import environ
+import numpy as np
+
+# Largest number of nodes drawn individually. Networks with more nodes are
+# drawn aggregated until the view is zoomed in to fewer nodes than this, can
+# be overridden with the WATER_LOD_MAX_NODES environment variable
+MAX_DETAIL_NODES = int(environ.get('WATER_LOD_MAX_NODES', 5000))
+
+# Fraction of the width and height of the view added on each side of the
+# area drawn in full detail, so small pans don't need new data
+DETAIL_MARGIN = 0.25
+
+
+class NetworkView:
+    """
+    The nodes and edges drawn for a network. Each node or edge drawn stands
+    for a group of the nodes or edges of the network, and shows the
+    highest value of its group, or another combination of them.
+
+    Args:
+        nodes (numpy.ndarray): The position of the representative network
+            node of each node drawn, whose name, location and tooltip
+            values are shown.
+        node_groups (numpy.ndarray): The node drawn for each network node,
+            or -1 if it isn't drawn.
+        starts (numpy.ndarray): The position in nodes of the first node of
+            each edge drawn.
+        ends (numpy.ndarray): The position in nodes of the second node of
+            each edge drawn.
+        edge_groups (numpy.ndarray): The edge drawn for each network edge,
+            or -1 if it isn't drawn.
+        bounds (tuple): The (x_start, x_end, y_start, y_end) of the area
+            drawn, or None if the whole network is drawn.
+    """
+
+    def __init__(self, nodes, node_groups, starts, ends, edge_groups,
+                 bounds=None):
+        self.nodes = nodes
+        self.node_groups = node_groups
+        self.starts = starts
+        self.ends = ends
+        self.edge_groups = edge_groups
+        self.bounds = bounds
+        self._node_members = _group_members(node_groups)
+        self._edge_members = _group_members(edge_groups)
+        # The first network edge of each edge drawn, whose values are shown
+        self.edges = self._edge_members[0][self._edge_members[1]]
+
+    def node_values(self, values, reduce=np.maximum):
+        """
+        Get the values of the nodes drawn from values of the network nodes.
+
+        Args:
+            values (numpy.ndarray): The value of each network node, or an
+                array of them with the nodes along the last axis.
+            reduce (numpy.ufunc): Combines the values of a group, by
+                default taking the highest.
+
+        Returns:
+            numpy.ndarray: The value of each group of nodes.
+        """
+        return _group_reduce(values, reduce, *self._node_members)
+
+    def edge_values(self, values, reduce=np.maximum):
+        """
+        Get the values of the edges drawn from values of the network edges.
+
+        Args:
+            values (numpy.ndarray): The value of each network edge, or an
+                array of them with the edges along the last axis.
+            reduce (numpy.ufunc): Combines the values of a group, by
+                default taking the highest.
+
+        Returns:
+            numpy.ndarray: The value of each group of edges.
+        """
+        return _group_reduce(values, reduce, *self._edge_members)
+
+    def contains(self, x_start, x_end, y_start, y_end):
+        """Whether an area is entirely within the area drawn"""
+        if self.bounds is None:
+            return True
+        bx_start, bx_end, by_start, by_end = self.bounds
+        return (bx_start <= x_start and x_end <= bx_end
+                and by_start <= y_start and y_end <= by_end)
+
+
+def _group_members(groups):
+    """Sort the members of each group together, returning the members, the
+    offset of the first member of each group, and whether every group has
+    one member and whether they are in order"""
+    members = np.argsort(groups, kind='stable')
+    members = members[groups[members] >= 0]
+    offsets = np.searchsorted(groups[members],
+                              np.arange(groups.max(initial=-1) + 1))
+    single = len(offsets) == len(members)
+    identity = single and np.array_equal(members, np.arange(len(groups)))
+    return members, offsets, single, identity
+
+
+def _group_reduce(values, reduce, members, offsets, single, identity):
+    values = np.asarray(values)
+    if identity:
+        return values
+    if single:
+        return values[..., members]
+    return reduce.reduceat(values[..., members], offsets, axis=-1)
+
+
+def full_view(n_nodes, sources, targets):
+    """The view drawing every node and edge of a network"""
+    return NetworkView(np.arange(n_nodes), np.arange(n_nodes),
+                       sources, targets, np.arange(len(sources)))
+
+
+def detail_view(xy, sources, targets, bounds):
+    """
+    The view drawing every node within an area, and every edge connected to
+    them, with the nodes at their other ends.
+
+    Args:
+        xy (numpy.ndarray): The location of each network node.
+        sources (numpy.ndarray): The position of the first node of each edge.
+        targets (numpy.ndarray): The position of the second node of each
+            edge.
+        bounds (tuple): The (x_start, x_end, y_start, y_end) of the area.
+
+    Returns:
+        NetworkView: The view.
+    """
+    x_start, x_end, y_start, y_end = bounds
+    inside = ((xy[:, 0] >= x_start) & (xy[:, 0] <= x_end)
+              & (xy[:, 1] >= y_start) & (xy[:, 1] <= y_end))
+    edges = inside[sources] | inside[targets]
+    shown = inside.copy()
+    shown[sources[edges]] = True
+    shown[targets[edges]] = True
+
+    nodes = np.flatnonzero(shown)
+    node_groups = np.full(len(xy), -1)
+    node_groups[nodes] = np.arange(len(nodes))
+    edge_groups = np.full(len(sources), -1)
+    edge_groups[edges] = np.arange(np.count_nonzero(edges))
+    return NetworkView(nodes, node_groups, node_groups[sources[edges]],
+                       node_groups[targets[edges]], edge_groups, bounds)
+
+
+def overview(xy, sources, targets, priority, max_nodes):
+    """
+    The view drawing a network aggregated into cells of a square grid, at
+    most max_nodes of them. All the nodes in a cell are drawn as the one
+    with the highest priority, and edges between the same two cells are
+    drawn as one, while edges within a cell aren't drawn.
+
+    Args:
+        xy (numpy.ndarray): The location of each network node.
+        sources (numpy.ndarray): The position of the first node of each edge.
+        targets (numpy.ndarray): The position of the second node of each
+            edge.
+        priority (numpy.ndarray): The priority of each node to represent
+            its cell.
+        max_nodes (int): The largest number of cells.
+
+    Returns:
+        NetworkView: The view.
+    """
+    cells = max(1, int(sqrt(max_nodes)))
+    origin = xy.min(axis=0)
+    cell_size = (xy.max(axis=0) - origin).max() / cells or 1.0
+    ij = np.minimum(((xy - origin) // cell_size).astype(np.int64), cells - 1)
+    _, node_groups = np.unique(ij[:, 0] * cells + ij[:, 1],
+                               return_inverse=True)
+    node_groups = node_groups.ravel()
+
+    # The node of each cell with the highest priority represents it
+    order = np.lexsort((-priority, node_groups))
+    first = np.flatnonzero(np.diff(node_groups[order], prepend=-1))
+    nodes = order[first]
+
+    n_groups = len(nodes)
+    source_groups = node_groups[sources]
+    target_groups = node_groups[targets]
+    pairs = (np.minimum(source_groups, target_groups) * n_groups
+             + np.maximum(source_groups, target_groups))
+    between = source_groups != target_groups
+    unique_pairs, edge_pairs = np.unique(pairs[between], return_inverse=True)
+    edge_groups = np.full(len(sources), -1)
+    edge_groups[between] = edge_pairs.ravel()
+    return NetworkView(nodes, node_groups, unique_pairs // n_groups,
+                       unique_pairs % n_groups, edge_groups)
+
+
+def _column(values):
+    """Convert tuples to lists, as bokeh's from_networkx does"""
+    return [list(value) if isinstance(value, tuple) else value
+            for value in values]
+
+
+class LevelOfDetail:
+    """
+    Chooses the nodes and edges of a network to draw for the area shown.
+
+    Networks of up to max_nodes nodes are always drawn in full. Larger
+    networks are drawn aggregated (see overview) while more than max_nodes
+    nodes are in view, and in full detail for the area around the view
+    (see detail_view) when zoomed in further.
+
+    Args:
+        G (networkx.Graph): The network graph.
+        locations (dict): The location of each node.
+        sources (numpy.ndarray): The position of the first node of each
+            edge, in the order of G.nodes().
+        targets (numpy.ndarray): The position of the second node of each
+            edge.
+        max_nodes (int): The largest number of nodes drawn.
+    """
+
+    def __init__(self, G, locations, sources, targets,
+                 max_nodes=MAX_DETAIL_NODES):
+        self.names = np.array(list(G.nodes()), dtype=object)
+        self.xy = np.array([locations[node] for node in self.names],
+                           dtype=float).reshape(-1, 2)
+        self.sources = sources
+        self.targets = targets
+        self.max_nodes = max_nodes
+        self.enabled = len(self.names) > max_nodes
+
+        # Node and edge attributes, shown in tooltips
+        node_attributes = {key for _, data in G.nodes(data=True)
+                           for key in data}
+        self.node_columns = {
+            key: _column(data.get(key) for _, data in G.nodes(data=True))
+            for key in node_attributes}
+        edge_attributes = {key for _, _, data in G.edges(data=True)
+                           for key in data} - {'start', 'end'}
+        self.edge_columns = {
+            key: _column(data.get(key) for _, _, data in G.edges(data=True))
+            for key in edge_attributes}
+
+        self.full = full_view(len(self.names), sources, targets)
+        if self.enabled:
+            # Reservoirs and tanks, then the best connected junctions,
+            # represent the cells of the overview
+            degree = (np.bincount(sources, minlength=len(self.names))
+                      + np.bincount(targets, minlength=len(self.names)))
+            junction = np.array([G.nodes[node].get('type') == 'Junction'
+                                 for node in self.names])
+            priority = degree + np.where(junction, 0, degree.max() + 1)
+            self.overview = overview(self.xy, sources, targets, priority,
+                                     max_nodes)
+        else:
+            self.overview = self.full
+
+    def view(self, x_start, x_end, y_start, y_end, current=None):
+        """
+        Choose the view to draw for the area shown.
+
+        Args:
+            x_start (float): The left of the area shown.
+            x_end (float): The right of the area shown.
+            y_start (float): The bottom of the area shown.
+            y_end (float): The top of the area shown.
+            current (NetworkView): The view currently drawn, which is kept
+                if it is still suitable.
+
+        Returns:
+            NetworkView: The view to draw.
+        """
+        if not self.enabled:
+            return self.full
+        x = self.xy[:, 0]
+        y = self.xy[:, 1]
+        in_view = np.count_nonzero((x >= x_start) & (x <= x_end)
+                                   & (y >= y_start) & (y <= y_end))
+        if in_view > self.max_nodes:
+            return self.overview
+        if (current is not None and current.bounds is not None
+                and current.contains(x_start, x_end, y_start, y_end)):
+            return current
+        x_margin = DETAIL_MARGIN * (x_end - x_start)
+        y_margin = DETAIL_MARGIN * (y_end - y_start)
+        return detail_view(self.xy, self.sources, self.targets,
+                           (x_start - x_margin, x_end + x_margin,
+                            y_start - y_margin, y_end + y_margin))
+
+    def graph_data(self, view):
+        """
+        Produce the data of a bokeh GraphRenderer drawing a view.
+
+        Args:
+            view (NetworkView): The view to draw.
+
+        Returns:
+            tuple: The node data, edge data and graph layout.
+        """
+        names = self.names[view.nodes].tolist()
+        node_data = {key: [column[i] for i in view.nodes]
+                     for key, column in self.node_columns.items()}
+        node_data['index'] = names
+        edge_data = {key: [column[i] for i in view.edges]
+                     for key, column in self.edge_columns.items()}
+        edge_data['start'] = [names[i] for i in view.starts]
+        edge_data['end'] = [names[i] for i in view.ends]
+        layout = dict(zip(names, self.xy[view.nodes].tolist()))
+        return node_data, edge_data, layout
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import time
+from os import replace, stat
+from os.path import join
+from .simulate import DEFAULT_PARAMETERS, generate_scenarios
+
+# Name of the file, in the scenario directory, recording how each scenario
+# was created
+MANIFEST_FILENAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+# Sections of an .inp file that only change how the network is drawn, so
+# editing them doesn't change the simulated scenarios
+DISPLAY_SECTIONS = {'[TITLE]', '[COORDINATES]', '[VERTICES]', '[LABELS]',
+                    '[BACKDROP]', '[TAGS]'}
+
+# Minimum seconds between saves of the manifest while scenarios are built
+SAVE_INTERVAL = 5.0
+
+
+def network_hash(inp_file):
+    """
+    Hash the parts of an .inp file that affect simulated pollution
+    scenarios.
+
+    Comments, whitespace and the sections in DISPLAY_SECTIONS are ignored,
+    so only edits that can change a simulation change the hash.
+
+    Args:
+        inp_file (str): The path of the EPANET .inp file.
+
+    Returns:
+        str: The hex digest of the SHA-256 hash.
+    """
+    sha = hashlib.sha256()
+    include = True
+    with open(inp_file, 'r') as stream:
+        for line in stream:
+            line = ' '.join(line.split(';')[0].split())
+            if line.startswith('['):
+                include = line.upper() not in DISPLAY_SECTIONS
+            if include and line:
+                sha.update(line.encode() + b'\n')
+    return sha.hexdigest()
+
+
+def checksum(data):
+    """The hex digest of the SHA-256 hash of some bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_checksum(filename):
+    """The hex digest of the SHA-256 hash of a file"""
+    with open(filename, 'rb') as stream:
+        return checksum(stream.read())
+
+
+def load_manifest(directory):
+    """Load the manifest of a scenario directory, or None if it has none"""
+    try:
+        with open(join(directory, MANIFEST_FILENAME), 'r') as stream:
+            manifest = json.load(stream)
+    except FileNotFoundError:
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError("Unsupported " + MANIFEST_FILENAME + " version in "
+                         + directory)
+    return manifest
+
+
+def save_manifest(directory, manifest):
+    """Save the manifest of a scenario directory"""
+    filename = join(directory, MANIFEST_FILENAME)
+    with open(filename + '.tmp', 'w') as stream:
+        json.dump(manifest, stream, indent=1, sort_keys=True)
+    replace(filename + '.tmp', filename)
+
+
+def record_scenario(manifest, directory, injection, inp_hash, parameters):
+    """
+    Add the checksum and origin of a newly written scenario to a manifest.
+
+    Args:
+        manifest (dict): The manifest to update.
+        directory (str): The scenario directory.
+        injection (str): The node label of the injection site.
+        inp_hash (str): The network_hash of the .inp file simulated.
+        parameters (dict): The simulation parameters used.
+    """
+    filename = join(directory, injection + '.pkl')
+    info = stat(filename)
+    manifest['scenarios'][injection] = {
+        'checksum': file_checksum(filename),
+        'size': info.st_size,
+        'mtime_ns': info.st_mtime_ns,
+        'network_hash': inp_hash,
+        'parameters': parameters,
+    }
+
+
+def is_current(record, directory, injection, inp_hash, parameters):
+    """
+    Check a scenario file matches its manifest record, and that the record
+    is for the current network and simulation parameters.
+
+    The checksum of the file is only calculated when its size or
+    modification time differ from the record.
+    """
+    if (record is None or record['network_hash'] != inp_hash
+            or record['parameters'] != parameters):
+        return False
+    filename = join(directory, injection + '.pkl')
+    try:
+        info = stat(filename)
+    except FileNotFoundError:
+        return False
+    if (info.st_size, info.st_mtime_ns) == (record['size'],
+                                            record['mtime_ns']):
+        return True
+    return file_checksum(filename) == record['checksum']
+
+
+def stale_scenarios(inp_file, directory, nodes, parameters):
+    """
+    Find the scenarios that are missing, or don't match the manifest, the
+    network or the simulation parameters.
+
+    Args:
+        inp_file (str): The path of the EPANET .inp file.
+        directory (str): The scenario directory.
+        nodes (list): The injection nodes to check.
+        parameters (dict): The simulation parameters.
+
+    Returns:
+        list: The injection nodes whose scenarios need to be simulated.
+    """
+    manifest = load_manifest(directory) or {'scenarios': {}}
+    inp_hash = network_hash(inp_file)
+    return [node for node in nodes
+            if not is_current(manifest['scenarios'].get(node), directory,
+                              node, inp_hash, parameters)]
+
+
+def build_scenarios(inp_file, directory, nodes, processes=None,
+                    parameters=None, progress=None):
+    """
+    Simulate the scenarios of a set of injection nodes, recording each in
+    the manifest of the scenario directory as it is finished. The manifest
+    is saved even if a simulation fails, so the finished scenarios don't
+    need to be simulated again.
+
+    Args:
+        inp_file (str): The path of the EPANET .inp file.
+        directory (str): The scenario directory.
+        nodes (list): The injection nodes to simulate.
+        processes (int): The number of worker processes.
+        parameters (dict): Simulation parameters to override in
+            DEFAULT_PARAMETERS.
+        progress (callable): Called with the node label, the number of
+            scenarios finished and the total after each simulation.
+
+    Returns:
+        list: The nodes that were simulated.
+    """
+    simulation_parameters = dict(DEFAULT_PARAMETERS)
+    simulation_parameters.update(parameters or {})
+    inp_hash = network_hash(inp_file)
+    manifest = None
+    last_save = [time.time()]
+
+    def record(injection, done, total):
+        nonlocal manifest
+        if manifest is None:
+            # generate_scenarios creates the directory
+            manifest = (load_manifest(directory)
+                        or {'version': MANIFEST_VERSION, 'scenarios': {}})
+        record_scenario(manifest, directory, injection, inp_hash,
+                        simulation_parameters)
+        if time.time() - last_save[0] > SAVE_INTERVAL:
+            save_manifest(directory, manifest)
+            last_save[0] = time.time()
+        if progress is not None:
+            progress(injection, done, total)
+
+    try:
+        return generate_scenarios(inp_file, directory, nodes=nodes,
+                                  processes=processes,
+                                  parameters=simulation_parameters,
+                                  force=True, progress=record)
+    finally:
+        if manifest is not None:
+            save_manifest(directory, manifest)
+
+
+def consistent_scenarios(inp_file, directory):
+    """
+    Find the scenarios that were simulated from the current network, with
+    the parameters of the latest build, according to the manifest.
+
+    Args:
+        inp_file (str): The path of the EPANET .inp file.
+        directory (str): The scenario directory.
+
+    Returns:
+        dict: The checksum of each consistent scenario, keyed by injection
+            node, or None if the directory has no manifest.
+    """
+    manifest = load_manifest(directory)
+    if manifest is None:
+        return None
+    inp_hash = network_hash(inp_file)
+    records = [record for record in manifest['scenarios'].values()
+               if record['network_hash'] == inp_hash]
+    if len(records) == 0:
+        return {}
+    # Scenarios of different simulation parameters can't be compared, use
+    # those of the most common parameters
+    counts = {}
+    for record in records:
+        key = json.dumps(record['parameters'], sort_keys=True)
+        counts[key] = counts.get(key, 0) + 1
+    parameters = json.loads(max(counts, key=counts.get))
+    return {injection: record['checksum']
+            for injection, record in manifest['scenarios'].items()
+            if record['network_hash'] == inp_hash
+            and record['parameters'] == parameters}
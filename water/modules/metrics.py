@@ -0,0 +1,222 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from tornado.web import RequestHandler
+
+# Upper bounds in seconds of the histogram buckets, from a frame drawn well
+# within an animation step to a slow network load
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Every metric of the process, in the order they were created
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n') + '"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """
+    A metric of the server process, exposed in the Prometheus text format
+    by exposition.
+
+    Metrics are created once, at module level, as the modules are shared by
+    every session of the process. Values are kept separately for each
+    combination of label values.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text of the metric.
+        label_names (tuple): The names of the labels.
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def samples(self):
+        """The (suffix, label values, extra labels, value) of each sample"""
+        with self._lock:
+            return [('', labels, (), value)
+                    for labels, value in sorted(self._values.items())]
+
+    def exposition(self):
+        """The metric in the Prometheus text format"""
+        lines = ['# HELP ' + self.name + ' ' + self.documentation,
+                 '# TYPE ' + self.name + ' ' + self.type]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(self.name + suffix
+                         + _format_labels(self.label_names, labels, extra)
+                         + ' ' + _format_value(value))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """A count that only increases"""
+
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        """Increase the count for some label values"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down. If function is given, it is called
+    for the value whenever the metric is exposed.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, function=None):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._values[()] = self._values.get((), 0) + amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self._values[()] = value
+
+    def samples(self):
+        if self.function is not None:
+            return [('', (), (), self.function())]
+        return super().samples()
+
+
+class CounterFunction(Gauge):
+    """A count kept elsewhere, read by calling function when the metric is
+    exposed"""
+
+    type = 'counter'
+
+
+class Histogram(Metric):
+    """
+    Counts of observed durations in cumulative buckets, with their sum.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text of the metric.
+        label_names (tuple): The names of the labels.
+        buckets (tuple): The increasing upper bounds of the buckets.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, *labels):
+        """Record an observation for some label values"""
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [[0] * len(self.buckets), 0.0]
+            counts[0][bucket] += 1
+            counts[1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(('_bucket', labels,
+                                    (('le', _format_value(bound)),),
+                                    cumulative))
+                samples.append(('_sum', labels, (), total))
+                samples.append(('_count', labels, (), cumulative))
+        return samples
+
+
+def timed(histogram, *labels):
+    """
+    Decorate a function to record how long each call takes in a histogram.
+
+    Args:
+        histogram (Histogram): The histogram to record the durations in.
+        labels (str): The label values to record them for.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(function):
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+        return timed_function
+    return decorator
+
+
+def exposition():
+    """
+    Produce every metric of the process in the Prometheus text format.
+
+    Returns:
+        str: The metrics.
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    return ''.join(metric.exposition() for metric in metrics)
+
+
+class MetricsHandler(RequestHandler):
+    """Serves the metrics of the process for Prometheus to scrape, added to
+    the bokeh server with extra_patterns"""
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(exposition())
+
+
+# Metrics of the app, shared by all its sessions
+ACTIVE_SESSIONS = Gauge('water_active_sessions',
+                        "Number of open sessions of the app")
+SESSIONS = Counter('water_sessions_total',
+                   "Number of sessions of the app opened")
+IDLE_SESSIONS = Counter('water_idle_sessions_total',
+                        "Number of sessions closed for being idle")
+LOAD_SECONDS = Histogram('water_load_seconds',
+                         "Time taken to load network data from files",
+                         ['function'])
+CALLBACK_SECONDS = Histogram('water_callback_seconds',
+                             "Time taken by the app's callbacks, update "
+                             "draws one frame of the animation",
+                             ['callback'])
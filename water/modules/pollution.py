@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 
@@ -19,15 +20,12 @@ def pollution_series(pollution_scenario, timestep):
             and injection location.
     """
     # Extract the pollution series at the given timestep
-    if timestep in pollution_scenario.index:
-        series = pollution_scenario.loc[timestep]
-    else:
-        # Construct a series of zero pollution
-        size = pollution_scenario.index.size
-        series = pd.Series(dict(zip(pollution_scenario.columns,
-                                    [0]*size)))
-
-    return series
+    try:
+        return pollution_scenario.loc[timestep]
+    except KeyError:
+        # Construct a series of zero pollution, one for each node
+        return pd.Series(np.zeros(pollution_scenario.columns.size),
+                         index=pollution_scenario.columns)
 
 
 def pollution_history(pollution_scenario, node):
@@ -39,6 +37,7 @@ def pollution_history(pollution_scenario, node):
         pollution_scenario (pandas.Dataframe): A dataframe of the pollution
             values at each node for set of timesteps. The columns of the
             Dataframe are the node labels and the index is a set of timesteps.
+            The ScenarioFrames of a scenario may be used instead.
         node (str): The label of the node.
 
     Returns:
@@ -47,7 +46,7 @@ def pollution_history(pollution_scenario, node):
     """
 
     if node == 'None':
-        return pd.Series([])
+        return pd.Series([], dtype=float)
     else:
         return pollution_scenario[node]
 
@@ -74,3 +73,51 @@ def pollution_scenario(pollution, injection):
     except KeyError:
         error = "Can't find .pkl file for pollution injection at " + injection
         raise KeyError(error)
+
+
+def node_positions(pollution_scenario, nodes):
+    """
+    Find the column of a pollution scenario for each node, so that values
+    from the scenario can be ordered like the nodes with a single index.
+
+    Args:
+        pollution_scenario (pandas.Dataframe): A dataframe of the pollution
+            values at each node for set of timesteps. The columns of the
+            Dataframe are the node labels and the index is a set of timesteps.
+        nodes (list): The node labels in the order required.
+
+    Returns:
+        numpy.ndarray: The integer position of each node in the columns.
+    """
+    positions = pollution_scenario.columns.get_indexer(nodes)
+    if (positions < 0).any():
+        missing = np.asarray(nodes, dtype=object)[positions < 0]
+        raise KeyError("No pollution data for nodes " + ", ".join(missing))
+    return positions
+
+
+def edge_pollution(node_pollution, sources, targets):
+    """
+    Calculate the pollution in each edge (pipe) from the pollution of the
+    nodes it connects.
+
+    The edge value is the mean of the connected nodes, except when one node
+    is zero, which indicates pollution is yet to spread through that edge.
+
+    Args:
+        node_pollution (numpy.ndarray): The pollution value of each node, or
+            an array with a row of node values for each timestep.
+        sources (numpy.ndarray): The position in node_pollution of the first
+            node of each edge.
+        targets (numpy.ndarray): The position in node_pollution of the second
+            node of each edge.
+
+    Returns:
+        numpy.ndarray: The pollution value of each edge, with a row for each
+            timestep if node_pollution has them.
+    """
+    source_pollution = np.take(node_pollution, sources, axis=-1)
+    target_pollution = np.take(node_pollution, targets, axis=-1)
+    edge_values = (source_pollution + target_pollution) / 2.
+    edge_values[(source_pollution == 0) | (target_pollution == 0)] = 0
+    return edge_values
@@ -0,0 +1,596 @@
+import json
+import logging
+import pickle
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from hashlib import sha256
+from os import getpid, listdir, remove, replace, stat
+from os.path import exists, join
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# Name of the file, in the scenario directory, that summarises the scenarios
+SUMMARY_FILENAME = 'summary.json'
+
+# Names of the files, in the scenario directory, of the array format. The
+# array has the shape (injection, timestep, node) and the labels of each axis
+# are stored in the JSON sidecar
+ARRAY_FILENAME = 'scenarios.npy'
+LABELS_FILENAME = 'scenarios.json'
+
+# Names of the files, in the scenario directory, of the sparse format. Most
+# values of a scenario are zero, as pollution takes time to reach a node or
+# never does, so only the values of each node from the first to the last
+# timestep it is polluted are kept, one node after another. The offsets
+# array gives where the values of each injection and node start, CSR style,
+# and the first array the timestep of their first value
+SPARSE_VALUES_FILENAME = 'sparse_values.npy'
+SPARSE_OFFSETS_FILENAME = 'sparse_offsets.npy'
+SPARSE_FIRST_FILENAME = 'sparse_first.npy'
+SPARSE_LABELS_FILENAME = 'sparse_scenarios.json'
+
+# Files written by convert_scenarios, in the array and sparse formats
+ARRAY_FILENAMES = (ARRAY_FILENAME, LABELS_FILENAME)
+SPARSE_FILENAMES = (SPARSE_VALUES_FILENAME, SPARSE_OFFSETS_FILENAME,
+                    SPARSE_FIRST_FILENAME, SPARSE_LABELS_FILENAME)
+
+# Number of levels of log quantized values, stored as uint16 with 0 for no
+# pollution, which keeps them within 0.02% over 10 orders of magnitude, or
+# 0.1% over 50
+LOG_LEVELS = 65535
+
+# Default number of scenarios a ScenarioStore keeps in memory
+DEFAULT_MAX_SCENARIOS = 16
+
+
+def temporary_filename(filename):
+    """The temporary file written before being moved to filename, unique
+    to the process, as the server processes write the same derived files"""
+    return filename + '.' + str(getpid()) + '.tmp'
+
+
+def scenario_files(directory):
+    """
+    List the pollution scenario files in a directory.
+
+    Args:
+        directory (str): The directory containing .pkl scenario files.
+
+    Returns:
+        dict: The size and modification time in ns of each .pkl file, keyed
+            by filename.
+    """
+    files = {}
+    for filename in listdir(directory):
+        if filename.endswith('.pkl'):
+            info = stat(join(directory, filename))
+            files[filename] = [info.st_size, info.st_mtime_ns]
+    return files
+
+
+def summarise_scenarios(directory, files):
+    """
+    Read every scenario in a directory once to find the range of pollution
+    values and the timesteps.
+
+    Args:
+        directory (str): The directory containing .pkl scenario files.
+        files (dict): The scenario files, as returned by scenario_files.
+
+    Returns:
+        dict: The summary, with keys 'files', 'max_pol', 'min_pol' and
+            'timesteps'.
+    """
+    max_pols = []
+    min_pols = []
+    timesteps = None
+    for filename in sorted(files):
+        with open(join(directory, filename), 'rb') as input_file:
+            pollution_df = pickle.load(input_file)
+        v = pollution_df.values.ravel()
+        max_pols.append(np.max(v))
+        try:  # below will error for a df where all values zero
+            min_pols.append(np.min(v[v > 0]))
+        except ValueError:
+            pass
+        if timesteps is None:
+            # This assumes all scenarios are identical in time
+            timesteps = [int(t) for t in pollution_df.index]
+
+    return {'files': files,
+            'max_pol': float(np.max(max_pols)),
+            'min_pol': float(np.min(min_pols)),
+            'timesteps': timesteps}
+
+
+def load_summary(directory):
+    """
+    Load the summary of the scenarios in a directory, creating it if it is
+    missing or the scenario files have changed since it was written.
+
+    Args:
+        directory (str): The directory containing .pkl scenario files.
+
+    Returns:
+        dict: The summary, see summarise_scenarios.
+    """
+    files = scenario_files(directory)
+    summary_file = join(directory, SUMMARY_FILENAME)
+    try:
+        with open(summary_file, 'r') as stream:
+            summary = json.load(stream)
+        if summary['files'] == files:
+            return summary
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    summary = summarise_scenarios(directory, files)
+    try:
+        # Write to a temporary file first so concurrent readers never see a
+        # partially written summary
+        with open(temporary_filename(summary_file), 'w') as stream:
+            json.dump(summary, stream)
+        replace(temporary_filename(summary_file), summary_file)
+    except OSError:
+        # A read only data directory just means summarising again next time
+        pass
+    return summary
+
+
+class ScenarioStore(Mapping):
+    """
+    A read only mapping of injection node to pollution dynamics dataframe
+    that reads each scenario from disk the first time it is used.
+
+    Only the most recently used scenarios are kept in memory. The range of
+    pollution values and the timesteps come from the scenario summary so that
+    scenarios don't need to be read to set up the visualisation. A store is
+    safe to share between threads.
+
+    Args:
+        directory (str): The directory containing .pkl scenario files.
+        max_scenarios (int): The number of scenarios to keep in memory.
+        checksums (dict): The expected checksum of each scenario that may be
+            used, keyed by injection node, or None to use every scenario.
+            Scenarios are checked against it when they are read.
+    """
+
+    def __init__(self, directory, max_scenarios=DEFAULT_MAX_SCENARIOS,
+                 checksums=None):
+        self.directory = directory
+        self.max_scenarios = max_scenarios
+        self.checksums = checksums
+        summary = load_summary(directory)
+        self.injection_nodes = sorted(
+            filename.split('.pkl')[0] for filename in summary['files']
+            if checksums is None or filename.split('.pkl')[0] in checksums)
+        self.max_pol = summary['max_pol']
+        self.min_pol = summary['min_pol']
+        self.timesteps = np.array(summary['timesteps'])
+        self._injections = set(self.injection_nodes)
+        self._scenarios = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, injection):
+        if injection not in self._injections:
+            raise KeyError(injection)
+        with self._lock:
+            if injection in self._scenarios:
+                self._scenarios.move_to_end(injection)
+                return self._scenarios[injection]
+
+        scenario = self._read(injection)
+
+        with self._lock:
+            self._scenarios[injection] = scenario
+            while len(self._scenarios) > self.max_scenarios:
+                self._scenarios.popitem(last=False)
+        return scenario
+
+    def __iter__(self):
+        return iter(self.injection_nodes)
+
+    def __len__(self):
+        return len(self.injection_nodes)
+
+    def loaded_nbytes(self):
+        """The size in bytes of the scenarios kept in memory, which the
+        network cache measures again as they are read"""
+        with self._lock:
+            scenarios = list(self._scenarios.values())
+        return sum(int(scenario.memory_usage(index=True).sum())
+                   for scenario in scenarios)
+
+    def _read(self, injection):
+        filename = join(self.directory, injection + '.pkl')
+        with open(filename, 'rb') as input_file:
+            data = input_file.read()
+        if (self.checksums is not None
+                and sha256(data).hexdigest() != self.checksums[injection]):
+            raise ValueError("Scenario " + injection + " has changed since "
+                             "it was simulated, rebuild the scenarios")
+        return pickle.loads(data)
+
+
+def converted_up_to_date(directory, labels_filename):
+    """
+    Whether the scenarios of a converted format were converted from the .pkl
+    files now in a directory, which have the sizes and modification times
+    recorded in its labels file by convert_scenarios.
+
+    Args:
+        directory (str): The directory containing .pkl scenario files.
+        labels_filename (str): The name of the labels file of the format.
+
+    Returns:
+        bool: False if the .pkl files have been added, removed or changed
+            since the conversion, or the conversion didn't record them.
+    """
+    try:
+        with open(join(directory, labels_filename), 'r') as stream:
+            labels = json.load(stream)
+    except (FileNotFoundError, ValueError):
+        return False
+    return labels.get('files') == scenario_files(directory)
+
+
+def _usable_injections(labels, checksums, filename, directory):
+    """The injection nodes of converted scenarios that were converted from
+    the .pkl files with the expected checksums"""
+    if checksums is None:
+        return labels['injection_nodes']
+    if 'checksums' not in labels:
+        raise ValueError(filename + " in " + directory + " was converted "
+                         "before the scenarios had a manifest, convert the "
+                         "scenarios again")
+    return [injection for injection, converted_checksum
+            in zip(labels['injection_nodes'], labels['checksums'])
+            if checksums.get(injection) == converted_checksum]
+
+
+class ArrayScenarioStore(Mapping):
+    """
+    A read only mapping of injection node to pollution dynamics dataframe
+    backed by a single memory mapped array of every scenario.
+
+    The array is written by convert_scenarios. Dataframes returned by the
+    store are views of the memory mapped file, so no scenario is copied into
+    the memory of the process and several server processes share the same
+    pages of the OS page cache.
+
+    Args:
+        directory (str): The directory containing the scenarios.npy and
+            scenarios.json files.
+        checksums (dict): The expected checksum of the .pkl file each
+            scenario that may be used was converted from, keyed by injection
+            node, or None to use every scenario.
+    """
+
+    def __init__(self, directory, checksums=None):
+        self.directory = directory
+        with open(join(directory, LABELS_FILENAME), 'r') as stream:
+            labels = json.load(stream)
+        self.data = np.load(join(directory, ARRAY_FILENAME), mmap_mode='r',
+                            allow_pickle=False)
+        self.injection_nodes = _usable_injections(labels, checksums,
+                                                  ARRAY_FILENAME, directory)
+        self.nodes = pd.Index(labels['nodes'])
+        self.timesteps = np.array(labels['timesteps'])
+        self.max_pol = labels['max_pol']
+        self.min_pol = labels['min_pol']
+        usable = set(self.injection_nodes)
+        self._positions = {injection: i for i, injection
+                           in enumerate(labels['injection_nodes'])
+                           if injection in usable}
+
+        expected_shape = (len(labels['injection_nodes']), len(self.timesteps),
+                          len(self.nodes))
+        if self.data.shape != expected_shape:
+            raise ValueError("Scenario array shape " + str(self.data.shape)
+                             + " doesn't match its labels in "
+                             + LABELS_FILENAME)
+
+    def __getitem__(self, injection):
+        return pd.DataFrame(self.data[self._positions[injection]],
+                            index=self.timesteps, columns=self.nodes,
+                            copy=False)
+
+    def __iter__(self):
+        return iter(self.injection_nodes)
+
+    def __len__(self):
+        return len(self.injection_nodes)
+
+
+class SparseScenarioStore(ScenarioStore):
+    """
+    A read only mapping of injection node to pollution dynamics dataframe
+    backed by the memory mapped files of the sparse format.
+
+    The files are written by convert_scenarios with sparse set, and hold
+    only the polluted values of each node, so they are typically an order of
+    magnitude smaller than the array format. A scenario is expanded into a
+    dataframe when it is used, and only the most recently used scenarios are
+    kept in memory, as by a ScenarioStore. Unlike the memory mapped array
+    format, the expanded scenarios aren't shared between processes.
+
+    Args:
+        directory (str): The directory containing the sparse format files.
+        max_scenarios (int): The number of scenarios to keep expanded in
+            memory.
+        checksums (dict): The expected checksum of the .pkl file each
+            scenario that may be used was converted from, keyed by injection
+            node, or None to use every scenario.
+    """
+
+    def __init__(self, directory, max_scenarios=DEFAULT_MAX_SCENARIOS,
+                 checksums=None):
+        self.directory = directory
+        self.max_scenarios = max_scenarios
+        self.checksums = checksums
+        with open(join(directory, SPARSE_LABELS_FILENAME), 'r') as stream:
+            labels = json.load(stream)
+        self.values = np.load(join(directory, SPARSE_VALUES_FILENAME),
+                              mmap_mode='r', allow_pickle=False)
+        self.offsets = np.load(join(directory, SPARSE_OFFSETS_FILENAME),
+                               mmap_mode='r', allow_pickle=False)
+        self.first = np.load(join(directory, SPARSE_FIRST_FILENAME),
+                             mmap_mode='r', allow_pickle=False)
+        self.injection_nodes = _usable_injections(
+            labels, checksums, SPARSE_VALUES_FILENAME, directory)
+        self.nodes = pd.Index(labels['nodes'])
+        self.timesteps = np.array(labels['timesteps'])
+        self.max_pol = labels['max_pol']
+        self.min_pol = labels['min_pol']
+        self.log_quantized = labels['log_quantized']
+        usable = set(self.injection_nodes)
+        self._positions = {injection: i for i, injection
+                           in enumerate(labels['injection_nodes'])
+                           if injection in usable}
+        self._injections = usable
+        self._scenarios = OrderedDict()
+        self._lock = threading.Lock()
+
+        expected_shape = (len(labels['injection_nodes']), len(self.nodes))
+        if (self.first.shape != expected_shape
+                or self.offsets.shape != (self.first.size + 1,)
+                or self.offsets[-1] != len(self.values)):
+            raise ValueError("Sparse scenario files in " + directory
+                             + " don't match their labels in "
+                             + SPARSE_LABELS_FILENAME)
+
+    def _read(self, injection):
+        i = self._positions[injection]
+        n_nodes = len(self.nodes)
+        offsets = np.asarray(self.offsets[i * n_nodes:(i + 1) * n_nodes + 1])
+        counts = np.diff(offsets)
+        values = self.values[offsets[0]:offsets[-1]]
+        if self.log_quantized:
+            values = dequantize_log(values, self.min_pol, self.max_pol)
+        elif values.dtype == np.float16:
+            values = values.astype(np.float32)
+        # The row of each value is its position less that of the first value
+        # of its node, plus the first timestep of the node
+        rows = np.arange(len(values)) - np.repeat(
+            offsets[:-1] - offsets[0] - self.first[i], counts)
+        columns = np.repeat(np.arange(n_nodes), counts)
+        scenario = np.zeros((len(self.timesteps), n_nodes),
+                            dtype=values.dtype)
+        scenario[rows, columns] = values
+        return pd.DataFrame(scenario, index=self.timesteps,
+                            columns=self.nodes, copy=False)
+
+
+def quantize_log(values, min_pol, max_pol):
+    """
+    Quantize pollution values on a log scale, as they span many orders of
+    magnitude.
+
+    Args:
+        values (numpy.ndarray): The pollution values.
+        min_pol (float): The smallest positive value to represent.
+        max_pol (float): The largest value to represent.
+
+    Returns:
+        numpy.ndarray: The uint16 level of each value, 0 for values that
+            aren't positive.
+    """
+    scale = np.log(max_pol / min_pol) or 1.0
+    levels = np.zeros(np.shape(values), dtype=np.uint16)
+    positive = values > 0
+    logs = np.log(values[positive].astype(np.float64)) - np.log(min_pol)
+    levels[positive] = np.clip(1 + np.rint(logs / scale * (LOG_LEVELS - 1)),
+                               1, LOG_LEVELS)
+    return levels
+
+
+def dequantize_log(levels, min_pol, max_pol):
+    """
+    Recover pollution values from levels produced by quantize_log.
+
+    Args:
+        levels (numpy.ndarray): The uint16 levels.
+        min_pol (float): The smallest positive value quantized.
+        max_pol (float): The largest value quantized.
+
+    Returns:
+        numpy.ndarray: The float32 pollution values.
+    """
+    scale = np.log(max_pol / min_pol) or 1.0
+    values = min_pol * np.exp((np.asarray(levels, dtype=np.float64) - 1)
+                              / (LOG_LEVELS - 1) * scale)
+    values[np.asarray(levels) == 0] = 0
+    return values.astype(np.float32)
+
+
+def open_scenario_store(directory, checksums=None):
+    """
+    Open the pollution scenarios in a directory, using the sparse or array
+    format if it has been created by convert_scenarios from the .pkl files
+    now in the directory, and the .pkl files otherwise.
+
+    Args:
+        directory (str): The scenario directory of a network.
+        checksums (dict): The expected checksum of each scenario that may be
+            used, keyed by injection node, or None to use every scenario.
+
+    Returns:
+        SparseScenarioStore, ArrayScenarioStore or ScenarioStore: The
+            scenarios.
+    """
+    formats = [(SPARSE_VALUES_FILENAME, SPARSE_LABELS_FILENAME),
+               (ARRAY_FILENAME, LABELS_FILENAME)]
+    for filename, labels_filename in formats:
+        if not exists(join(directory, filename)):
+            continue
+        if not converted_up_to_date(directory, labels_filename):
+            log.warning("The .pkl scenarios in %s have changed since they "
+                        "were converted, using them until they are converted "
+                        "again", directory)
+        elif filename == SPARSE_VALUES_FILENAME:
+            return SparseScenarioStore(directory, checksums=checksums)
+        else:
+            return ArrayScenarioStore(directory, checksums)
+    return ScenarioStore(directory, checksums=checksums)
+
+
+def _polluted_runs(values):
+    """The first polluted timestep of each node of a scenario, the number of
+    values from it to the last polluted timestep, and those values one node
+    after another"""
+    polluted = values != 0
+    any_polluted = polluted.any(axis=0)
+    first = np.where(any_polluted, np.argmax(polluted, axis=0), 0)
+    last = len(values) - 1 - np.argmax(polluted[::-1], axis=0)
+    counts = np.where(any_polluted, last - first + 1, 0)
+    rows = np.arange(len(values))[:, np.newaxis]
+    kept = (rows >= first) & (rows <= last) & any_polluted
+    return first, counts, values.T[kept.T]
+
+
+def _save_array(filename, array):
+    """Save an array in the .npy format to a temporary file, to be moved
+    into place once every file has been written"""
+    with open(filename + '.tmp', 'wb') as output:
+        np.save(output, array, allow_pickle=False)
+
+
+def convert_scenarios(directory, dtype='float64', sparse=False,
+                      log_quantize=False):
+    """
+    Convert the .pkl scenario files in a directory into a single array with
+    the shape (injection, timestep, node), saved as scenarios.npy, with the
+    axis labels and the range of pollution values in scenarios.json.
+
+    With sparse set, the files of the sparse format are written instead,
+    keeping only the values of each node from the first to the last
+    timestep it is polluted. Converting to one format removes the files of
+    the other.
+
+    Scenarios are written one at a time into the memory mapped output, so
+    the whole array never has to fit in memory. The sparse format is held
+    in memory while it is converted. The size and modification time of each
+    .pkl file are recorded in the labels, so that the converted scenarios
+    aren't used once the .pkl files change, see converted_up_to_date.
+
+    Args:
+        directory (str): The directory containing .pkl scenario files.
+        dtype (str): The numpy data type to store the values as.
+        sparse (bool): Whether to write the sparse format.
+        log_quantize (bool): Whether to store the values of the sparse
+            format as uint16 levels on a log scale, see quantize_log, rather
+            than as dtype.
+
+    Returns:
+        tuple: The shape of the scenarios, (injection, timestep, node).
+    """
+    if log_quantize and not sparse:
+        raise ValueError("Only the sparse format can be log quantized")
+    files = scenario_files(directory)
+    injection_nodes = sorted(filename.split('.pkl')[0] for filename in files)
+    if len(injection_nodes) == 0:
+        raise ValueError("No .pkl scenario files found in " + directory)
+
+    checksums = []
+
+    def read(injection):
+        with open(join(directory, injection + '.pkl'), 'rb') as input_file:
+            data = input_file.read()
+        checksums.append(sha256(data).hexdigest())
+        return pickle.loads(data)
+
+    first = read(injection_nodes[0])
+    nodes = first.columns
+    timesteps = first.index
+    shape = (len(injection_nodes), len(timesteps), len(nodes))
+
+    if sparse:
+        runs = []
+        first_polluted = np.zeros((shape[0], shape[2]), dtype=np.int32)
+        counts = np.zeros((shape[0], shape[2]), dtype=np.int64)
+    else:
+        array_file = join(directory, ARRAY_FILENAME)
+        data = np.lib.format.open_memmap(array_file + '.tmp', mode='w+',
+                                         dtype=dtype, shape=shape)
+    max_pols = []
+    min_pols = []
+    for i, injection in enumerate(injection_nodes):
+        pollution_df = first if i == 0 else read(injection)
+        if not pollution_df.index.equals(timesteps):
+            raise ValueError("Scenario " + injection + " has different "
+                             "timesteps to " + injection_nodes[0])
+        # Use the same node order for every scenario
+        values = pollution_df.reindex(columns=nodes).values
+        if sparse:
+            first_polluted[i], counts[i], run = _polluted_runs(values)
+            # Levels are calculated once the range of values is known
+            runs.append(run.astype('float32' if log_quantize else dtype))
+        else:
+            data[i] = values
+        max_pols.append(np.max(values))
+        positive = values[values > 0]
+        if positive.size > 0:
+            min_pols.append(np.min(positive))
+
+    labels = {'injection_nodes': injection_nodes,
+              'nodes': [str(node) for node in nodes],
+              'timesteps': [int(t) for t in timesteps],
+              'checksums': checksums,
+              'files': files,
+              'max_pol': float(np.max(max_pols)),
+              'min_pol': float(np.min(min_pols))}
+    if sparse:
+        values = np.concatenate(runs)
+        if log_quantize:
+            values = quantize_log(values, labels['min_pol'],
+                                  labels['max_pol'])
+        offsets = np.zeros(counts.size + 1, dtype=np.int64)
+        np.cumsum(counts.ravel(), out=offsets[1:])
+        labels['log_quantized'] = log_quantize
+        labels_file = join(directory, SPARSE_LABELS_FILENAME)
+        arrays = [SPARSE_OFFSETS_FILENAME, SPARSE_FIRST_FILENAME,
+                  SPARSE_VALUES_FILENAME]
+        for filename, array in zip(arrays, [offsets, first_polluted, values]):
+            _save_array(join(directory, filename), array)
+        other_format = ARRAY_FILENAMES
+    else:
+        data.flush()
+        del data
+        labels_file = join(directory, LABELS_FILENAME)
+        arrays = [ARRAY_FILENAME]
+        other_format = SPARSE_FILENAMES
+
+    with open(labels_file + '.tmp', 'w') as stream:
+        json.dump(labels, stream)
+    # Move the arrays into place last, and the values of the sparse format
+    # last of all, as the scenarios are only used once they exist
+    replace(labels_file + '.tmp', labels_file)
+    for filename in arrays:
+        replace(join(directory, filename) + '.tmp', join(directory, filename))
+    for filename in other_format:
+        if exists(join(directory, filename)):
+            remove(join(directory, filename))
+    return shape
@@ -0,0 +1,62 @@
+from bisect import bisect_left
+import numpy as np
+
+# Number of matching node names offered while typing
+TOP_MATCHES = 10
+
+
+class NodeIndex:
+    """
+    The names of the nodes of a network, indexed to find a node's position
+    in the graph, and the names starting with some text, without going
+    through every node.
+
+    Args:
+        names (list): The node names, in graph order.
+    """
+
+    def __init__(self, names):
+        self.names = np.array(names, dtype=object)
+        self._positions = {name: i for i, name in enumerate(self.names)}
+        keys = [str(name).lower() for name in self.names]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self._keys = [keys[i] for i in order]
+        self._sorted_names = [self.names[i] for i in order]
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def __len__(self):
+        return len(self.names)
+
+    def position(self, name):
+        """
+        Find the position of a node in the graph.
+
+        Args:
+            name (str): The node name.
+
+        Returns:
+            int: The position of the node, or None if there is no such node.
+        """
+        return self._positions.get(name)
+
+    def search(self, text, top=TOP_MATCHES):
+        """
+        Find the node names starting with some text, ignoring case.
+
+        Args:
+            text (str): The start of the names.
+            top (int): The largest number of names to return.
+
+        Returns:
+            list: The matching names in alphabetical order.
+        """
+        prefix = text.strip().lower()
+        start = bisect_left(self._keys, prefix)
+        matches = []
+        for i in range(start, min(start + top, len(self._keys))):
+            if not self._keys[i].startswith(prefix):
+                break
+            matches.append(self._sorted_names[i])
+        return matches
@@ -0,0 +1,108 @@
+import heapq
+import numpy as np
+
+
+class DetectionIndex:
+    """
+    How soon a sensor at each node would detect each pollution scenario,
+    precomputed from the arrival times of the pollution analytics so that
+    placing sensors doesn't need the scenarios.
+
+    The delay of a scenario is counted from the pollution first reaching
+    the network. Scenarios a sensor doesn't detect by the end of the
+    simulation count as detected at the end, so the placement favours
+    detecting more scenarios as well as detecting them sooner. Scenarios
+    whose pollution never exceeds the analytics threshold anywhere are
+    left out.
+
+    Args:
+        arrival (numpy.ndarray): The arrival time of pollution at each node
+            in each scenario, with the shape (injection node, node) and
+            infinite where pollution never arrives.
+        end (float): The last timestep of the scenarios.
+    """
+
+    def __init__(self, arrival, end):
+        detectable = np.isfinite(arrival).any(axis=1)
+        arrival = arrival[detectable]
+        start = arrival.min(axis=1)
+        # The delay if the scenario isn't detected
+        self.penalties = end - start
+        # Laid out by node so each node's delays are contiguous
+        self.delays = np.ascontiguousarray(
+            (np.minimum(arrival, end) - start[:, np.newaxis]).T)
+        self.n_scenarios = len(self.penalties)
+
+    def detection(self, nodes):
+        """
+        Measure how well sensors at a set of nodes detect the scenarios.
+
+        Args:
+            nodes (list): The positions of the nodes with sensors.
+
+        Returns:
+            tuple: The fraction of the scenarios detected, and the mean
+                delay, counting undetected scenarios as in DetectionIndex.
+        """
+        best = self.penalties.copy()
+        for node in nodes:
+            best = np.minimum(best, self.delays[node])
+        if self.n_scenarios == 0:
+            return 0.0, 0.0
+        return np.mean(best < self.penalties), best.mean()
+
+    def gains(self, best):
+        """The total reduction in the delay of the scenarios from adding a
+        sensor at each node, given the best delays of the sensors so far"""
+        return np.maximum(best - self.delays, 0).sum(axis=1)
+
+
+def place_sensors(index, budget, candidates=None):
+    """
+    Choose nodes for sensors that minimise the mean delay before the
+    pollution scenarios are detected.
+
+    The reduction in delay is submodular, so nodes are added greedily, each
+    being the one that reduces the delay most, which is within a factor
+    (1 - 1/e) of the best placement. Gains can only shrink as sensors are
+    added, so a node's gain is only recalculated when it might be the best
+    (lazy greedy or CELF), rather than recalculating every node for every
+    sensor.
+
+    Args:
+        index (DetectionIndex): The detection delays.
+        budget (int): The largest number of sensors to place. Fewer are
+            placed if more sensors wouldn't detect anything sooner.
+        candidates (numpy.ndarray): The positions of the nodes sensors may
+            be placed at, by default any node.
+
+    Returns:
+        tuple: The positions of the chosen nodes, in the order they were
+            chosen, and the mean delay after adding each of them.
+    """
+    best = index.penalties.copy()
+    if candidates is None:
+        candidates = np.arange(len(index.delays))
+    if index.n_scenarios == 0 or len(candidates) == 0:
+        return [], []
+    # Heap of (-gain, node, number of sensors chosen when it was calculated)
+    heap = [(-gain, node, 0) for node, gain
+            in zip(candidates.tolist(), index.gains(best)[candidates])]
+    heapq.heapify(heap)
+
+    chosen = []
+    mean_delays = []
+    while len(chosen) < budget and heap:
+        negative_gain, node, calculated = heapq.heappop(heap)
+        if calculated < len(chosen):
+            # Recalculate the stale gain, it's the best if it still beats
+            # the others' gains, which can only be overestimates
+            gain = np.maximum(best - index.delays[node], 0).sum()
+            heapq.heappush(heap, (-gain, node, len(chosen)))
+            continue
+        if negative_gain >= 0:
+            break
+        chosen.append(node)
+        best = np.minimum(best, index.delays[node])
+        mean_delays.append(best.mean())
+    return chosen, mean_delays
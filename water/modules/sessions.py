@@ -0,0 +1,56 @@
+from os import environ
+import time
+
+# Minutes a session can go without the user doing anything before it is
+# closed, releasing its network and stopping its animation, or 0, the
+# default, to keep idle sessions open. Can be set with the
+# WATER_IDLE_MINUTES environment variable
+IDLE_MINUTES = float(environ.get('WATER_IDLE_MINUTES', 0))
+# Seconds between checks of whether a session is idle
+IDLE_CHECK_SECONDS = 60
+
+
+class SessionActivity:
+    """
+    When the user of a session last did something, changing a widget in the
+    browser or clicking a button or the plot. Changes made by the server,
+    such as the frames of an animation, don't count.
+
+    Args:
+        clock (callable): The clock giving the current time in seconds.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.last = clock()
+        self._ignored = set()
+
+    def touch(self, event=None):
+        """Record that the user did something now, can be registered as a
+        callback of any model event"""
+        self.last = self.clock()
+
+    def changed(self, event):
+        """Document change callback, recording the changes made by the
+        browser, apart from those to the ignored models"""
+        if (event.setter is not None
+                and getattr(event, 'model', None) not in self._ignored):
+            self.touch()
+
+    def ignore(self, *models):
+        """Don't count changes to some models, which the browser changes
+        without the user, like the widgets moved by the browser animation"""
+        self._ignored.update(models)
+
+    def forget(self, *models):
+        """Stop ignoring models that have been removed from the document"""
+        self._ignored.difference_update(models)
+
+    def idle_seconds(self):
+        """The seconds since the user last did something"""
+        return self.clock() - self.last
+
+    def idle(self, minutes=IDLE_MINUTES):
+        """Whether the user hasn't done anything for some minutes, never if
+        minutes is 0"""
+        return minutes > 0 and self.idle_seconds() > minutes * 60
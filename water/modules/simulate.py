@@ -0,0 +1,173 @@
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import exists, join
+import wntr
+
+# Simulation parameters of the example scenarios, pollution is injected at
+# 10-11hr and the spread is reported every 5 minutes for 24hr
+DEFAULT_PARAMETERS = {
+    'duration': 24 * 3600,
+    'timestep': 300,
+    'injection_start': 10 * 3600,
+    'injection_end': 11 * 3600,
+    'source_type': 'SETPOINT',
+    'strength': 1000.0,
+}
+
+# Names of the pattern and source added to the network for the injection
+SOURCE_PATTERN = 'PollutionInjectionPattern'
+SOURCE_NAME = 'PollutionInjection'
+
+# The network model of a worker process, see _simulate_worker
+_worker = {}
+
+
+def water_quality_model(inp_file, parameters):
+    """
+    Create a water network model set up for a water quality (CHEM)
+    simulation of a pollution injection.
+
+    Args:
+        inp_file (str): The path of the EPANET .inp file.
+        parameters (dict): The simulation parameters, see DEFAULT_PARAMETERS.
+
+    Returns:
+        wntr.network.WaterNetworkModel: The network model, with the
+            injection pattern added but no source.
+    """
+    wn = wntr.network.WaterNetworkModel(inp_file)
+    wn.options.quality.parameter = 'CHEM'
+    wn.options.time.duration = parameters['duration']
+    wn.options.time.hydraulic_timestep = parameters['timestep']
+    wn.options.time.quality_timestep = parameters['timestep']
+    wn.options.time.report_timestep = parameters['timestep']
+    wn.options.time.report_start = 0
+    pattern = wntr.network.elements.Pattern.binary_pattern(
+        SOURCE_PATTERN,
+        start_time=parameters['injection_start'],
+        end_time=parameters['injection_end'],
+        duration=parameters['duration'],
+        step_size=wn.options.time.pattern_timestep)
+    wn.add_pattern(SOURCE_PATTERN, pattern)
+    return wn
+
+
+def simulate_injection(wn, injection, file_prefix, parameters):
+    """
+    Simulate the spread of pollution injected at a node.
+
+    Args:
+        wn (wntr.network.WaterNetworkModel): A model from
+            water_quality_model.
+        injection (str): The node label of the injection site.
+        file_prefix (str): The prefix of the EPANET files written while
+            simulating.
+        parameters (dict): The simulation parameters, see DEFAULT_PARAMETERS.
+
+    Returns:
+        pandas.Dataframe: The pollution value at each node for each
+            timestep, in the format load_pollution_dynamics expects. The
+            columns of the Dataframe are the node labels and the index is the
+            timesteps in seconds.
+    """
+    wn.add_source(SOURCE_NAME, injection, parameters['source_type'],
+                  parameters['strength'], SOURCE_PATTERN)
+    try:
+        sim = wntr.sim.EpanetSimulator(wn)
+        results = sim.run_sim(file_prefix=file_prefix)
+    finally:
+        wn.remove_source(SOURCE_NAME)
+    return results.node['quality']
+
+
+def write_scenario(pollution_df, filename):
+    """Pickle a pollution scenario, writing to a temporary file first so an
+    interrupted run never leaves a partial scenario behind"""
+    with open(filename + '.tmp', 'wb') as output_file:
+        pickle.dump(pollution_df, output_file,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + '.tmp', filename)
+
+
+def _simulate_worker(injection, output_dir, inp_file, parameters, work_dir):
+    # Load the network once for all the simulations of a worker process
+    if _worker.get('key') != (inp_file, repr(parameters)):
+        _worker['wn'] = water_quality_model(inp_file, parameters)
+        _worker['key'] = (inp_file, repr(parameters))
+        _worker['parameters'] = parameters
+        _worker['work_dir'] = work_dir
+    # Each process needs its own EPANET files
+    file_prefix = join(_worker['work_dir'], str(os.getpid()))
+    pollution_df = simulate_injection(_worker['wn'], injection, file_prefix,
+                                      _worker['parameters'])
+    write_scenario(pollution_df, join(output_dir, injection + '.pkl'))
+    return injection
+
+
+def candidate_injection_nodes(inp_file):
+    """The nodes of a network pollution can be injected at, its junctions"""
+    return wntr.network.WaterNetworkModel(inp_file).junction_name_list
+
+
+def generate_scenarios(inp_file, output_dir, nodes=None, processes=None,
+                       parameters=None, force=False, progress=None):
+    """
+    Simulate pollution injected at each of a set of nodes, using a pool of
+    processes, and save each scenario as a .pkl file in output_dir.
+
+    Finished scenarios act as checkpoints, nodes that already have a .pkl
+    file are skipped unless force is set, so an interrupted run can be
+    resumed by running it again. If a simulation fails, the others are
+    still finished and reported to progress before its error is raised.
+
+    Args:
+        inp_file (str): The path of the EPANET .inp file.
+        output_dir (str): The scenario directory, created if missing.
+        nodes (list): The injection nodes, by default every junction.
+        processes (int): The number of worker processes, by default the
+            number of CPUs.
+        parameters (dict): Simulation parameters to override in
+            DEFAULT_PARAMETERS.
+        force (bool): Whether to simulate nodes that already have a scenario.
+        progress (callable): Called with the node label, the number of
+            scenarios finished and the total after each simulation.
+
+    Returns:
+        list: The nodes that were simulated.
+    """
+    simulation_parameters = dict(DEFAULT_PARAMETERS)
+    simulation_parameters.update(parameters or {})
+    if nodes is None:
+        nodes = candidate_injection_nodes(inp_file)
+    os.makedirs(output_dir, exist_ok=True)
+    todo = [node for node in nodes
+            if force or not exists(join(output_dir, node + '.pkl'))]
+    if len(todo) == 0:
+        return []
+
+    work_dir = tempfile.mkdtemp(prefix='water-simulate-')
+    try:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_simulate_worker, node, output_dir,
+                                       inp_file, simulation_parameters,
+                                       work_dir)
+                       for node in todo]
+            done = 0
+            errors = []
+            for future in as_completed(futures):
+                try:
+                    injection = future.result()
+                except Exception as error:
+                    errors.append(error)
+                    continue
+                done += 1
+                if progress is not None:
+                    progress(injection, done, len(todo))
+            if len(errors) > 0:
+                raise errors[0]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return todo
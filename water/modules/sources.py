@@ -0,0 +1,295 @@
+import json
+from os import remove, replace, stat
+from os.path import exists, join
+import numpy as np
+from .analytics import DEFAULT_THRESHOLD
+from .pollution import node_positions
+from .scenarios import (ARRAY_FILENAME, SPARSE_VALUES_FILENAME,
+                        scenario_files, temporary_filename)
+
+# Names of the files, in the scenario directory, of the source index. Only
+# the polluted values are stored, a row for each timestep and node in turn,
+# holding the positions of the injection nodes whose scenarios pollute the
+# node then and those values. The offsets file has the start of each row and
+# the end of the last. The labels of the timesteps, nodes and injection nodes
+# are stored in the JSON sidecar
+SOURCE_OFFSETS_FILENAME = 'source_index_offsets.npy'
+SOURCE_INJECTIONS_FILENAME = 'source_index_injections.npy'
+SOURCE_VALUES_FILENAME = 'source_index_values.npy'
+SOURCE_LABELS_FILENAME = 'source_index.json'
+SOURCE_INDEX_FILENAMES = (SOURCE_OFFSETS_FILENAME, SOURCE_INJECTIONS_FILENAME,
+                          SOURCE_VALUES_FILENAME, SOURCE_LABELS_FILENAME)
+# The dense index of earlier versions, removed when the index is built
+DENSE_SOURCE_INDEX_FILENAME = 'source_index.npy'
+
+# Number of candidate injection nodes shown
+TOP_CANDIDATES = 5
+
+
+def source_files(directory):
+    """The size and modification time in ns of the scenario files an index
+    of a directory is built from, keyed by filename"""
+    files = scenario_files(directory)
+    for filename in (ARRAY_FILENAME, SPARSE_VALUES_FILENAME):
+        array_file = join(directory, filename)
+        if exists(array_file):
+            info = stat(array_file)
+            files[filename] = [info.st_size, info.st_mtime_ns]
+    return files
+
+
+class SourceIndex:
+    """
+    The pollution of every scenario at each node and timestep, arranged so
+    that the scenarios that best explain a few observed concentrations are
+    found by reading only the values at the observed nodes.
+
+    Args:
+        offsets (numpy.ndarray): The start of the values of each timestep
+            and node, the row timestep * number of nodes + node, followed by
+            the end of the last row.
+        injections (numpy.ndarray): The position of the injection node of
+            each value.
+        values (numpy.ndarray): The polluted values.
+        injection_nodes (list): The injection nodes of the scenarios.
+        nodes (list): The node labels.
+        timesteps (numpy.ndarray): The timesteps.
+    """
+
+    def __init__(self, offsets, injections, values, injection_nodes, nodes,
+                 timesteps):
+        self.offsets = offsets
+        self.injections = injections
+        self.values = values
+        self.injection_nodes = list(injection_nodes)
+        self.nodes = list(nodes)
+        self.timesteps = np.asarray(timesteps)
+        self._node_positions = {node: i for i, node in enumerate(self.nodes)}
+        self._rows = {timestep: i
+                      for i, timestep in enumerate(self.timesteps.tolist())}
+
+    def expected(self, timestep, positions):
+        """
+        Get the pollution of every scenario at some nodes at a timestep.
+
+        Args:
+            timestep (int): The timestep.
+            positions (list): The positions of the nodes.
+
+        Returns:
+            numpy.ndarray: The pollution with the shape (node, injection
+                node).
+        """
+        expected = np.zeros((len(positions), len(self.injection_nodes)),
+                            dtype='float32')
+        first_row = self._rows[timestep] * len(self.nodes)
+        for i, position in enumerate(positions):
+            start, end = self.offsets[first_row + position:
+                                      first_row + position + 2]
+            expected[i, self.injections[start:end]] = self.values[start:end]
+        return expected
+
+    def rank(self, observations, timestep, top=TOP_CANDIDATES):
+        """
+        Find the injection nodes whose scenarios best match observed
+        pollution.
+
+        Concentrations are compared on a log scale, as they span many orders
+        of magnitude, with concentrations below the pollution analytics
+        threshold treated as clean water.
+
+        Args:
+            observations (dict): The observed concentration at each node.
+            timestep (int): The time of the observations.
+            top (int): The number of candidates to return.
+
+        Returns:
+            list: (injection node, error) pairs, best first, where the error
+                is the root mean square difference of the log10
+                concentrations.
+        """
+        if timestep not in self._rows:
+            raise ValueError("No pollution data at timestep "
+                             + str(timestep))
+        unknown = [node for node in observations
+                   if node not in self._node_positions]
+        if unknown:
+            raise ValueError("Unknown nodes: " + ', '.join(unknown))
+        if len(observations) == 0:
+            return []
+        positions = [self._node_positions[node] for node in observations]
+        expected = self.expected(timestep, positions)
+        observed = np.array(list(observations.values()), dtype=float)
+        differences = (
+            np.log10(expected + DEFAULT_THRESHOLD)
+            - np.log10(np.maximum(observed, 0)
+                       + DEFAULT_THRESHOLD)[:, np.newaxis])
+        errors = np.sqrt(np.mean(differences ** 2, axis=0))
+        top = min(top, len(errors))
+        best = np.argpartition(errors, top - 1)[:top]
+        best = best[np.argsort(errors[best], kind='stable')]
+        return [(self.injection_nodes[i], float(errors[i])) for i in best]
+
+
+def _scenario_values(scenario, nodes):
+    """The values of a scenario with the nodes in graph order, as float32"""
+    return scenario.values[:, node_positions(scenario, nodes)].astype(
+        'float32')
+
+
+def _open_array(directory, filename, dtype, shape):
+    """Create an array, memory mapped to a temporary file in directory to be
+    moved into place once written, or in memory if directory is None"""
+    if directory is None:
+        return np.zeros(shape, dtype=dtype)
+    return np.lib.format.open_memmap(
+        temporary_filename(join(directory, filename)), mode='w+',
+        dtype=dtype, shape=shape)
+
+
+def build_source_index(pollution, injection_nodes, nodes, timesteps,
+                       directory=None):
+    """
+    Build the source index of the scenarios of a network, saving it in the
+    scenario directory so that it is only built once.
+
+    Only polluted values are kept, so the index is about the size of the
+    scenarios in the sparse format. The scenarios are read twice, once to
+    count the values of each row and once to copy them, so only one
+    scenario and the index, memory mapped when it is saved, are held in
+    memory.
+
+    Args:
+        pollution (Mapping): The pollution scenario of each injection node.
+        injection_nodes (list): The injection nodes to index.
+        nodes (list): The node labels in graph order.
+        timesteps (numpy.ndarray): The timesteps of the scenarios.
+        directory (str): The scenario directory to save the index in, or
+            None to keep it in memory.
+
+    Returns:
+        SourceIndex: The index.
+    """
+    counts = np.zeros(len(timesteps) * len(nodes), dtype='int64')
+    for injection in injection_nodes:
+        counts += (_scenario_values(pollution[injection], nodes) > 0).ravel()
+    offsets = np.zeros(len(counts) + 1, dtype='int64')
+    np.cumsum(counts, out=offsets[1:])
+    del counts
+
+    n_values = int(offsets[-1])
+
+    if directory is not None:
+        files = source_files(directory)
+        try:
+            arrays = [_open_array(directory, filename, dtype, shape)
+                      for filename, dtype, shape in (
+                          (SOURCE_OFFSETS_FILENAME, 'int64', offsets.shape),
+                          (SOURCE_INJECTIONS_FILENAME, 'int32', (n_values,)),
+                          (SOURCE_VALUES_FILENAME, 'float32', (n_values,)))]
+        except OSError:
+            # A read only data directory just means building it every time
+            directory = None
+    if directory is None:
+        arrays = [offsets, np.zeros(n_values, dtype='int32'),
+                  np.zeros(n_values, dtype='float32')]
+    arrays[0][:] = offsets
+    injections, values = arrays[1:]
+
+    # The next free place in each row
+    filled = offsets[:-1].copy()
+    for i, injection in enumerate(injection_nodes):
+        scenario = _scenario_values(pollution[injection], nodes).ravel()
+        rows = np.flatnonzero(scenario > 0)
+        places = filled[rows]
+        injections[places] = i
+        values[places] = scenario[rows]
+        filled[rows] += 1
+
+    if directory is not None:
+        for array in arrays:
+            array.flush()
+        del arrays, injections, values
+        labels = {'injection_nodes': list(injection_nodes),
+                  'nodes': [str(node) for node in nodes],
+                  'timesteps': [int(t) for t in timesteps],
+                  'files': files}
+        labels_file = join(directory, SOURCE_LABELS_FILENAME)
+        with open(temporary_filename(labels_file), 'w') as stream:
+            json.dump(labels, stream)
+        for filename in SOURCE_INDEX_FILENAMES:
+            replace(temporary_filename(join(directory, filename)),
+                    join(directory, filename))
+        dense_file = join(directory, DENSE_SOURCE_INDEX_FILENAME)
+        if exists(dense_file):
+            remove(dense_file)
+        return _open_source_index(injection_nodes, nodes, timesteps,
+                                  directory)
+    return SourceIndex(offsets, injections, values, injection_nodes, nodes,
+                       timesteps)
+
+
+def _open_source_index(injection_nodes, nodes, timesteps, directory):
+    """Open the source index saved in a scenario directory, memory mapped"""
+    return SourceIndex(*[np.load(join(directory, filename), mmap_mode='r',
+                                 allow_pickle=False)
+                         for filename in SOURCE_INDEX_FILENAMES[:3]],
+                       injection_nodes, nodes, timesteps)
+
+
+def load_source_index(pollution, injection_nodes, nodes, timesteps,
+                      directory):
+    """
+    Open the source index saved in a scenario directory, building it first
+    if it is missing or out of date with the scenarios.
+
+    Args:
+        pollution (Mapping): The pollution scenario of each injection node.
+        injection_nodes (list): The injection nodes to index.
+        nodes (list): The node labels in graph order.
+        timesteps (numpy.ndarray): The timesteps of the scenarios.
+        directory (str): The scenario directory.
+
+    Returns:
+        SourceIndex: The index.
+    """
+    try:
+        with open(join(directory, SOURCE_LABELS_FILENAME), 'r') as stream:
+            labels = json.load(stream)
+        if (labels['injection_nodes'] == list(injection_nodes)
+                and labels['nodes'] == [str(node) for node in nodes]
+                and labels['timesteps'] == [int(t) for t in timesteps]
+                and labels['files'] == source_files(directory)):
+            return _open_source_index(injection_nodes, nodes, timesteps,
+                                      directory)
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    return build_source_index(pollution, injection_nodes, nodes, timesteps,
+                              directory)
+
+
+def parse_observations(text):
+    """
+    Parse observed concentrations written as comma separated node=value
+    pairs, such as "J-5=2.5, J-10=0".
+
+    Args:
+        text (str): The observations.
+
+    Returns:
+        dict: The observed concentration at each node.
+    """
+    observations = {}
+    for pair in text.split(','):
+        if not pair.strip():
+            continue
+        node, separator, value = pair.partition('=')
+        if not separator or not node.strip():
+            raise ValueError("Expected node=value, not '" + pair.strip()
+                             + "'")
+        try:
+            observations[node.strip()] = float(value)
+        except ValueError:
+            raise ValueError("Invalid concentration for " + node.strip()
+                             + ": '" + value.strip() + "'")
+    return observations
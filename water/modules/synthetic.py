@@ -0,0 +1,214 @@
+from math import sqrt
+from os import makedirs
+from os.path import join
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import dijkstra, minimum_spanning_tree
+from .load_data import DATA_DIR
+from .simulate import DEFAULT_PARAMETERS, write_scenario
+
+# Distance in metres between neighbouring junctions of the street grid
+SPACING = 100.0
+# Fraction of the streets off the spanning tree that get a pipe, forming
+# loops like a real distribution network
+LOOP_FRACTION = 0.2
+# Number of junctions fed by each reservoir
+RESERVOIR_JUNCTIONS = 5000
+# Pipe diameters in mm
+DIAMETERS = [100, 150, 200, 300]
+# Time in seconds for the pollution concentration to decay by a factor e
+DECAY_TIME = 6 * 3600
+# Multipliers of the base demand over a day, one per hour
+DEMAND_PATTERN = [0.6, 0.5, 0.5, 0.5, 0.6, 0.8, 1.1, 1.4, 1.3, 1.1, 1.0, 1.0,
+                  1.1, 1.0, 0.9, 0.9, 1.0, 1.2, 1.4, 1.4, 1.2, 1.0, 0.8, 0.7]
+# Number of pollution scenarios written by default
+DEFAULT_SCENARIOS = 10
+# Fraction of the junctions, those nearest a reservoir, that scenarios are
+# injected at by default, as pollution spreads furthest from them
+MAINS_FRACTION = 0.01
+
+
+class SyntheticNetwork:
+    """
+    A randomly generated water network with plausible pollution scenarios,
+    for testing the app on networks larger than the examples.
+
+    Junctions sit on a jittered square grid of streets. Pipes follow a
+    random spanning tree of the streets plus LOOP_FRACTION of the others,
+    giving the mix of branches and loops of a real network, and one
+    reservoir is added for every RESERVOIR_JUNCTIONS junctions.
+
+    Pollution scenarios aren't simulated. Water is assumed to flow away
+    from the nearest reservoir along each pipe at a random speed, and
+    pollution is carried downstream from the injection node, decaying as it
+    travels.
+
+    Args:
+        junctions (int): The approximate number of junctions, rounded to a
+            square number.
+        seed (int): The seed of the random generator, the same seed always
+            gives the same network.
+    """
+
+    def __init__(self, junctions, seed=0):
+        rng = np.random.RandomState(seed)
+        side = max(2, int(round(sqrt(junctions))))
+        n_junctions = side * side
+        n_reservoirs = max(1, n_junctions // RESERVOIR_JUNCTIONS)
+        self.junctions = ['J-' + str(i + 1) for i in range(n_junctions)]
+        self.reservoirs = ['R-' + str(i + 1) for i in range(n_reservoirs)]
+        self.nodes = self.junctions + self.reservoirs
+
+        rows, cols = np.divmod(np.arange(n_junctions), side)
+        junction_xy = (np.column_stack([cols, -rows]) * SPACING
+                       + rng.uniform(-0.3, 0.3, (n_junctions, 2)) * SPACING)
+
+        # Streets join each junction to its east and south neighbours
+        grid = np.arange(n_junctions).reshape(side, side)
+        street_starts = np.concatenate([grid[:, :-1].ravel(),
+                                        grid[:-1, :].ravel()])
+        street_ends = np.concatenate([grid[:, 1:].ravel(),
+                                      grid[1:, :].ravel()])
+        weights = rng.uniform(1, 2, len(street_starts))
+        tree = minimum_spanning_tree(coo_matrix(
+            (weights, (street_starts, street_ends)),
+            shape=(n_junctions, n_junctions))).tocsr()
+        in_tree = np.asarray(
+            tree[street_starts, street_ends]).ravel() > 0
+        piped = in_tree | (rng.uniform(size=len(in_tree)) < LOOP_FRACTION)
+
+        # Each reservoir sits next to a junction, joined by a short pipe
+        fed = rng.choice(n_junctions, n_reservoirs, replace=False)
+        reservoir_xy = junction_xy[fed] + SPACING / 2
+        self.coordinates = np.vstack([junction_xy, reservoir_xy])
+        self.starts = np.concatenate(
+            [street_starts[piped], n_junctions + np.arange(n_reservoirs)])
+        self.ends = np.concatenate([street_ends[piped], fed])
+        self.lengths = np.linalg.norm(
+            self.coordinates[self.starts] - self.coordinates[self.ends],
+            axis=1)
+        self.diameters = rng.choice(DIAMETERS, len(self.starts))
+        self.speeds = rng.uniform(0.2, 1.0, len(self.starts))
+
+        # Gentle hills, with reservoirs high enough to supply every junction
+        self.elevations = (10
+                           + 5 * np.sin(junction_xy[:, 0] / 1000)
+                           + 5 * np.cos(junction_xy[:, 1] / 1300)
+                           + rng.uniform(0, 1, n_junctions))
+        self.heads = np.full(n_reservoirs, self.elevations.max() + 40)
+        self.demands = rng.lognormal(np.log(0.2), 0.5, n_junctions)
+
+        # Orient each pipe away from the nearest reservoir
+        n_nodes = len(self.nodes)
+        pipes = coo_matrix((self.lengths, (self.starts, self.ends)),
+                           shape=(n_nodes, n_nodes))
+        supply = dijkstra(pipes, directed=False,
+                          indices=n_junctions + np.arange(n_reservoirs),
+                          min_only=True)
+        # Distance of each junction from the nearest reservoir, along pipes
+        self.supply_distances = supply[:n_junctions]
+        forward = supply[self.starts] <= supply[self.ends]
+        upstream = np.where(forward, self.starts, self.ends)
+        downstream = np.where(forward, self.ends, self.starts)
+        self._flow = coo_matrix((self.lengths / self.speeds,
+                                 (upstream, downstream)),
+                                shape=(n_nodes, n_nodes)).tocsr()
+
+    def inp_text(self):
+        """
+        Produce the network as the text of an EPANET .inp file.
+
+        Returns:
+            str: The contents of the .inp file.
+        """
+        lines = ['[TITLE]', 'Synthetic network of ' + str(len(self.junctions))
+                 + ' junctions', '', '[JUNCTIONS]']
+        lines += [name + '  ' + format(elevation, '.2f') + '  '
+                  + format(demand, '.4f') + '  1'
+                  for name, elevation, demand in zip(
+                      self.junctions, self.elevations, self.demands)]
+        lines += ['', '[RESERVOIRS]']
+        lines += [name + '  ' + format(head, '.2f')
+                  for name, head in zip(self.reservoirs, self.heads)]
+        lines += ['', '[PIPES]']
+        lines += ['P-' + str(i + 1) + '  ' + self.nodes[start] + '  '
+                  + self.nodes[end] + '  ' + format(length, '.1f') + '  '
+                  + str(diameter) + '  100  0  Open'
+                  for i, (start, end, length, diameter) in enumerate(zip(
+                      self.starts, self.ends, self.lengths, self.diameters))]
+        lines += ['', '[PATTERNS]',
+                  '1  ' + '  '.join(str(m) for m in DEMAND_PATTERN),
+                  '', '[TIMES]', 'Duration  24:00', 'Pattern Timestep  1:00',
+                  '', '[OPTIONS]', 'Units  LPS', 'Headloss  H-W', '',
+                  '[COORDINATES]']
+        lines += [name + '  ' + format(x, '.2f') + '  ' + format(y, '.2f')
+                  for name, (x, y) in zip(self.nodes, self.coordinates)]
+        lines += ['', '[END]', '']
+        return '\n'.join(lines)
+
+    def scenario(self, injection, parameters=None, dtype='float64'):
+        """
+        Produce a pollution scenario for an injection node.
+
+        Args:
+            injection (str): The node label of the injection site.
+            parameters (dict): Simulation parameters to override in
+                DEFAULT_PARAMETERS.
+            dtype (str): The data type of the pollution values.
+
+        Returns:
+            pandas.Dataframe: The pollution value at each node for each
+                timestep, in the format load_pollution_dynamics expects.
+        """
+        simulation_parameters = dict(DEFAULT_PARAMETERS)
+        simulation_parameters.update(parameters or {})
+        timesteps = np.arange(0, simulation_parameters['duration'] + 1,
+                              simulation_parameters['timestep'])
+        arrival = dijkstra(self._flow, indices=self.nodes.index(injection))
+        concentration = (simulation_parameters['strength']
+                         * np.exp(-arrival / DECAY_TIME)).astype(dtype)
+        since_injection = timesteps[:, np.newaxis] - arrival
+        polluted = (
+            (since_injection >= simulation_parameters['injection_start'])
+            & (since_injection < simulation_parameters['injection_end']))
+        return pd.DataFrame(np.where(polluted, concentration, 0).astype(dtype),
+                            index=timesteps, columns=self.nodes)
+
+
+def write_synthetic_network(name, junctions, scenarios=DEFAULT_SCENARIOS,
+                            seed=0, data_dir=None, dtype='float64'):
+    """
+    Write a synthetic network, and pollution scenarios for a random choice
+    of its junctions nearest the reservoirs, in the layout of a custom
+    network.
+
+    Args:
+        name (str): The name of the network.
+        junctions (int): The approximate number of junctions.
+        scenarios (int): The number of pollution scenarios.
+        seed (int): The seed of the random generator.
+        data_dir (str): The directory to write the network to, by default
+            DATA_DIR so that the app shows it.
+        dtype (str): The data type of the pollution values.
+
+    Returns:
+        str: The directory of the network files.
+    """
+    if data_dir is None:
+        data_dir = DATA_DIR
+    file_path = join(data_dir, name)
+    makedirs(join(file_path, name), exist_ok=True)
+
+    network = SyntheticNetwork(junctions, seed)
+    with open(join(file_path, name + '.inp'), 'w') as inp_file:
+        inp_file.write(network.inp_text())
+    scenarios = min(scenarios, len(network.junctions))
+    mains = np.argsort(network.supply_distances)[
+        :max(scenarios, int(MAINS_FRACTION * len(network.junctions)))]
+    rng = np.random.RandomState(seed)
+    for junction in rng.choice(mains, scenarios, replace=False):
+        injection = network.junctions[junction]
+        write_scenario(network.scenario(injection, dtype=dtype),
+                       join(file_path, name, injection + '.pkl'))
+    return file_path